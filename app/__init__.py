@@ -2,24 +2,49 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 import os
+from .routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key')
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///task_manager.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///task_manager.db')
+    app.config['DATABASE_REPLICA_URL'] = os.environ.get('DATABASE_REPLICA_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-    db.init_app(app)
+    # Любой ключ конфигурации можно задать переменной окружения FLASK_<ключ>,
+    # например FLASK_SQLITE_BUSY_TIMEOUT=10000 или FLASK_DB_POOL_SIZE=20.
+    app.config.from_prefixed_env()
+    if test_config:
+        app.config.update(test_config)
+
+    from .database import init_database
+    init_database(app)
+    from .sql_profiling import init_sql_profiling
+    init_sql_profiling(app)
+    from .cache import init_cache
+    init_cache(app)
+    from .passwords import init_passwords
+    init_passwords(app)
+    from .metrics import init_metrics
+    init_metrics(app)
+    from .profiler import init_profiler
+    init_profiler(app)
+    from .events import init_events
+    init_events(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
 
-    from .models import User
+    from . import versioning  # обработчики событий сессии для version/updated_at
+    from . import counters  # обработчики событий сессии для счётчиков задач
+    from . import project_stats  # обработчики событий сессии для статистики проектов
+    from . import search  # полнотекстовый индекс создаётся вместе с таблицами
+    from . import sync  # обработчики событий сессии для записей об удалениях
+    from .cache import load_user
     @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    def load_user_by_id(user_id):
+        return load_user(int(user_id))
 
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint)
@@ -30,4 +55,7 @@ def create_app():
     from .api import api as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix='/api')
 
+    from .cli import register_commands
+    register_commands(app)
+
     return app
\ No newline at end of file
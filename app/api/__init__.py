@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from app.api import projects, tasks
\ No newline at end of file
+from app.api import auth, events, projects, stats, tasks
\ No newline at end of file
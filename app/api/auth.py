@@ -0,0 +1,11 @@
+from flask import jsonify
+from flask_login import login_required, current_user
+from app.passwords import get_password_hasher
+from . import api
+
+@api.route('/auth/stats', methods=['GET'])
+@login_required
+def password_hashing_stats():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(get_password_hasher().stats())
@@ -0,0 +1,47 @@
+import hashlib
+from datetime import date, datetime, timezone
+
+from flask import Response, request
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:32]
+
+
+def _http_date(value):
+    # updated_at хранится в локальном времени, как и created_at. HTTP-дата
+    # точна до секунды, поэтому для ещё не закончившейся секунды её нет:
+    # запись в ту же секунду дала бы 304 по If-Modified-Since на устаревшую
+    # копию. Такие ответы проверяются только по ETag.
+    if value is None or value.replace(microsecond=0) >= datetime.now().replace(microsecond=0):
+        return None
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def task_representation_key():
+    # Всё, от чего зависит тело ответа, кроме самих данных: выбор полей,
+    # параметры списка и текущая дата (от неё зависит is_overdue).
+    return tuple(sorted(request.args.items(multi=True))), date.today().isoformat()
+
+
+def not_modified(etag, last_modified=None):
+    # 304 до сериализации, если клиентская копия актуальна.
+    http_date = _http_date(last_modified)
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif http_date is not None and request.if_modified_since is not None:
+        matched = http_date <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    http_date = _http_date(last_modified)
+    if http_date is not None:
+        response.last_modified = http_date
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,18 @@
+from flask import Response, jsonify, request, stream_with_context
+from flask_login import login_required, current_user
+from app.events import event_stream
+from . import api
+
+@api.route('/tasks/events', methods=['GET'])
+@login_required
+def task_events():
+    # Браузерный EventSource при переподключении сам присылает Last-Event-ID.
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    stream = event_stream(current_user.id, current_user.is_admin(), last_event_id)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
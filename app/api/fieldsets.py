@@ -0,0 +1,23 @@
+from flask import request
+
+
+class FieldsetError(ValueError):
+    pass
+
+
+def _parse_list(name, allowed):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    items = tuple(v.strip() for v in value.split(',') if v.strip())
+    unknown = [v for v in items if v not in allowed]
+    if unknown:
+        raise FieldsetError(f'Unknown {name}: {", ".join(unknown)}. Use: {", ".join(allowed)}')
+    return items
+
+
+def parse_fieldset(model):
+    # ?fields=id,title — какие скалярные поля отдавать (по умолчанию все);
+    # ?include=subtasks — какие связанные данные подгружать (по умолчанию все,
+    # пустой include= отключает их вместе с запросами к связанным таблицам).
+    return _parse_list('fields', model.FIELDS), _parse_list('include', model.INCLUDES)
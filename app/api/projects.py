@@ -1,19 +1,51 @@
 from flask import jsonify, request
 from flask_login import login_required, current_user
+from sqlalchemy import func
 from app.models import Project, db
+from app.pagination import DEFAULT_PAGE_SIZE, PaginationError, paginate, next_page_url
 from . import api
+from .conditional import make_etag, not_modified, set_validators, task_representation_key
+from .fieldsets import FieldsetError, parse_fieldset
 
 @api.route('/projects', methods=['GET'])
 @login_required
 def get_projects():
-    projects = Project.query.all()
-    return jsonify([p.to_dict() for p in projects])
+    try:
+        fields, include = parse_fieldset(Project)
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+
+    max_version, count = db.session.query(func.max(Project.version), func.count(Project.id)).one()
+    # Дата входит в ключ: от неё зависит число просроченных задач в stats.
+    etag = make_etag('projects', max_version, count, task_representation_key())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        projects, next_cursor = paginate(Project.query, Project, Project.SORT_KEYS, request.args,
+                                         default_limit=DEFAULT_PAGE_SIZE)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(Project.to_dict_list(projects, fields, include))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{next_page_url(next_cursor)}>; rel="next"'
+    return set_validators(response, etag)
 
 @api.route('/projects/<int:id>', methods=['GET'])
 @login_required
 def get_project(id):
     project = Project.query.get_or_404(id)
-    return jsonify(project.to_dict())
+    try:
+        fields, include = parse_fieldset(Project)
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = make_etag('project', project.id, project.version, task_representation_key())
+    cached = not_modified(etag, project.updated_at)
+    if cached:
+        return cached
+    return set_validators(jsonify(project.to_dict(fields, include)), etag, project.updated_at)
 
 @api.route('/projects', methods=['POST'])
 @login_required
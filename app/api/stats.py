@@ -0,0 +1,12 @@
+from flask import jsonify
+from flask_login import login_required, current_user
+from app.stats import task_stats
+from . import api
+from .conditional import make_etag, not_modified, set_validators
+
+@api.route('/stats', methods=['GET'])
+@login_required
+def get_stats():
+    stats = task_stats(current_user)
+    etag = make_etag('stats', current_user.id, repr(stats))
+    return not_modified(etag) or set_validators(jsonify(stats), etag)
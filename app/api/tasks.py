@@ -1,30 +1,127 @@
-from flask import jsonify, request
+from flask import Response, jsonify, request, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, date
-from app.models import Task, User, Project, Comment, Subtask, db
+from sqlalchemy import delete, func, insert, select, update
+from app.cache import get_task_list_cache, mark_users_changed
+from app.models import Task, User, Project, Comment, Subtask, chunked, db, task_assignees
+from app.export import EXPORT_FORMATS, export_stream
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate, next_page_url, parse_limit
+from app.events import record_task_events
+from app.project_stats import apply_delta, task_state_counts
+from app.search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, search_tasks
+from app.sync import ResyncRequired, record_revocations, task_changes
+from app.versioning import next_revision
 from . import api
+from .conditional import make_etag, not_modified, set_validators, task_representation_key
+from .fieldsets import FieldsetError, parse_fieldset
+
+def task_filters_from_args(args):
+    project_id = args.get('project_id')
+    if project_id is not None:
+        try:
+            project_id = int(project_id)
+        except ValueError:
+            raise ValueError('Invalid project_id')
+    return {
+        'status': args.get('status'),
+        'overdue': str(args.get('overdue')).lower() == 'true',
+        'due_today': str(args.get('due_today')).lower() == 'true',
+        'project_id': project_id
+    }
 
 @api.route('/tasks', methods=['GET'])
 @login_required
 def get_tasks():
-    query = Task.query.filter(
-        (Task.user_id == current_user.id) | (Task.assignees.contains(current_user))
-    )
-
-    status = request.args.get('status')
-    if status in ['todo', 'in_progress', 'review', 'done']:
-        query = query.filter(Task.status == status)
-
-    overdue = request.args.get('overdue')
-    if overdue == 'true':
-        query = query.filter(Task.deadline < date.today(), Task.completed_at.is_(None))
-
-    due_today = request.args.get('due_today')
-    if due_today == 'true':
-        query = query.filter(Task.deadline == date.today(), Task.completed_at.is_(None))
-
-    tasks = query.all()
-    return jsonify([t.to_dict() for t in tasks])
+    cache = get_task_list_cache()
+    cache_key = cache.make_key('api', current_user.id, request.args) if cache else None
+    cached = cache.get(cache_key) if cache else None
+    if cached:
+        etag, payload, next_cursor = cached
+        return not_modified(etag) or task_list_response(etag, payload, next_cursor)
+
+    query = Task.query.filter(Task.visible_to_filter(current_user))
+    try:
+        query = Task.apply_filters(query, **task_filters_from_args(request.args))
+        fields, include = parse_fieldset(Task)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Валидатор списка считается агрегатом без загрузки строк: version берётся
+    # из глобального счётчика ревизий, поэтому любое изменение задачи из
+    # выборки увеличивает max(version), а удаление уменьшает count.
+    max_version, count = query.with_entities(func.max(Task.version), func.count(Task.id)).one()
+    etag = make_etag('tasks', current_user.id, max_version, count, task_representation_key())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        tasks, next_cursor = paginate(query, Task, Task.SORT_KEYS, request.args,
+                                      default_limit=DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    payload = Task.to_dict_list(tasks, fields, include)
+    if cache:
+        cache.set(cache_key, (etag, payload, next_cursor))
+    return task_list_response(etag, payload, next_cursor)
+
+def task_list_response(etag, payload, next_cursor):
+    response = jsonify(payload)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{next_page_url(next_cursor)}>; rel="next"'
+    return set_validators(response, etag)
+
+@api.route('/tasks/export', methods=['GET'])
+@login_required
+def export_tasks():
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Invalid format. Use one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    query = Task.query.filter(Task.visible_to_filter(current_user))
+    try:
+        query = Task.apply_filters(query, **task_filters_from_args(request.args))
+        fields, include = parse_fieldset(Task)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    mimetype, chunks = export_stream(query, export_format, fields, include)
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=tasks.{export_format}'
+    return response
+
+@api.route('/tasks/search', methods=['GET'])
+@login_required
+def find_tasks():
+    query = Task.query.filter(Task.visible_to_filter(current_user))
+    try:
+        fields, include = parse_fieldset(Task)
+        limit = min(parse_limit(request.args.get('limit'), DEFAULT_SEARCH_LIMIT), MAX_SEARCH_LIMIT)
+        results = search_tasks(query, request.args.get('q', ''), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    payload = Task.to_dict_list([task for task, _ in results], fields, include)
+    for item, (_, snippet) in zip(payload, results):
+        item['snippet'] = snippet
+    return jsonify(payload)
+
+@api.route('/tasks/changes', methods=['GET'])
+@login_required
+def get_task_changes():
+    try:
+        fields, include = parse_fieldset(Task)
+        limit = parse_limit(request.args.get('limit'), MAX_PAGE_SIZE)
+        tasks, deleted, token, has_more = task_changes(current_user, request.args.get('since'), limit)
+    except ResyncRequired:
+        return jsonify({'error': 'Full resync required', 'full_resync': True}), 410
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'tasks': Task.to_dict_list(tasks, fields, include),
+        'deleted': deleted,
+        'token': token,
+        'has_more': has_more
+    })
 
 @api.route('/tasks/<int:id>', methods=['GET'])
 @login_required
@@ -32,25 +129,44 @@ def get_task(id):
     task = Task.query.get_or_404(id)
     if not task.is_visible_to(current_user):
         return jsonify({'error': 'Access denied'}), 403
-    return jsonify(task.to_dict())
-
-@api.route('/tasks', methods=['POST'])
-@login_required
-def create_task():
-    data = request.get_json() or {}
-    title = data.get('title', '').strip()
+    try:
+        fields, include = parse_fieldset(Task)
+    except FieldsetError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = make_etag('task', task.id, task.version, task_representation_key())
+    cached = not_modified(etag, task.updated_at)
+    if cached:
+        return cached
+    return set_validators(jsonify(task.to_dict(fields, include)), etag, task.updated_at)
+
+BULK_MAX_TASKS = 10000
+BULK_BATCH_SIZE = 500
+
+def parse_ids(values):
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+def parse_task_payload(data):
+    # Проверки без обращения к БД; project_id и assignee_ids разрешаются
+    # вызывающим кодом, чтобы массовое создание делало это одним запросом.
+    if not isinstance(data, dict):
+        return None, 'Task must be an object'
+    title = data.get('title', '')
+    description = data.get('description', '')
+    if not isinstance(title, str) or not isinstance(description or '', str):
+        return None, 'Title and description must be strings'
+    title = title.strip()
     if not title:
-        return jsonify({'error': 'Title is required'}), 400
+        return None, 'Title is required'
     if len(title) > 200:
-        return jsonify({'error': 'Title too long (max 200 characters)'}), 400
-    if len(data.get('description', '')) > 2000:
-        return jsonify({'error': 'Description too long (max 2000 characters)'}), 400
-
-    project_id = data.get('project_id')
-    if project_id is not None:
-        project = Project.query.get(project_id)
-        if not project:
-            return jsonify({'error': 'Invalid project_id'}), 400
+        return None, 'Title too long (max 200 characters)'
+    if len(description or '') > 2000:
+        return None, 'Description too long (max 2000 characters)'
 
     priority = data.get('priority', 2)
     if priority not in [1, 2, 3, 4]:
@@ -60,41 +176,127 @@ def create_task():
     if data.get('deadline'):
         try:
             deadline = datetime.strptime(data['deadline'], '%Y-%m-%d').date()
-        except ValueError:
-            return jsonify({'error': 'Invalid deadline format. Use YYYY-MM-DD'}), 400
+        except (TypeError, ValueError):
+            return None, 'Invalid deadline format. Use YYYY-MM-DD'
 
+    project_id = data.get('project_id')
+    if project_id is not None:
+        try:
+            project_id = int(project_id)
+        except (TypeError, ValueError):
+            return None, 'Invalid project_id'
+
+    assignee_ids = data.get('assignee_ids') or []
+    if not isinstance(assignee_ids, list):
+        return None, 'assignee_ids must be a list'
+    assignee_ids = parse_ids(assignee_ids)
+
+    subtasks = []
+    for sub in data.get('subtasks') or []:
+        if isinstance(sub, dict) and isinstance(sub.get('title'), str):
+            sub_title = sub['title'].strip()
+            if sub_title:
+                subtasks.append((sub_title, bool(sub.get('completed', False))))
+
+    return {
+        'title': title,
+        'description': (description or '').strip(),
+        'project_id': project_id,
+        'status': data.get('status', 'todo'),
+        'priority': priority,
+        'deadline': deadline,
+        'assignee_ids': assignee_ids,
+        'subtasks': subtasks
+    }, None
+
+def build_task(values, assignees):
     task = Task(
-        title=title,
-        description=data.get('description', '').strip(),
+        title=values['title'],
+        description=values['description'],
         user_id=current_user.id,
-        project_id=project_id,
-        status=data.get('status', 'todo'),
-        priority=priority,
-        deadline=deadline
+        project_id=values['project_id'],
+        status=values['status'],
+        priority=values['priority'],
+        deadline=values['deadline']
     )
-    db.session.add(task)
-    db.session.flush()
+    task.assignees = [
+        assignees[aid] for aid in dict.fromkeys(values['assignee_ids'])
+        if aid in assignees and current_user.can_assign_to(assignees[aid])
+    ]
+    task.subtasks = [Subtask(title=title, completed=completed) for title, completed in values['subtasks']]
+    return task
+
+def existing_project_ids(ids):
+    ids = list(set(ids))
+    found = set()
+    for chunk in chunked(ids):
+        found.update(db.session.scalars(select(Project.id).where(Project.id.in_(chunk))))
+    return found
 
-    assignee_ids = data.get('assignee_ids', [])
-    if assignee_ids:
-        assignees = []
-        for aid in assignee_ids:
-            user = User.query.get(aid)
-            if user and current_user.can_assign_to(user):
-                assignees.append(user)
-        task.assignees.extend(assignees)
-
-    subtasks_data = data.get('subtasks', [])
-    for sub in subtasks_data:
-        if isinstance(sub, dict) and 'title' in sub:
-            title = sub['title'].strip()
-            if title:
-                st = Subtask(title=title, completed=sub.get('completed', False))
-                task.subtasks.append(st)
+@api.route('/tasks', methods=['POST'])
+@login_required
+def create_task():
+    values, error = parse_task_payload(request.get_json() or {})
+    if error:
+        return jsonify({'error': error}), 400
 
+    project_id = values['project_id']
+    if project_id is not None and project_id not in existing_project_ids([project_id]):
+        return jsonify({'error': 'Invalid project_id'}), 400
+
+    task = build_task(values, User.load_many(values['assignee_ids']))
+    db.session.add(task)
     db.session.commit()
     return jsonify(task.to_dict()), 201
 
+@api.route('/tasks/bulk', methods=['POST'])
+@login_required
+def bulk_create_tasks():
+    data = request.get_json(silent=True)
+    items = data.get('tasks') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'tasks must be a non-empty list'}), 400
+    if len(items) > BULK_MAX_TASKS:
+        return jsonify({'error': f'Too many tasks (max {BULK_MAX_TASKS})'}), 400
+
+    results = []
+    parsed = []
+    for index, item in enumerate(items):
+        values, error = parse_task_payload(item)
+        results.append({'index': index, 'error': error} if error else {'index': index})
+        parsed.append(values)
+
+    valid = [v for v in parsed if v is not None]
+    projects = existing_project_ids(v['project_id'] for v in valid if v['project_id'] is not None)
+    users = User.load_many(aid for v in valid for aid in v['assignee_ids'])
+
+    pending = []
+    for result, values in zip(results, parsed):
+        if values is None:
+            continue
+        if values['project_id'] is not None and values['project_id'] not in projects:
+            result['error'] = 'Invalid project_id'
+            continue
+        pending.append((result, values))
+
+    # Задачи собираются и вставляются пачками внутри одной транзакции.
+    for i in range(0, len(pending), BULK_BATCH_SIZE):
+        batch = [(result, build_task(values, users)) for result, values in pending[i:i + BULK_BATCH_SIZE]]
+        db.session.add_all(task for _, task in batch)
+        db.session.flush()
+        for result, task in batch:
+            result['id'] = task.id
+    db.session.commit()
+
+    failed = len(results) - len(pending)
+    if not pending:
+        status = 400
+    elif failed:
+        status = 207
+    else:
+        status = 201
+    return jsonify({'created': len(pending), 'failed': failed, 'results': results}), status
+
 @api.route('/tasks/<int:id>', methods=['PUT'])
 @login_required
 def update_task(id):
@@ -143,15 +345,169 @@ def update_task(id):
 
     assignee_ids = data.get('assignee_ids', [])
     if isinstance(assignee_ids, list):
-        task.assignees.clear()
-        for aid in assignee_ids:
-            user = User.query.get(aid)
-            if user and current_user.can_assign_to(user):
-                task.assignees.append(user)
+        users = User.load_many(parse_ids(assignee_ids))
+        task.assignees = [u for u in users.values() if current_user.can_assign_to(u)]
 
     db.session.commit()
     return jsonify(task.to_dict()), 200
 
+def parse_bulk_changes(data):
+    if not isinstance(data, dict) or not data:
+        return None, 'changes must be a non-empty object'
+    unknown = set(data) - {'status', 'priority', 'project_id', 'deadline',
+                           'add_assignee_ids', 'remove_assignee_ids'}
+    if unknown:
+        return None, f'Unknown changes: {", ".join(sorted(unknown))}'
+
+    values = {}
+    if 'status' in data:
+        if data['status'] not in Task.STATUSES:
+            return None, 'Invalid status'
+        values['status'] = data['status']
+    if 'priority' in data:
+        if data['priority'] not in [1, 2, 3, 4]:
+            return None, 'Invalid priority'
+        values['priority'] = data['priority']
+    if 'project_id' in data:
+        project_id = data['project_id']
+        if project_id in (None, 0):
+            values['project_id'] = None
+        else:
+            try:
+                project_id = int(project_id)
+            except (TypeError, ValueError):
+                return None, 'Invalid project_id'
+            if project_id not in existing_project_ids([project_id]):
+                return None, 'Invalid project_id'
+            values['project_id'] = project_id
+    if 'deadline' in data:
+        if data['deadline'] is None:
+            values['deadline'] = None
+        else:
+            try:
+                values['deadline'] = datetime.strptime(data['deadline'], '%Y-%m-%d').date()
+            except (TypeError, ValueError):
+                return None, 'Invalid deadline format. Use YYYY-MM-DD'
+
+    for key in ('add_assignee_ids', 'remove_assignee_ids'):
+        if not isinstance(data.get(key, []), list):
+            return None, f'{key} must be a list'
+    return values, None
+
+@api.route('/tasks/bulk', methods=['PATCH'])
+@login_required
+def bulk_update_tasks():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    changes = data.get('changes')
+    values, error = parse_bulk_changes(changes)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # Кандидаты: явный список id или фильтр по видимым задачам, как в get_tasks.
+    skipped = []
+    if 'ids' in data:
+        if not isinstance(data['ids'], list) or not data['ids']:
+            return jsonify({'error': 'ids must be a non-empty list'}), 400
+        requested = []
+        for value in data['ids']:
+            try:
+                requested.append(int(value))
+            except (TypeError, ValueError):
+                skipped.append({'id': value, 'reason': 'invalid_id'})
+        requested = list(dict.fromkeys(requested))
+        if len(requested) > BULK_MAX_TASKS:
+            return jsonify({'error': f'Too many tasks (max {BULK_MAX_TASKS})'}), 400
+        owners = {}
+        for chunk in chunked(requested):
+            owners.update(db.session.execute(
+                select(Task.id, Task.user_id).where(Task.id.in_(chunk))
+            ).all())
+    elif isinstance(data.get('filter'), dict):
+        requested = None
+        query = Task.query.filter(Task.visible_to_filter(current_user))
+        try:
+            query = Task.apply_filters(query, **task_filters_from_args(data['filter']))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        owners = dict(
+            query.with_entities(Task.id, Task.user_id).order_by(Task.id).limit(BULK_MAX_TASKS + 1).all()
+        )
+        if len(owners) > BULK_MAX_TASKS:
+            return jsonify({'error': f'Too many tasks (max {BULK_MAX_TASKS})'}), 400
+    else:
+        return jsonify({'error': 'ids or filter is required'}), 400
+
+    # Те же права, что и у PUT /api/tasks/<id>: менять задачу может только автор.
+    for task_id in (requested if requested is not None else owners):
+        if task_id not in owners:
+            skipped.append({'id': task_id, 'reason': 'not_found'})
+        elif owners[task_id] != current_user.id:
+            skipped.append({'id': task_id, 'reason': 'access_denied'})
+    ids = [task_id for task_id, owner in owners.items() if owner == current_user.id]
+
+    # Массовые изменения идут мимо событий сессии: списки задач сбрасываются
+    # явно для автора и всех исполнителей до и после изменения.
+    affected_users = {current_user.id}
+    for chunk in chunked(ids):
+        affected_users.update(db.session.scalars(
+            select(task_assignees.c.user_id).where(task_assignees.c.task_id.in_(chunk))
+        ))
+
+    add_ids = parse_ids(changes.get('add_assignee_ids', []))
+    remove_ids = parse_ids(changes.get('remove_assignee_ids', []))
+    users = User.load_many(add_ids)
+    allowed = [u.id for u in users.values() if current_user.can_assign_to(u)]
+    rejected_assignees = sorted(set(add_ids) - set(allowed))
+
+    if values.get('status') == 'done':
+        values['completed_at'] = func.coalesce(Task.completed_at, datetime.now())
+    # Массовые UPDATE идут мимо событий сессии, поэтому версия и статистика
+    # проектов обновляются явно.
+    if ids:
+        revision = values['version'] = next_revision(db.session.connection())
+        values['updated_at'] = datetime.now()
+        stats_before = task_state_counts(db.session.connection(), ids)
+
+    for chunk in chunked(ids):
+        db.session.execute(
+            update(Task).where(Task.id.in_(chunk)).values(**values),
+            execution_options={'synchronize_session': False}
+        )
+        if remove_ids:
+            revoked = {}
+            for task_id, user_id in db.session.execute(
+                    select(task_assignees.c.task_id, task_assignees.c.user_id)
+                    .where(task_assignees.c.task_id.in_(chunk), task_assignees.c.user_id.in_(remove_ids),
+                           task_assignees.c.user_id != current_user.id)):
+                revoked.setdefault(task_id, set()).add(user_id)
+            record_revocations(db.session.connection(), revoked, revision)
+            db.session.execute(
+                delete(task_assignees)
+                .where(task_assignees.c.task_id.in_(chunk), task_assignees.c.user_id.in_(remove_ids))
+            )
+        if allowed:
+            existing = set(db.session.execute(
+                select(task_assignees.c.task_id, task_assignees.c.user_id)
+                .where(task_assignees.c.task_id.in_(chunk), task_assignees.c.user_id.in_(allowed))
+            ).all())
+            rows = [{'task_id': t, 'user_id': u} for t in chunk for u in allowed if (t, u) not in existing]
+            if rows:
+                db.session.execute(insert(task_assignees), rows)
+    if ids:
+        apply_delta(db.session.connection(), stats_before, task_state_counts(db.session.connection(), ids))
+        record_task_events(db.session.connection(), ids,
+                           'status_changed' if 'status' in values else 'updated')
+        mark_users_changed(db.session, affected_users | set(allowed))
+    db.session.commit()
+
+    return jsonify({
+        'updated': ids,
+        'skipped': skipped,
+        'rejected_assignee_ids': rejected_assignees
+    }), 200
+
 @api.route('/tasks/<int:id>', methods=['DELETE'])
 @login_required
 def delete_task(id):
@@ -251,3 +607,11 @@ def delete_subtask(id):
     db.session.delete(subtask)
     db.session.commit()
     return jsonify({'message': 'Subtask deleted'}), 200
+
+@api.route('/cache/stats', methods=['GET'])
+@login_required
+def cache_stats():
+    if not current_user.is_admin():
+        return jsonify({'error': 'Access denied'}), 403
+    cache = get_task_list_cache()
+    return jsonify(cache.stats() if cache else {'enabled': False})
@@ -1,6 +1,10 @@
+import time
+
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user
 from .models import User, db
+from .metrics import observe_login
+from .passwords import PasswordHasherBusy, get_password_hasher
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, EqualTo, ValidationError
@@ -23,12 +27,40 @@ class RegistrationForm(FlaskForm):
         if user:
             raise ValidationError('Пользователь с таким именем уже существует.')
 
+def busy_response(template, form):
+    # Очередь хэширования переполнена: отвечаем сразу, не дожидаясь пула.
+    flash('Сервер перегружен, повторите попытку через несколько секунд')
+    return render_template(template, form=form), 503, {'Retry-After': '1'}
+
+def check_credentials(username, password):
+    user = User.query.filter_by(username=username).first()
+    if not user or not user.check_password(password):
+        return None
+    # Хэш, посчитанный со старыми параметрами, заменяется при входе:
+    # только сейчас известен пароль в открытом виде.
+    if user.password_needs_rehash():
+        try:
+            user.set_password(password)
+            db.session.commit()
+        except PasswordHasherBusy:
+            pass
+    return user
+
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user and user.check_password(form.password.data):
+        hasher = get_password_hasher()
+        started = time.perf_counter()
+        try:
+            user = check_credentials(form.username.data, form.password.data)
+        except PasswordHasherBusy:
+            return busy_response('login.html', form)
+        finally:
+            elapsed = time.perf_counter() - started
+            hasher.record_login(elapsed)
+            observe_login(elapsed)
+        if user:
             login_user(user, remember=True)
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
@@ -47,7 +79,10 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy:
+            return busy_response('register.html', form)
         db.session.add(user)
         db.session.commit()
         flash('Регистрация прошла успешно!')
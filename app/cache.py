@@ -0,0 +1,311 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from app.models import Task, User, db
+from app.routing import used_replica
+from app.versioning import pending_changes
+
+
+class LocalCacheBackend:
+    # LRU в памяти процесса с TTL. Общий бэкенд (Redis и т.п.) должен
+    # реализовать те же get/set/incr/counter поверх общего хранилища.
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        # Счётчики поколений живут отдельно от LRU: их вытеснение вернуло бы
+        # старое поколение и вместе с ним устаревшие записи.
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileGenerationBackend(LocalCacheBackend):
+    # Записи живут в памяти процесса, а счётчики поколений — файлы в общей
+    # папке, как версия кэша пользователей: поколение — (inode, mtime) файла,
+    # поэтому запись в одном процессе сбрасывает списки во всех остальных
+    # ценой одного stat() на запрос.
+    def __init__(self, directory, max_entries=1024):
+        super().__init__(max_entries)
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(':', '-'))
+
+    def counter(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return 0
+        return f'{st.st_ino}.{st.st_mtime_ns}'
+
+    def incr(self, key):
+        path = self._path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, path)
+        return self.counter(key)
+
+
+class TaskListCache:
+    # Ключ записи включает поколение пользователя; инвалидация просто
+    # увеличивает поколение, и старые записи вытесняются LRU/TTL.
+    # Поколение читается до запроса к БД, поэтому ответ, собранный
+    # параллельно с записью, попадает под старый ключ и не будет прочитан.
+    ALL_USERS = 'all'
+
+    def __init__(self, backend=None, ttl=30):
+        self.backend = backend if backend is not None else LocalCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, scope, user_id, args):
+        # user_id=None — выборка по всем задачам (админский список).
+        owner = self.ALL_USERS if user_id is None else user_id
+        generation = self.backend.counter(f'gen:{owner}')
+        normalized = sorted(args.items(multi=True))
+        digest = hashlib.sha1(repr((normalized, date.today().isoformat())).encode()).hexdigest()
+        return f'tasks:{scope}:{owner}:{generation}:{digest}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        # Поколение уже увеличено коммитом записи, а реплика может её ещё не
+        # содержать: ответ по реплике под новым ключом жил бы весь TTL.
+        if has_app_context() and used_replica(db.session):
+            return
+        self.backend.set(key, value, self.ttl)
+
+    def invalidate_users(self, user_ids):
+        for user_id in set(user_ids):
+            self.backend.incr(f'gen:{user_id}')
+        self.backend.incr(f'gen:{self.ALL_USERS}')
+        self.invalidations += 1
+
+    def stats(self):
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'ttl': self.ttl
+        }
+        if isinstance(self.backend, LocalCacheBackend):
+            stats['entries'] = len(self.backend)
+            stats['evictions'] = self.backend.evictions
+        return stats
+
+
+def get_task_list_cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('task_list_cache')
+
+
+def task_audience(task):
+    # Пользователи, в чьих списках задача была или окажется после изменения.
+    users = {task.user_id}
+    history = inspect(task).attrs.assignees.history
+    users.update(u.id for u in history.deleted or ())
+    users.update(u.id for u in task.assignees)
+    return users
+
+
+def mark_users_changed(session, user_ids):
+    session.info.setdefault('task_list_changed_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_changed_users(session, flush_context, instances):
+    users = set()
+    for obj in pending_changes(session):
+        if isinstance(obj, Task):
+            users.update(task_audience(obj))
+    if users:
+        mark_users_changed(session, users)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_task_lists(session):
+    users = session.info.pop('task_list_changed_users', None)
+    cache = get_task_list_cache()
+    if users and cache is not None:
+        cache.invalidate_users(users)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_users(session):
+    session.info.pop('task_list_changed_users', None)
+
+
+class UserCache:
+    # Кэш пользователей для user_loader. Записи — отсоединённые копии User,
+    # которые подключаются к сессии запроса через merge(load=False) без SQL.
+    # Между процессами кэш согласуется через файл версии: перед чтением
+    # сравнивается (inode, mtime) файла, и если другой процесс его
+    # перезаписал, локальные записи сбрасываются. Это один stat() на запрос.
+    def __init__(self, version_file, backend=None, ttl=60):
+        self.version_file = version_file
+        self.backend = backend if backend is not None else LocalCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._seen_version = self._version()
+
+    def _version(self):
+        try:
+            st = os.stat(self.version_file)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _check_version(self):
+        version = self._version()
+        if version != self._seen_version:
+            self.backend.clear()
+            self._seen_version = version
+
+    def get(self, user_id):
+        self._check_version()
+        user = self.backend.get(user_id)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def set(self, user):
+        values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        copy = User(**values)
+        make_transient_to_detached(copy)
+        self.backend.set(user.id, copy, self.ttl)
+
+    def invalidate(self):
+        # os.replace даёт файлу новый inode, поэтому смену версии видно
+        # даже при грубом разрешении mtime.
+        tmp_path = f'{self.version_file}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, self.version_file)
+        self.backend.clear()
+        self._seen_version = self._version()
+
+
+def get_user_cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('user_cache')
+
+
+def load_user(user_id):
+    cache = get_user_cache()
+    if cache is None:
+        return db.session.get(User, user_id)
+    user = cache.get(user_id)
+    if user is not None:
+        return db.session.merge(user, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        cache.set(user)
+    return user
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_changed_user_accounts(session, flush_context, instances):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and (obj in session.deleted or session.is_modified(obj)):
+            session.info['user_accounts_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_user_cache(session):
+    cache = get_user_cache()
+    if session.info.pop('user_accounts_changed', False) and cache is not None:
+        cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changed_user_accounts(session):
+    session.info.pop('user_accounts_changed', None)
+
+
+def default_user_cache_version_file(app):
+    # Файл версии общий для всех процессов, работающих с одной базой.
+    digest = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'task-manager-users-{digest}.version')
+
+
+def default_task_list_cache_dir(app):
+    digest = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'task-manager-task-lists-{digest}')
+
+
+def init_cache(app):
+    if app.config.get('TASK_LIST_CACHE_ENABLED', True):
+        backend = app.config.get('TASK_LIST_CACHE_BACKEND') or FileGenerationBackend(
+            app.config.get('TASK_LIST_CACHE_DIR') or default_task_list_cache_dir(app),
+            max_entries=app.config.get('TASK_LIST_CACHE_SIZE', 1024)
+        )
+        app.extensions['task_list_cache'] = TaskListCache(
+            backend, ttl=app.config.get('TASK_LIST_CACHE_TTL', 30)
+        )
+    if app.config.get('USER_CACHE_ENABLED', True):
+        app.extensions['user_cache'] = UserCache(
+            app.config.get('USER_CACHE_VERSION_FILE') or default_user_cache_version_file(app),
+            LocalCacheBackend(max_entries=app.config.get('USER_CACHE_SIZE', 1024)),
+            ttl=app.config.get('USER_CACHE_TTL', 60)
+        )
@@ -0,0 +1,115 @@
+import sys
+
+import click
+
+from app import db, migrations, search
+from app.counters import repair_counters
+from app.export import EXPORT_FORMATS, export_stream
+from app.project_stats import rebuild_project_stats
+from app.models import Task, User
+
+
+@click.command('export-tasks')
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='ndjson')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, allow_dash=True), default='-',
+              help='Файл для выгрузки (по умолчанию stdout).')
+@click.option('--user', 'username', help='Выгружать только задачи, видимые этому пользователю.')
+@click.option('--status', type=click.Choice(Task.STATUSES))
+@click.option('--overdue', is_flag=True)
+@click.option('--due-today', is_flag=True)
+@click.option('--project-id', type=int)
+def export_tasks_command(export_format, output, username, status, overdue, due_today, project_id):
+    """Потоковая выгрузка задач в NDJSON или CSV."""
+    query = Task.query
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter(f'пользователь {username} не найден', param_hint='--user')
+        query = query.filter(Task.visible_to_filter(user))
+    query = Task.apply_filters(query, status=status, overdue=overdue,
+                               due_today=due_today, project_id=project_id)
+
+    _, chunks = export_stream(query, export_format)
+    with click.open_file(output, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    # В stdout идут только данные, иначе сообщение попало бы в выгрузку.
+    if output != '-':
+        click.echo(f'Выгрузка завершена: {output}', err=True)
+
+
+@click.command('db-upgrade')
+def db_upgrade_command():
+    """Создать базу или обновить её схему до последней версии."""
+    applied = migrations.upgrade()
+    for number, description in applied:
+        click.echo(f'{number:03d} {description}')
+    click.echo(f'Схема базы данных: версия {migrations.HEAD}')
+
+
+@click.command('repair-counters')
+def repair_counters_command():
+    """Пересчитать счётчики комментариев и подзадач у всех задач."""
+    with db.engine.begin() as conn:
+        repaired = repair_counters(conn)
+    click.echo(f'Исправлено задач: {repaired}')
+
+
+@click.command('rebuild-search')
+def rebuild_search_command():
+    """Перестроить полнотекстовый индекс задач и комментариев."""
+    with db.engine.begin() as conn:
+        if not search.fts_available(conn):
+            raise click.ClickException('Полнотекстовый индекс доступен только для SQLite')
+        indexed = search.rebuild(conn)
+    click.echo(f'Проиндексировано задач: {indexed}')
+
+
+@click.command('reconcile-project-stats')
+def reconcile_project_stats_command():
+    """Пересчитать статистику проектов с нуля и показать расхождения."""
+    with db.engine.begin() as conn:
+        drifted = rebuild_project_stats(conn)
+    if drifted:
+        click.echo('Исправлена статистика проектов: ' + ', '.join(map(str, drifted)))
+    else:
+        click.echo('Расхождений нет')
+
+
+@click.command('seed')
+@click.option('--tasks', type=int, default=1000, show_default=True)
+@click.option('--users', type=int, help='По умолчанию одна пятидесятая от числа задач.')
+@click.option('--projects', type=int, help='По умолчанию одна двухсотая от числа задач.')
+@click.option('--managers', type=int, help='По умолчанию каждый десятый пользователь.')
+@click.option('--comments', type=int, default=2, show_default=True, help='В среднем на задачу.')
+@click.option('--subtasks', type=int, default=2, show_default=True, help='В среднем на задачу.')
+@click.option('--assignees', type=int, default=2, show_default=True, help='Максимум на задачу.')
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--chunk-size', type=int, default=10000, show_default=True)
+@click.option('--reset', is_flag=True, help='Удалить все данные перед заполнением.')
+def seed_command(tasks, users, projects, managers, comments, subtasks, assignees, seed, chunk_size, reset):
+    """Заполнить базу сгенерированными задачами, комментариями и подзадачами."""
+    from seed_db import ADMIN_PASSWORD, SHARED_PASSWORD, SeedError, generate
+    if reset:
+        db.drop_all()
+        db.create_all()
+    with click.progressbar(length=tasks, label='Задачи', file=sys.stderr) as bar:
+        try:
+            totals = generate(db.engine, tasks=tasks, users=users, projects=projects, managers=managers,
+                              comments=comments, subtasks=subtasks, assignees=assignees,
+                              seed=seed, chunk_size=chunk_size, progress=bar.update)
+        except SeedError as e:
+            raise click.ClickException(f'{e}: используйте --reset')
+    click.echo(f'Пользователей: {totals["users"]}, проектов: {totals["projects"]}, '
+               f'задач: {totals["tasks"]}, исполнителей: {totals["assignees"]}, '
+               f'комментариев: {totals["comments"]}, подзадач: {totals["subtasks"]}')
+    click.echo(f'Вход: admin / {ADMIN_PASSWORD}, manager1 / {SHARED_PASSWORD}, worker1 / {SHARED_PASSWORD}')
+
+
+def register_commands(app):
+    app.cli.add_command(export_tasks_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(repair_counters_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(reconcile_project_stats_command)
+    app.cli.add_command(seed_command)
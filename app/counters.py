@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+from sqlalchemy import event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session
+
+from app.models import Comment, Subtask, Task
+from app.versioning import next_revision
+
+COUNTERS = ('comments_count', 'subtasks_total', 'subtasks_done')
+
+
+def _parent_task(session, obj):
+    task = obj.task
+    if task is None and obj.task_id is not None:
+        task = session.get(Task, obj.task_id)
+    return task
+
+
+def _subtask_done_delta(subtask):
+    history = inspect(subtask).attrs.completed.history
+    if not history.has_changes():
+        return 0
+    was_done = bool(history.deleted and history.deleted[0])
+    is_done = bool(subtask.completed)
+    return int(is_done) - int(was_done)
+
+
+@event.listens_for(Session, 'before_flush')
+def maintain_counters(session, flush_context, instances):
+    # Изменения счётчиков попадают в INSERT/UPDATE самой задачи, который
+    # и так выполняется в этом flush (версия, updated_at), поэтому массовое
+    # создание задач с подзадачами не даёт лишних UPDATE на каждую строку.
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for obj in session.new:
+        if isinstance(obj, Comment):
+            deltas[_parent_task(session, obj)]['comments_count'] += 1
+        elif isinstance(obj, Subtask):
+            delta = deltas[_parent_task(session, obj)]
+            delta['subtasks_total'] += 1
+            delta['subtasks_done'] += int(bool(obj.completed))
+    for obj in session.deleted:
+        if isinstance(obj, Comment):
+            deltas[_parent_task(session, obj)]['comments_count'] -= 1
+        elif isinstance(obj, Subtask):
+            delta = deltas[_parent_task(session, obj)]
+            delta['subtasks_total'] -= 1
+            delta['subtasks_done'] -= int(bool(obj.completed))
+    for obj in session.dirty:
+        if isinstance(obj, Subtask) and obj not in session.deleted:
+            deltas[_parent_task(session, obj)]['subtasks_done'] += _subtask_done_delta(obj)
+
+    for task, delta in deltas.items():
+        if task is None or task in session.deleted:
+            continue
+        for name, value in delta.items():
+            if not value:
+                continue
+            if task in session.new:
+                setattr(task, name, (getattr(task, name) or 0) + value)
+            else:
+                setattr(task, name, getattr(Task, name) + value)
+
+
+def _counts():
+    return {
+        'comments_count': select(func.count(Comment.id))
+        .where(Comment.task_id == Task.id).scalar_subquery(),
+        'subtasks_total': select(func.count(Subtask.id))
+        .where(Subtask.task_id == Task.id).scalar_subquery(),
+        'subtasks_done': select(func.count(Subtask.id))
+        .where(Subtask.task_id == Task.id, Subtask.completed.is_(True)).scalar_subquery(),
+    }
+
+
+def repair_counters(connection, batch_size=10000):
+    # Пересчитывает счётчики пачками по диапазонам id; обновляются только
+    # расходящиеся строки. Возвращает число исправленных задач.
+    counts = _counts()
+    mismatch = or_(*(getattr(Task, name) != expr for name, expr in counts.items()))
+    first_id, last_id = connection.execute(select(func.min(Task.id), func.max(Task.id))).one()
+    if first_id is None:
+        return 0
+    revision = next_revision(connection)
+    repaired = 0
+    for start in range(first_id, last_id + 1, batch_size):
+        result = connection.execute(
+            update(Task.__table__)
+            .where(Task.id.between(start, start + batch_size - 1), mismatch)
+            .values(version=revision, **counts)
+        )
+        repaired += result.rowcount
+    return repaired
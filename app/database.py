@@ -0,0 +1,84 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from app import db
+from app.routing import REPLICA_BIND
+
+# Значения по умолчанию; любое можно переопределить в конфигурации
+# или переменной окружения FLASK_<ключ>.
+DATABASE_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,  # мс
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,  # байт
+    'SQLITE_CACHE_SIZE': -64000,  # отрицательное значение — в КиБ
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    # Сколько секунд после своей записи пользователь читает из основной базы.
+    'DB_READ_YOUR_WRITES_SECONDS': 5,
+}
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def engine_options(config, url):
+    # Явно заданные SQLALCHEMY_ENGINE_OPTIONS имеют приоритет над настройками
+    # пула. Для SQLite пул не настраивается: файловой базе хватает
+    # стандартного, а для :memory: параметры QueuePool недопустимы.
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if is_sqlite(url):
+        return options
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+    options.setdefault('pool_pre_ping', config['DB_POOL_PRE_PING'])
+    return options
+
+
+def sqlite_pragmas(config):
+    # busy_timeout идёт первым: смена journal_mode сама может ждать блокировку.
+    return [
+        ('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT'])),
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('mmap_size', int(config['SQLITE_MMAP_SIZE'])),
+        ('cache_size', int(config['SQLITE_CACHE_SIZE'])),
+    ]
+
+
+def _apply_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return on_connect
+
+
+def init_database(app):
+    for key, value in DATABASE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        app.config, app.config['SQLALCHEMY_DATABASE_URI']
+    )
+    replica_url = app.config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {'url': replica_url, **engine_options(app.config, replica_url)}
+        app.config['SQLALCHEMY_BINDS'] = binds
+    db.init_app(app)
+    # init_app заводит пустые метаданные для каждого bind. Моделей у реплики
+    # нет (на неё переключает RoutingSession), а оставшиеся метаданные
+    # ломают create_all() у других приложений в том же процессе (тесты).
+    db.metadatas.pop(REPLICA_BIND, None)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _apply_pragmas(sqlite_pragmas(app.config)))
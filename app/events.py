@@ -0,0 +1,309 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from app.cache import task_audience
+from app.models import Comment, Subtask, Task, TaskEvent, chunked, db, task_assignees
+
+# Изменения этих колонок — следствие других событий (комментария,
+# подзадачи, новой версии), отдельного события "updated" они не дают.
+DERIVED_ATTRS = {'version', 'updated_at', 'comments_count', 'subtasks_total', 'subtasks_done'}
+REPLAY_BATCH_SIZE = 500
+SUBSCRIBER_QUEUE_SIZE = 1000
+PRUNE_EVERY = 100
+# Пауза после ошибки чтения событий растёт вдвое до этого предела, секунды.
+MAX_RETRY_DELAY = 30
+
+_flushes = itertools.count(1)
+
+
+def encode_audience(user_ids):
+    return ',' + ','.join(str(u) for u in sorted(user_ids)) + ','
+
+
+def _payload(task, kind, **extra):
+    return json.dumps(dict(type=kind, task_id=task.id, title=task.title, status=task.status,
+                           version=task.version, **extra), ensure_ascii=False)
+
+
+def _parent(session, obj):
+    task = obj.task
+    if task is None and obj.task_id is not None:
+        task = session.get(Task, obj.task_id)
+    return task
+
+
+def _changed_attrs(task):
+    state = inspect(task)
+    return {attr.key for attr in state.attrs
+            if attr.key not in DERIVED_ATTRS and attr.history.has_changes()}
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_task_events(session, flush_context, instances):
+    # Аудитория считается до flush: после удаления задачи её исполнителей
+    # уже не прочитать.
+    kinds = {}
+
+    def add(task, kind, **extra):
+        if task is not None:
+            kinds.setdefault(task, {})[kind] = extra
+
+    for obj in session.new:
+        if isinstance(obj, Task):
+            add(obj, 'created')
+        elif isinstance(obj, Comment):
+            add(_parent(session, obj), 'commented', comment=obj)
+        elif isinstance(obj, Subtask):
+            add(_parent(session, obj), 'updated')
+    for obj in session.deleted:
+        if isinstance(obj, Task):
+            add(obj, 'deleted')
+        elif isinstance(obj, (Comment, Subtask)):
+            add(_parent(session, obj), 'updated')
+    for obj in session.dirty:
+        if isinstance(obj, Task) and obj not in session.deleted:
+            changed = _changed_attrs(obj)
+            if 'status' in changed:
+                history = inspect(obj).attrs.status.history
+                add(obj, 'status_changed', old_status=history.deleted[0] if history.deleted else None)
+            elif changed:
+                add(obj, 'updated')
+        elif isinstance(obj, Subtask) and session.is_modified(obj):
+            add(_parent(session, obj), 'updated')
+
+    pending = []
+    for task, task_kinds in kinds.items():
+        for final in ('deleted', 'created'):
+            if final in task_kinds:
+                task_kinds = {final: task_kinds[final]}
+                break
+        if len(task_kinds) > 1:
+            task_kinds.pop('updated', None)
+        audience = encode_audience(task_audience(task))
+        pending.extend((task, kind, audience, extra) for kind, extra in task_kinds.items())
+    if pending:
+        session.info.setdefault('task_events', []).extend(pending)
+
+
+@event.listens_for(Session, 'after_flush')
+def write_task_events(session, flush_context):
+    # События пишутся в той же транзакции, что и изменения, и уже после
+    # next_revision() в versioning: строка счётчика ревизий заблокирована
+    # до commit, поэтому id событий растут в порядке фиксации транзакций
+    # и читатель журнала не пропустит событие.
+    pending = session.info.pop('task_events', None)
+    if not pending:
+        return
+    now = datetime.now()
+    rows = []
+    for task, kind, audience, extra in pending:
+        if kind == 'commented':
+            extra = {'comment_id': extra['comment'].id}
+        rows.append({'task_id': task.id, 'kind': kind, 'audience': audience,
+                     'payload': _payload(task, kind, **extra), 'created_at': now})
+    connection = session.connection()
+    connection.execute(insert(TaskEvent.__table__), rows)
+    if next(_flushes) % PRUNE_EVERY == 0:
+        prune_events(connection)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_task_events(session):
+    session.info.pop('task_events', None)
+
+
+def record_task_events(connection, task_ids, kind):
+    # Для массовых UPDATE, которые идут мимо событий сессии.
+    now = datetime.now()
+    for chunk in chunked(list(task_ids)):
+        audiences = {}
+        for task_id, user_id in connection.execute(
+                select(task_assignees.c.task_id, task_assignees.c.user_id)
+                .where(task_assignees.c.task_id.in_(chunk))):
+            audiences.setdefault(task_id, set()).add(user_id)
+        rows = []
+        for task in connection.execute(
+                select(Task.id, Task.user_id, Task.title, Task.status, Task.version)
+                .where(Task.id.in_(chunk))):
+            audience = audiences.get(task.id, set()) | {task.user_id}
+            rows.append({'task_id': task.id, 'kind': kind, 'audience': encode_audience(audience),
+                         'payload': _payload(task, kind), 'created_at': now})
+        if rows:
+            connection.execute(insert(TaskEvent.__table__), rows)
+
+
+def prune_events(connection, keep=None):
+    keep = keep or current_app.config.get('TASK_EVENTS_LOG_SIZE', 10000)
+    last_id = connection.execute(select(func.max(TaskEvent.id))).scalar()
+    if last_id is not None:
+        connection.execute(delete(TaskEvent).where(TaskEvent.id <= last_id - keep))
+
+
+def fetch_events(connection, after_id, user_id=None, limit=REPLAY_BATCH_SIZE):
+    # user_id=None — все события (поток брокера и администраторы).
+    query = select(TaskEvent.id, TaskEvent.kind, TaskEvent.audience, TaskEvent.payload) \
+        .where(TaskEvent.id > after_id)
+    if user_id is not None:
+        query = query.where(TaskEvent.audience.like(f'%,{user_id},%'))
+    return connection.execute(query.order_by(TaskEvent.id).limit(limit)).all()
+
+
+def format_event(row):
+    return f'id: {row.id}\nevent: {row.kind}\ndata: {row.payload}\n\n'
+
+
+class Subscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBroker:
+    # Один поток на процесс читает новые события из БД и раздаёт их
+    # подписчикам этого процесса. Общая точка для всех процессов на хосте —
+    # сама таблица task_event, внешний брокер не нужен. Поток работает,
+    # только пока есть подписчики.
+    def __init__(self, app, poll_interval=1.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.last_id = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                with db.engine.connect() as conn:
+                    self.last_id = conn.execute(select(func.max(TaskEvent.id))).scalar() or 0
+                self._thread = threading.Thread(target=self._run, name='task-events', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _run(self):
+        try:
+            with self.app.app_context():
+                self._poll()
+        finally:
+            # Поток мог завершиться и из-за необработанной ошибки: следующий
+            # подписчик должен запустить новый.
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _poll(self):
+        delay = self.poll_interval
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                subscribers = list(self._subscribers)
+            # Временная ошибка БД не должна останавливать рассылку всем
+            # подписчикам процесса: ошибка пишется в лог, опрос повторяется.
+            try:
+                with db.engine.connect() as conn:
+                    rows = fetch_events(conn, self.last_id)
+            except Exception:
+                self.app.logger.exception('Task events poll failed, retrying in %.1f s', delay)
+                time.sleep(delay)
+                delay = min(max(delay, 0.1) * 2, MAX_RETRY_DELAY)
+                continue
+            delay = self.poll_interval
+            for row in rows:
+                self.last_id = row.id
+                for subscriber in subscribers:
+                    try:
+                        subscriber.queue.put_nowait(row)
+                    except queue.Full:
+                        subscriber.overflowed = True
+            if not rows:
+                time.sleep(self.poll_interval)
+
+
+def get_event_broker():
+    return current_app.extensions['task_events']
+
+
+def replay_events(after_id, user_id=None):
+    while True:
+        with db.engine.connect() as conn:
+            rows = fetch_events(conn, after_id, user_id)
+        yield from rows
+        if len(rows) < REPLAY_BATCH_SIZE:
+            return
+        after_id = rows[-1].id
+
+
+def event_stream(user_id, is_admin, last_event_id=None):
+    config = current_app.config
+    heartbeat = config.get('TASK_EVENTS_HEARTBEAT', 15)
+    deadline = time.monotonic() + config.get('TASK_EVENTS_MAX_AGE', 300)
+    audience = None if is_admin else user_id
+    broker = get_event_broker()
+    with db.engine.connect() as conn:
+        reset = False
+        if last_event_id is None:
+            sent = conn.execute(select(func.max(TaskEvent.id))).scalar() or 0
+        else:
+            sent = last_event_id
+            first_id = conn.execute(select(func.min(TaskEvent.id))).scalar()
+            # Часть событий уже удалена из журнала: клиенту нужно
+            # перечитать задачи целиком.
+            reset = first_id is not None and first_id > sent + 1
+    # Подписка после чтения точки отсчёта: всё, что брокер раздаст после
+    # этого момента, попадёт в очередь, а более ранние события придут из БД.
+    subscriber = broker.subscribe()
+    try:
+        yield f'retry: {config.get("TASK_EVENTS_RETRY_MS", 2000)}\n\n'
+        if reset:
+            yield 'event: reset\ndata: {}\n\n'
+        for row in replay_events(sent, audience):
+            yield format_event(row)
+            sent = row.id
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if subscriber.overflowed:
+                # Очередь переполнилась: догоняем по журналу в БД.
+                subscriber.overflowed = False
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                for row in replay_events(sent, audience):
+                    yield format_event(row)
+                    sent = row.id
+                continue
+            try:
+                row = subscriber.queue.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            if row.id <= sent:
+                continue
+            sent = row.id
+            if is_admin or f',{user_id},' in row.audience:
+                yield format_event(row)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def init_events(app):
+    app.extensions['task_events'] = EventBroker(
+        app, poll_interval=app.config.get('TASK_EVENTS_POLL_INTERVAL', 1.0)
+    )
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+
+from app.models import Task, db
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_CHUNK_SIZE = 1000
+
+
+def iter_task_chunks(query, fields=None, include=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # Серверный курсор (yield_per) читает задачи порциями; связанные данные
+    # для каждой порции подтягиваются пакетно, поэтому память не зависит
+    # от общего числа задач.
+    result = db.session.execute(
+        query.order_by(Task.id).statement,
+        execution_options={'yield_per': chunk_size}
+    )
+    for partition in result.scalars().partitions():
+        yield Task.to_dict_list(partition, fields, include)
+
+
+def iter_ndjson(query, fields=None, include=None):
+    for chunk in iter_task_chunks(query, fields, include):
+        yield ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in chunk)
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def iter_csv(query, fields=None, include=None):
+    columns = list(fields if fields is not None else Task.FIELDS)
+    include = Task.INCLUDES if include is None else include
+    columns += [{'assignees': 'assignee_ids'}.get(name, name) for name in include]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in iter_task_chunks(query, fields, include):
+        for item in chunk:
+            writer.writerow([_csv_value(item.get(c)) for c in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_stream(query, export_format, fields=None, include=None):
+    if export_format == 'csv':
+        return 'text/csv', iter_csv(query, fields, include)
+    return 'application/x-ndjson', iter_ndjson(query, fields, include)
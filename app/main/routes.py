@@ -1,7 +1,13 @@
-from flask import render_template, request, redirect, url_for, flash
+from flask import abort, render_template, request, redirect, url_for, flash, send_file
 from flask_login import login_required, current_user
 from . import main
+from sqlalchemy.orm import joinedload
+from app.cache import get_task_list_cache
 from app.models import Task, User, Project, Comment, Subtask, db
+from app.profiler import PROFILE_FORMATS, get_profile_store
+from app.pagination import DEFAULT_PAGE_SIZE, PaginationError, paginate, next_page_url
+from app.search import SearchError, search_tasks
+from app.stats import task_stats
 from datetime import datetime, date
 
 @main.route('/')
@@ -13,8 +19,9 @@ def index():
 @main.route('/projects')
 @login_required
 def projects():
-    projects = Project.query.all()
-    return render_template('projects.html', projects=projects)
+    projects = Project.query.options(joinedload(Project.author)).all()
+    stats = Project.load_stats([p.id for p in projects])
+    return render_template('projects.html', projects=projects, stats=stats)
 
 @main.route('/project/new', methods=['POST'])
 @login_required
@@ -73,8 +80,14 @@ def delete_project(id):
 @login_required
 def view_project(id):
     project = Project.query.get_or_404(id)
-    tasks = project.tasks.all()
-    return render_template('project_detail.html', project=project, tasks=tasks)
+    try:
+        tasks, next_cursor = paginate(project.tasks, Task, Task.SORT_KEYS, request.args,
+                                      default_limit=DEFAULT_PAGE_SIZE)
+    except PaginationError:
+        flash('Некорректные параметры страницы')
+        return redirect(url_for('main.view_project', id=id))
+    return render_template('project_detail.html', project=project, tasks=tasks,
+                           next_url=next_page_url(next_cursor))
 
 @main.route('/project/<int:project_id>/new_task')
 @login_required
@@ -89,9 +102,7 @@ def tasks():
     if current_user.is_admin():
         query = Task.query
     else:
-        query = Task.query.filter(
-            (Task.user_id == current_user.id) | (Task.assignees.contains(current_user))
-        )
+        query = Task.query.filter(Task.visible_to_filter(current_user))
 
     status = request.args.get('status')
     if status in ['todo', 'in_progress', 'review', 'done']:
@@ -106,10 +117,45 @@ def tasks():
         today = date.today()
         query = query.filter(Task.deadline == today)
 
-    tasks = query.all()
+    q = request.args.get('q', '').strip()
+    if q:
+        try:
+            results = search_tasks(query.options(joinedload(Task.project)), q)
+        except SearchError:
+            flash('Введите слова для поиска')
+            return redirect(url_for('main.tasks'))
+        return render_template('tasks.html', tasks=[task for task, _ in results],
+                               snippets={task.id: snippet for task, snippet in results},
+                               projects=Project.query.all(), users=User.query.all(), q=q,
+                               stats=task_stats(current_user))
+
+    # В кэше хранятся только id страницы: строки задач всё равно читаются
+    # по первичному ключу, зато фильтрация и сортировка не повторяются.
+    cache = get_task_list_cache()
+    cache_key = None
+    if cache:
+        cache_key = cache.make_key('html', None if current_user.is_admin() else current_user.id,
+                                   request.args)
+    cached = cache.get(cache_key) if cache else None
+    if cached:
+        task_ids, next_cursor = cached
+        by_id = {t.id: t for t in Task.query.options(joinedload(Task.project))
+                 .filter(Task.id.in_(task_ids))}
+        tasks = [by_id[i] for i in task_ids if i in by_id]
+    else:
+        try:
+            tasks, next_cursor = paginate(query.options(joinedload(Task.project)), Task,
+                                          Task.SORT_KEYS, request.args,
+                                          default_limit=DEFAULT_PAGE_SIZE)
+        except PaginationError:
+            flash('Некорректные параметры страницы')
+            return redirect(url_for('main.tasks'))
+        if cache:
+            cache.set(cache_key, ([t.id for t in tasks], next_cursor))
     projects = Project.query.all()
     users = User.query.all()
-    return render_template('tasks.html', tasks=tasks, projects=projects, users=users)
+    return render_template('tasks.html', tasks=tasks, projects=projects, users=users,
+                           next_url=next_page_url(next_cursor), stats=task_stats(current_user))
 
 @main.route('/task/new', methods=['POST'])
 @login_required
@@ -176,11 +222,9 @@ def new_task():
     if assignee_ids:
         try:
             assignee_ids = [int(i) for i in assignee_ids]
-            assignees = []
-            for aid in assignee_ids:
-                user = User.query.get(aid)
-                if user and current_user.can_assign_to(user):
-                    assignees.append(user)
+            users = User.load_many(assignee_ids)
+            assignees = [users[aid] for aid in dict.fromkeys(assignee_ids)
+                         if aid in users and current_user.can_assign_to(users[aid])]
             task.assignees.extend(assignees)
         except (ValueError, TypeError):
             flash('Некорректные данные о пользователях')
@@ -267,11 +311,9 @@ def edit_task(id):
     if assignee_ids:
         try:
             assignee_ids = [int(i) for i in assignee_ids]
-            assignees = []
-            for aid in assignee_ids:
-                user = User.query.get(aid)
-                if user and current_user.can_assign_to(user):
-                    assignees.append(user)
+            users = User.load_many(assignee_ids)
+            assignees = [users[aid] for aid in dict.fromkeys(assignee_ids)
+                         if aid in users and current_user.can_assign_to(users[aid])]
             task.assignees.clear()
             task.assignees.extend(assignees)
         except (ValueError, TypeError):
@@ -427,7 +469,22 @@ def admin():
         flash('Доступ запрещён')
         return redirect(url_for('main.tasks'))
     users = User.query.filter(User.id != current_user.id).all()
-    return render_template('admin.html', users=users)
+    store = get_profile_store()
+    profiles = store.list() if store else []
+    return render_template('admin.html', users=users, profiles=profiles)
+
+@main.route('/admin/profiles/<profile_id>.<kind>')
+@login_required
+def download_profile(profile_id, kind):
+    if not current_user.is_admin():
+        flash('Доступ запрещён')
+        return redirect(url_for('main.tasks'))
+    store = get_profile_store()
+    path = store.file(profile_id, kind) if store else None
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype=PROFILE_FORMATS[kind], as_attachment=True,
+                     download_name=f'profile-{profile_id}.{kind}')
 
 @main.route('/admin/user/<int:user_id>/set_level', methods=['POST'])
 @login_required
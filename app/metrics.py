@@ -0,0 +1,351 @@
+import atexit
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+
+from app import db
+
+# Верхние границы корзин гистограммы длительности запросов, секунды.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_HELP = {
+    'http_requests_total': ('counter', 'HTTP requests handled'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency in seconds'),
+    'http_requests_in_flight': ('gauge', 'HTTP requests being handled'),
+    'db_queries_total': ('counter', 'SQL statements executed while handling HTTP requests'),
+    'login_duration_seconds': ('histogram', 'Password check latency at login in seconds'),
+    'password_hash_queue_depth': ('gauge', 'Password hashes running or queued'),
+    'password_hash_rejected_total': ('counter', 'Password hashes rejected because the queue was full'),
+}
+
+# Сюда сливаются счётчики и гистограммы завершившихся процессов.
+AGGREGATE_FILE = 'aggregate.json'
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsCollector:
+    # Каждый процесс копит метрики в памяти и раз в flush_interval секунд
+    # атомарно записывает их в свой файл <pid>.json в общей папке. /metrics
+    # суммирует файлы всех процессов: счётчики и гистограммы — всех, включая
+    # завершившиеся, gauge — только живых процессов. Файлы завершившихся
+    # процессов (и файл с pid, доставшимся новому процессу) сливаются в
+    # aggregate.json и удаляются, чтобы папка не росла с каждым перезапуском.
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._sources = []
+        os.makedirs(directory, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.path = os.path.join(self.directory, f'{self.pid}.json')
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._flushed_at = 0.0
+        if os.path.exists(self.path):
+            with self._locked():
+                self._merge_dead([self.path])
+
+    def _check_fork(self):
+        # После fork (gunicorn --preload) у дочернего процесса свой файл.
+        if os.getpid() != self.pid:
+            self._lock = threading.Lock()
+            self._reset()
+
+    def add_source(self, source):
+        # source() -> {'counters': {(name, labels): value}, 'gauges': {...}}
+        # со значениями на момент вызова, например из пула хэширования.
+        self._sources.append(source)
+
+    def inc(self, name, labels, amount=1):
+        self._check_fork()
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge_add(self, name, labels, amount):
+        self._check_fork()
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        # Корзины хранятся без накопления; последние два элемента — сумма
+        # и число наблюдений.
+        self._check_fork()
+        key = _key(name, labels)
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            counts[bisect_left(buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def snapshot(self):
+        self._check_fork()
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            gauges = dict(self._gauges)
+        for source in self._sources:
+            values = source()
+            for key, value in values.get('counters', {}).items():
+                counters[key] = counters.get(key, 0) + value
+            gauges.update(values.get('gauges', {}))
+        return {
+            'pid': self.pid,
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), value] for (name, labels), value in histograms.items()],
+            'gauges': [[name, list(labels), value] for (name, labels), value in gauges.items()],
+        }
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        data = self.snapshot()
+        # Недоступная папка метрик не должна ронять обработку запросов.
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _locked(self):
+        # Межпроцессная блокировка папки: слияние файлов и их чтение в
+        # collect() не должны пересекаться, иначе значения посчитаются дважды.
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _merge_dead(self, paths):
+        # Вызывается под _locked(). Gauge завершившихся процессов не нужны.
+        aggregate_path = os.path.join(self.directory, AGGREGATE_FILE)
+        snapshots = [self._read(path) for path in [aggregate_path] + paths]
+        counters, histograms, _ = self._sum(data for data in snapshots if data is not None)
+        aggregate = {
+            'pid': None,
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), value] for (name, labels), value in histograms.items()],
+            'gauges': [],
+        }
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(aggregate, f)
+            os.replace(tmp_path, aggregate_path)
+            for path in paths:
+                os.remove(path)
+        except OSError:
+            pass
+
+    def _sum(self, snapshots):
+        counters, histograms, gauges = {}, {}, {}
+        for data in snapshots:
+            for name, labels, value in data['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in data['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], value)]
+                else:
+                    histograms[key] = list(value)
+            if data['pid'] == self.pid or (data['pid'] is not None and _pid_alive(data['pid'])):
+                for name, labels, value in data['gauges']:
+                    key = (name, tuple(map(tuple, labels)))
+                    gauges[key] = gauges.get(key, 0) + value
+        return counters, histograms, gauges
+
+    def collect(self):
+        # Сумма по всем процессам: {(name, labels): value}.
+        snapshots = [self.snapshot()]
+        with self._locked():
+            dead = []
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == self.path:
+                    continue
+                data = self._read(path)
+                if data is None:
+                    continue
+                snapshots.append(data)
+                if data['pid'] is not None and not _pid_alive(data['pid']):
+                    dead.append(path)
+            if dead:
+                self._merge_dead(dead)
+        return self._sum(snapshots)
+
+    def render(self):
+        counters, histograms, gauges = self.collect()
+        series = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            series.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), counts in histograms.items():
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {counts[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {counts[-1]}')
+        output = []
+        for name in sorted(series):
+            kind, help_text = METRICS_HELP.get(name, ('untyped', name))
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} {kind}')
+            output.extend(sorted(series[name]))
+        return '\n'.join(output) + '\n'
+
+
+def get_metrics():
+    if has_app_context():
+        return current_app.extensions.get('metrics')
+    return None
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    get_metrics().gauge_add('http_requests_in_flight', {'endpoint': _endpoint()}, 1)
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exc):
+    if 'metrics_start' not in g:
+        return
+    metrics = get_metrics()
+    endpoint = _endpoint()
+    metrics.gauge_add('http_requests_in_flight', {'endpoint': endpoint}, -1)
+    metrics.inc('http_requests_total', {
+        'endpoint': endpoint, 'method': request.method, 'status': g.get('metrics_status', 500)
+    })
+    metrics.observe('http_request_duration_seconds', {'endpoint': endpoint},
+                    time.perf_counter() - g.metrics_start)
+    metrics.inc('db_queries_total', {'endpoint': endpoint}, g.metrics_queries)
+    metrics.flush()
+
+
+def observe_login(seconds):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.observe('login_duration_seconds', {}, seconds)
+
+
+def password_hasher_metrics(hasher):
+    stats = hasher.stats()
+    return {
+        'counters': {_key('password_hash_rejected_total', {}): stats['rejected']},
+        'gauges': {_key('password_hash_queue_depth', {}): stats['queue_depth']},
+    }
+
+
+def metrics_view():
+    metrics = get_metrics()
+    token = current_app.config.get('METRICS_TOKEN')
+    # Без токена метрики отдаются только при явном METRICS_PUBLIC.
+    if not token and not current_app.config.get('METRICS_PUBLIC', False):
+        return Response('METRICS_TOKEN is not configured\n', status=403, mimetype='text/plain')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def default_metrics_dir(app):
+    # Папка общая для всех процессов, работающих с одной базой.
+    digest = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'task-manager-metrics-{digest}')
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    metrics = MetricsCollector(
+        app.config.get('METRICS_DIR') or default_metrics_dir(app),
+        flush_interval=app.config.get('METRICS_FLUSH_INTERVAL', 1.0)
+    )
+    app.extensions['metrics'] = metrics
+
+    hasher = app.extensions['password_hasher']
+    metrics.add_source(lambda: password_hasher_metrics(hasher))
+    atexit.register(metrics.flush, force=True)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'after_cursor_execute', _count_query)
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,127 @@
+from sqlalchemy import Column, Integer, MetaData, Table, inspect, select, text, update
+
+from app import db, search
+from app.counters import repair_counters
+from app.models import ProjectOpenDeadline, ProjectStats, Revision, TaskEvent, Tombstone
+from app.project_stats import rebuild_project_stats
+
+# Номер схемы хранится в отдельной таблице вне db.metadata, чтобы
+# create_all() и drop_all() в тестах её не трогали.
+schema_version = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, nullable=False)
+)
+
+
+def _add_column(conn, table, name, ddl):
+    columns = {c['name'] for c in inspect(conn).get_columns(table)}
+    if name not in columns:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+
+def _create_indexes(conn, *names):
+    # Определения индексов берутся из моделей, чтобы не дублировать их здесь.
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+
+def _sort_indexes(conn):
+    _create_indexes(conn, 'ix_task_created_at_id', 'ix_task_deadline_id',
+                    'ix_task_priority_id', 'ix_project_name')
+
+
+def _versions(conn):
+    for table in ('task', 'project'):
+        _add_column(conn, table, 'version', 'INTEGER NOT NULL DEFAULT 0')
+        _add_column(conn, table, 'updated_at', 'TIMESTAMP')
+    Revision.__table__.create(conn, checkfirst=True)
+
+
+def _filter_indexes(conn):
+    _create_indexes(conn, 'ix_task_assignees_user_task', 'ix_task_user_status', 'ix_task_status',
+                    'ix_task_project_status', 'ix_task_completed_at', 'ix_task_open_deadline',
+                    'ix_comment_task_id', 'ix_subtask_task_id')
+
+
+def _task_counters(conn):
+    for name in ('comments_count', 'subtasks_total', 'subtasks_done'):
+        _add_column(conn, 'task', name, 'INTEGER NOT NULL DEFAULT 0')
+    repair_counters(conn)
+
+
+def _search_index(conn):
+    search.rebuild(conn)
+
+
+def _project_stats(conn):
+    ProjectStats.__table__.create(conn, checkfirst=True)
+    ProjectOpenDeadline.__table__.create(conn, checkfirst=True)
+    rebuild_project_stats(conn)
+
+
+def _task_events(conn):
+    TaskEvent.__table__.create(conn, checkfirst=True)
+
+
+def _tombstones(conn):
+    Tombstone.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, 'ix_task_version_id')
+
+
+def _password_hash_length(conn):
+    # SQLite не проверяет длину VARCHAR; в PostgreSQL колонка была
+    # VARCHAR(128), а хэши scrypt длиннее.
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(256)'))
+
+
+# Шаги должны быть идемпотентными: в SQLite DDL не откатывается вместе
+# с транзакцией, и после сбоя шаг будет выполнен повторно.
+MIGRATIONS = [
+    (1, 'Индексы сортировки задач и проектов', _sort_indexes),
+    (2, 'Колонки version/updated_at и счётчик ревизий', _versions),
+    (3, 'Индексы фильтров задач, исполнителей, комментариев и подзадач', _filter_indexes),
+    (4, 'Счётчики комментариев и подзадач в задачах', _task_counters),
+    (5, 'Полнотекстовый индекс задач и комментариев', _search_index),
+    (6, 'Статистика задач по проектам', _project_stats),
+    (7, 'Журнал событий задач', _task_events),
+    (8, 'Записи об удалениях для синхронизации и индекс по version', _tombstones),
+    (9, 'Длина хэша пароля до 256 символов', _password_hash_length),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    if not inspect(conn).has_table('schema_version'):
+        return None
+    return conn.execute(select(schema_version.c.version)).scalar()
+
+
+def upgrade(engine=None):
+    # Создаёт новую базу сразу в актуальной схеме или доводит существующую
+    # до HEAD. Возвращает список применённых миграций.
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        version = current_version(conn)
+        if version is None:
+            if not inspect(conn).has_table('task'):
+                db.metadata.create_all(conn)
+                schema_version.create(conn)
+                conn.execute(schema_version.insert().values(version=HEAD))
+                return []
+            schema_version.create(conn)
+            conn.execute(schema_version.insert().values(version=0))
+            version = 0
+
+    applied = []
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(update(schema_version).values(version=number))
+        applied.append((number, description))
+    return applied
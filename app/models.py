@@ -1,19 +1,31 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import func, select
 from app import db
+from app.passwords import get_password_hasher
 from datetime import datetime, date
+from collections import defaultdict
+
+# Ограничение на размер IN (...) в пакетных запросах, чтобы не упираться
+# в лимит параметров SQLite.
+IN_BATCH_SIZE = 500
+
+
+def chunked(items, size=IN_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 task_assignees = db.Table(
     'task_assignees',
     db.Column('task_id', db.Integer, db.ForeignKey('task.id'), primary_key=True),
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Index('ix_task_assignees_user_task', 'user_id', 'task_id'),
     extend_existing=True
 )
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
     access_level = db.Column(db.Integer, default=1, nullable=False)
 
     authored_tasks = db.relationship('Task', back_populates='author', lazy='dynamic')
@@ -22,10 +34,13 @@ class User(UserMixin, db.Model):
     authored_projects = db.relationship('Project', back_populates='author', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_password_hasher().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_password_hasher().verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return get_password_hasher().needs_rehash(self.password_hash)
 
     def is_admin(self):
         return self.access_level == 0
@@ -33,33 +48,140 @@ class User(UserMixin, db.Model):
     def can_manage(self, other):
         return self.is_admin()
 
+    @staticmethod
+    def load_many(ids):
+        # {id: пользователь} для списка id одним запросом на пачку.
+        ids = list(set(ids))
+        users = {}
+        for chunk in chunked(ids):
+            users.update((u.id, u) for u in User.query.filter(User.id.in_(chunk)))
+        return users
+
     def can_assign_to(self, other):
         return self.access_level <= other.access_level
 
     def __repr__(self):
         return f'<User {self.username} (L{self.access_level})>'
 
+def select_fields(data, fields):
+    if fields is None:
+        return data
+    return {k: v for k, v in data.items() if k in fields}
+
+
 class Project(db.Model):
+    SORT_KEYS = ('id', 'name')
+    FIELDS = ('id', 'name', 'description', 'color', 'author_id')
+    INCLUDES = ('author', 'stats')
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.Text)
     color = db.Column(db.String(7), default='#3498db')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
 
     tasks = db.relationship('Task', back_populates='project', lazy='dynamic')
     author = db.relationship('User', back_populates='authored_projects')
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None, include=None):
+        include = self.INCLUDES if include is None else include
+        related = {}
+        if 'author' in include:
+            related['author_username'] = self.author.username if self.author else 'Unknown'
+        if 'stats' in include:
+            related['stats'] = Project.load_stats([self.id])[self.id]
+        return self._to_dict(fields, related)
+
+    def _to_dict(self, fields, related):
+        data = select_fields({
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'color': self.color,
-            'author_id': self.user_id,
-            'author_username': self.author.username if self.author else 'Unknown'
-        }
+            'author_id': self.user_id
+        }, fields)
+        data.update(related)
+        return data
+
+    @staticmethod
+    def to_dict_list(projects, fields=None, include=None):
+        projects = list(projects)
+        include = Project.INCLUDES if include is None else include
+        usernames = {}
+        if 'author' in include:
+            user_ids = list({p.user_id for p in projects})
+            for chunk in chunked(user_ids):
+                rows = db.session.execute(
+                    select(User.id, User.username).where(User.id.in_(chunk))
+                )
+                usernames.update(rows.all())
+        stats = Project.load_stats([p.id for p in projects]) if 'stats' in include else {}
+        result = []
+        for p in projects:
+            related = {}
+            if 'author' in include:
+                related['author_username'] = usernames.get(p.user_id, 'Unknown')
+            if 'stats' in include:
+                related['stats'] = stats[p.id]
+            result.append(p._to_dict(fields, related))
+        return result
+
+    @staticmethod
+    def load_stats(project_ids):
+        # Два запроса на пачку проектов к таблицам, которые ведёт
+        # app/project_stats.py, без просмотра task.
+        today = date.today()
+        rows, overdue = {}, {}
+        for chunk in chunked(list(set(project_ids))):
+            rows.update((r.project_id, r) for r in ProjectStats.query.filter(ProjectStats.project_id.in_(chunk)))
+            overdue.update(db.session.execute(
+                select(ProjectOpenDeadline.project_id, func.sum(ProjectOpenDeadline.open_count))
+                .where(ProjectOpenDeadline.project_id.in_(chunk), ProjectOpenDeadline.deadline < today)
+                .group_by(ProjectOpenDeadline.project_id)
+            ).all())
+        result = {}
+        for project_id in project_ids:
+            row = rows.get(project_id)
+            by_status = {status: getattr(row, status) if row else 0 for status in Task.STATUSES}
+            total = row.total if row else 0
+            result[project_id] = {
+                'total': total,
+                'by_status': by_status,
+                'overdue': overdue.get(project_id) or 0,
+                'completion': round(by_status['done'] * 100 / total) if total else 0
+            }
+        return result
 
 class Task(db.Model):
+    SORT_KEYS = ('created_at', 'deadline', 'priority', 'id')
+    FIELDS = (
+        'id', 'title', 'description', 'created_at', 'completed_at', 'author_id',
+        'project_id', 'status', 'priority', 'deadline', 'priority_emoji', 'is_overdue',
+        'subtasks_total', 'subtasks_done'
+    )
+    INCLUDES = ('subtasks', 'assignees', 'comments_count')
+    STATUSES = ('todo', 'in_progress', 'review', 'done')
+
+    __table_args__ = (
+        db.Index('ix_task_created_at_id', 'created_at', 'id'),
+        db.Index('ix_task_deadline_id', 'deadline', 'id'),
+        db.Index('ix_task_priority_id', 'priority', 'id'),
+        # Фильтры get_tasks/main.tasks: ветка "автор" видимости со статусом,
+        # админский фильтр по статусу, задачи проекта и открытые задачи
+        # с дедлайном (overdue/due_today).
+        db.Index('ix_task_user_status', 'user_id', 'status'),
+        db.Index('ix_task_status', 'status'),
+        db.Index('ix_task_project_status', 'project_id', 'status'),
+        db.Index('ix_task_completed_at', 'completed_at'),
+        db.Index('ix_task_open_deadline', 'deadline',
+                 sqlite_where=db.text('completed_at IS NULL'),
+                 postgresql_where=db.text('completed_at IS NULL')),
+        # Выборка изменений после ревизии для синхронизации (app/sync.py).
+        db.Index('ix_task_version_id', 'version', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -70,6 +192,12 @@ class Task(db.Model):
     status = db.Column(db.String(20), default='todo')
     priority = db.Column(db.Integer, default=2)
     deadline = db.Column(db.Date, nullable=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    # Денормализованные счётчики, поддерживаются app/counters.py.
+    comments_count = db.Column(db.Integer, default=0, nullable=False)
+    subtasks_total = db.Column(db.Integer, default=0, nullable=False)
+    subtasks_done = db.Column(db.Integer, default=0, nullable=False)
 
     author = db.relationship('User', back_populates='authored_tasks')
     assignees = db.relationship('User', secondary=task_assignees, back_populates='assigned_tasks')
@@ -77,6 +205,28 @@ class Task(db.Model):
     comments = db.relationship('Comment', back_populates='task', cascade='all, delete-orphan')
     subtasks = db.relationship('Subtask', back_populates='task', cascade='all, delete-orphan')
 
+    @staticmethod
+    def visible_to_filter(user):
+        # Не Task.assignees.contains(): внутри OR он превращается в декартово
+        # произведение с task_assignees. Форма "user_id = ? OR id IN (...)"
+        # позволяет SQLite объединить поиск по ix_task_user_status
+        # и ix_task_assignees_user_task вместо полного просмотра task.
+        return (Task.user_id == user.id) | Task.id.in_(
+            select(task_assignees.c.task_id).where(task_assignees.c.user_id == user.id)
+        )
+
+    @staticmethod
+    def apply_filters(query, status=None, overdue=False, due_today=False, project_id=None):
+        if status in Task.STATUSES:
+            query = query.filter(Task.status == status)
+        if overdue:
+            query = query.filter(Task.deadline < date.today(), Task.completed_at.is_(None))
+        if due_today:
+            query = query.filter(Task.deadline == date.today(), Task.completed_at.is_(None))
+        if project_id is not None:
+            query = query.filter(Task.project_id == project_id)
+        return query
+
     def is_visible_to(self, user):
         if user.is_admin():
             return True
@@ -104,24 +254,73 @@ class Task(db.Model):
             'done': '#2ecc71'
         }.get(self.status, '#95a5a6')
 
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None, include=None):
+        include = self.INCLUDES if include is None else include
+        related = {}
+        if 'assignees' in include:
+            related['assignee_ids'] = [u.id for u in self.assignees]
+        if 'subtasks' in include:
+            related['subtasks'] = [s.to_dict() for s in self.subtasks]
+        if 'comments_count' in include:
+            related['comments_count'] = self.comments_count
+        return self._to_dict(fields, related)
+
+    def _to_dict(self, fields, related):
+        data = select_fields({
             'id': self.id,
             'title': self.title,
             'description': self.description,
             'created_at': self.created_at.isoformat(),
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
             'author_id': self.user_id,
-            'assignee_ids': [u.id for u in self.assignees],
             'project_id': self.project_id,
             'status': self.status,
             'priority': self.priority,
             'deadline': self.deadline.isoformat() if self.deadline else None,
             'priority_emoji': self.get_priority_emoji(),
             'is_overdue': self.is_overdue(),
-            'subtasks': [s.to_dict() for s in self.subtasks],
-            'comments_count': len(self.comments)
-        }
+            'subtasks_total': self.subtasks_total,
+            'subtasks_done': self.subtasks_done
+        }, fields)
+        data.update(related)
+        return data
+
+    @staticmethod
+    def to_dict_list(tasks, fields=None, include=None):
+        # Сериализация списка без ленивых загрузок: исполнители и подзадачи
+        # подтягиваются пакетно для всей страницы и только если запрошены
+        # в include; количество комментариев хранится в самой задаче.
+        tasks = list(tasks)
+        include = Task.INCLUDES if include is None else include
+        ids = [t.id for t in tasks]
+        assignee_ids = defaultdict(list)
+        subtasks = defaultdict(list)
+
+        for chunk in chunked(ids):
+            if 'assignees' in include:
+                rows = db.session.execute(
+                    select(task_assignees.c.task_id, task_assignees.c.user_id)
+                    .where(task_assignees.c.task_id.in_(chunk))
+                    .order_by(task_assignees.c.task_id, task_assignees.c.user_id)
+                )
+                for task_id, user_id in rows:
+                    assignee_ids[task_id].append(user_id)
+
+            if 'subtasks' in include:
+                for st in Subtask.query.filter(Subtask.task_id.in_(chunk)).order_by(Subtask.id):
+                    subtasks[st.task_id].append(st)
+
+        result = []
+        for t in tasks:
+            related = {}
+            if 'assignees' in include:
+                related['assignee_ids'] = assignee_ids[t.id]
+            if 'subtasks' in include:
+                related['subtasks'] = [s.to_dict() for s in subtasks[t.id]]
+            if 'comments_count' in include:
+                related['comments_count'] = t.comments_count
+            result.append(t._to_dict(fields, related))
+        return result
 
     def can_mark_as_done(self, user):
         if user.is_admin():
@@ -146,7 +345,7 @@ class Comment(db.Model):
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False, index=True)
 
     author = db.relationship('User', back_populates='comments')
     task = db.relationship('Task', back_populates='comments')
@@ -165,7 +364,7 @@ class Subtask(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     completed = db.Column(db.Boolean, default=False)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False, index=True)
 
     task = db.relationship('Task', back_populates='subtasks')
 
@@ -175,4 +374,61 @@ class Subtask(db.Model):
             'title': self.title,
             'completed': self.completed,
             'task_id': self.task_id
-        }
\ No newline at end of file
+        }
+
+class ProjectStats(db.Model):
+    # Число задач проекта всего и по статусам. Обновляется в той же
+    # транзакции, что и задачи (app/project_stats.py).
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    total = db.Column(db.Integer, default=0, nullable=False)
+    todo = db.Column(db.Integer, default=0, nullable=False)
+    in_progress = db.Column(db.Integer, default=0, nullable=False)
+    review = db.Column(db.Integer, default=0, nullable=False)
+    done = db.Column(db.Integer, default=0, nullable=False)
+
+class ProjectOpenDeadline(db.Model):
+    # Число незавершённых задач проекта с данным дедлайном. Просроченность
+    # зависит от текущей даты, поэтому хранится не готовый счётчик, а
+    # распределение по дедлайнам: сумма по deadline < сегодня.
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    deadline = db.Column(db.Date, primary_key=True)
+    open_count = db.Column(db.Integer, default=0, nullable=False)
+
+class TaskEvent(db.Model):
+    # Журнал изменений задач для ленты событий (app/events.py). audience —
+    # id пользователей через запятую с запятыми по краям (",1,5,"), чтобы
+    # выбирать события пользователя через LIKE без отдельной таблицы.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    audience = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+class Tombstone(db.Model):
+    # Запись об удалении задачи, комментария или подзадачи для
+    # GET /api/tasks/changes. Задача также получает запись с kind='task',
+    # когда пользователь перестаёт её видеть (снят с исполнителей): тогда
+    # audience — только эти пользователи. Хранится SYNC_TOMBSTONE_RETENTION
+    # секунд (app/sync.py).
+    __table_args__ = (
+        db.Index('ix_tombstone_revision', 'revision'),
+        db.Index('ix_tombstone_deleted_at', 'deleted_at'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    task_id = db.Column(db.Integer, nullable=False)
+    audience = db.Column(db.Text, nullable=False)
+    revision = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+class Revision(db.Model):
+    # Глобальный счётчик изменений: каждый flush, затрагивающий задачи или
+    # проекты, берёт следующее значение и записывает его в их version.
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,146 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from flask import request, url_for
+from sqlalchemy import and_, tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(sort, value, last_id):
+    payload = json.dumps({'s': sort, 'v': _encode_value(value), 'id': last_id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data['s'], data['v'], int(data['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise PaginationError('Invalid cursor')
+
+
+def parse_sort(sort, sort_keys, default='id'):
+    sort = sort or default
+    name = sort.lstrip('-')
+    if name not in sort_keys:
+        raise PaginationError(f'Invalid sort key. Use one of: {", ".join(sort_keys)}')
+    return sort, name, sort.startswith('-')
+
+
+def parse_limit(limit, default=None):
+    if limit is None:
+        return default
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise PaginationError('Invalid limit')
+    if limit < 1:
+        raise PaginationError('Invalid limit')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _order_by(column, id_column, descending):
+    if column is id_column:
+        return [id_column.desc() if descending else id_column.asc()]
+    if descending:
+        return [column.desc().nulls_last(), id_column.desc()]
+    return [column.asc().nulls_first(), id_column.asc()]
+
+
+def _segments(column, id_column, descending, after):
+    # Условия выборки "после курсора" в порядке выдачи. NULL-значения идут
+    # первыми при ASC и последними при DESC и выбираются отдельным запросом:
+    # так каждое условие остаётся сравнением кортежей и ищется по индексу
+    # (column, id), а глубокие страницы стоят столько же, сколько первая.
+    id_after = (lambda last_id: id_column < last_id) if descending else (lambda last_id: id_column > last_id)
+    if column is id_column:
+        return [id_after(after[1])] if after else [None]
+
+    if after is None:
+        nulls, values = column.is_(None), column.isnot(None)
+    else:
+        value, last_id = after
+        if value is None:
+            nulls = and_(column.is_(None), id_after(last_id))
+            values = None if descending else column.isnot(None)
+        else:
+            nulls = column.is_(None) if descending else None
+            key, bound = tuple_(column, id_column), tuple_(value, last_id)
+            values = key < bound if descending else key > bound
+    segments = [values, nulls] if descending else [nulls, values]
+    return [s for s in segments if s is not None]
+
+
+def paginate(query, model, sort_keys, args, default_limit=None):
+    # Keyset-пагинация: возвращает (items, next_cursor). Без limit/cursor
+    # и default_limit отдаёт все строки, но уже в стабильном порядке.
+    sort, name, descending = parse_sort(args.get('sort'), sort_keys)
+    limit = parse_limit(args.get('limit'), default_limit)
+    column = getattr(model, name)
+    id_column = model.id
+
+    after = None
+    cursor = args.get('cursor')
+    if cursor:
+        cursor_sort, value, last_id = decode_cursor(cursor)
+        if cursor_sort != sort:
+            raise PaginationError('Cursor does not match sort order')
+        try:
+            after = (_decode_value(column, value), last_id)
+        except (TypeError, ValueError):
+            raise PaginationError('Invalid cursor')
+        if limit is None:
+            limit = DEFAULT_PAGE_SIZE
+
+    if limit is None:
+        return query.order_by(*_order_by(column, id_column, descending)).all(), None
+
+    order = [column.desc(), id_column.desc()] if descending else [column.asc(), id_column.asc()]
+    if column is id_column:
+        order = order[1:]
+    items = []
+    for condition in _segments(column, id_column, descending, after):
+        segment = query.filter(condition) if condition is not None else query
+        items.extend(segment.order_by(*order).limit(limit + 1 - len(items)).all())
+        if len(items) > limit:
+            break
+
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    last = items[-1]
+    return items, encode_cursor(sort, getattr(last, name), last.id)
+
+
+def next_page_url(next_cursor):
+    if not next_cursor:
+        return None
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
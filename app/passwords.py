@@ -0,0 +1,142 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_HASH_METHOD = 'scrypt'
+LATENCY_WINDOW = 1000
+
+
+class PasswordHasherBusy(RuntimeError):
+    pass
+
+
+def hash_parameters(password_hash):
+    # Префикс хэша werkzeug до соли: "scrypt:32768:8:1", "pbkdf2:sha256:600000".
+    return password_hash.split('$', 1)[0]
+
+
+class PasswordHasher:
+    # Хэширование выполняется в пуле процессов, чтобы медленный scrypt не
+    # занимал поток, обслуживающий запросы. queue_limit ограничивает число
+    # хэшей в работе и в очереди: при переполнении сразу бросается
+    # PasswordHasherBusy, а не копятся ожидающие запросы. workers=0 —
+    # хэширование в текущем потоке (тесты, CLI).
+    def __init__(self, method=DEFAULT_HASH_METHOD, workers=2, queue_limit=None, timeout=30):
+        self.method = method
+        self.workers = workers
+        self.queue_limit = queue_limit or max(workers, 1) * 4
+        self.timeout = timeout
+        self.rejected = 0
+        self.pending = 0
+        self.logins = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._slots = threading.BoundedSemaphore(self.queue_limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._parameters = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy('Password hashing queue is full')
+        with self._lock:
+            self.pending += 1
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self._release()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Слот освобождается, когда хэш действительно посчитан, даже если
+        # запрос перестал его ждать по таймауту.
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Для вызывающего кода это та же перегрузка: 503 и Retry-After.
+            raise PasswordHasherBusy('Password hashing timed out')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    @property
+    def parameters(self):
+        # Нормализованные параметры текущего метода ("scrypt" превращается
+        # в "scrypt:32768:8:1"); считаются один раз по пустому паролю.
+        if self._parameters is None:
+            self._parameters = hash_parameters(generate_password_hash('', self.method))
+        return self._parameters
+
+    def needs_rehash(self, password_hash):
+        return hash_parameters(password_hash) != self.parameters
+
+    def record_login(self, seconds):
+        with self._lock:
+            self.logins += 1
+            self._latencies.append(seconds)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'method': self.method,
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'queue_depth': self.pending,
+                'rejected': self.rejected,
+                'logins': self.logins,
+            }
+        if latencies:
+            stats['login_latency_ms'] = {
+                'avg': round(sum(latencies) / len(latencies) * 1000, 2),
+                'p50': round(latencies[len(latencies) // 2] * 1000, 2),
+                'p95': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            }
+        return stats
+
+
+_default_hasher = PasswordHasher(workers=0, queue_limit=1 << 16)
+
+
+def get_password_hasher():
+    if has_app_context():
+        hasher = current_app.extensions.get('password_hasher')
+        if hasher is not None:
+            return hasher
+    return _default_hasher
+
+
+def init_passwords(app):
+    workers = app.config.get('PASSWORD_HASH_WORKERS')
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD),
+        workers=workers,
+        queue_limit=app.config.get('PASSWORD_HASH_QUEUE_LIMIT'),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 30)
+    )
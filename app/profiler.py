@@ -0,0 +1,173 @@
+import cProfile
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_login import current_user
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+PROFILE_ID = re.compile(r'^\d+-\d+-\d+$')
+PROFILE_FORMATS = {'pstats': 'application/octet-stream', 'collapsed': 'text/plain'}
+
+_sequence = itertools.count(1)
+
+
+class StackSampler:
+    # Раз в interval секунд снимает стек потока запроса. Результат —
+    # collapsed stacks ("корень;...;лист число"), которые понимают
+    # flamegraph.pl и speedscope; cProfile полных стеков не хранит.
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    # Кольцо из последних size профилей в папке: на каждый профиль
+    # <id>.json с описанием, <id>.pstats и <id>.collapsed. id начинается
+    # со времени в мс, поэтому сортировка имён — порядок записи.
+    def __init__(self, directory, size=20):
+        self.directory = directory
+        self.size = size
+
+    def path(self, profile_id, kind):
+        return os.path.join(self.directory, f'{profile_id}.{kind}')
+
+    def save(self, profiler, sampler, info):
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f'{int(time.time() * 1000):013d}-{os.getpid()}-{next(_sequence)}'
+        profiler.dump_stats(self.path(profile_id, 'pstats'))
+        with open(self.path(profile_id, 'collapsed'), 'w') as f:
+            f.write(sampler.collapsed())
+        # Описание пишется последним: профиль виден в списке только целиком.
+        with open(self.path(profile_id, 'json'), 'w') as f:
+            json.dump(dict(info, id=profile_id), f)
+        self.trim()
+        return profile_id
+
+    def trim(self):
+        for meta in sorted(glob.glob(self.path('*', 'json')), reverse=True)[self.size:]:
+            profile_id = os.path.basename(meta)[:-len('.json')]
+            for kind in ('json',) + tuple(PROFILE_FORMATS):
+                try:
+                    os.remove(self.path(profile_id, kind))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        profiles = []
+        for meta in sorted(glob.glob(self.path('*', 'json')), reverse=True):
+            try:
+                with open(meta) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def file(self, profile_id, kind):
+        if not PROFILE_ID.match(profile_id) or kind not in PROFILE_FORMATS:
+            return None
+        path = self.path(profile_id, kind)
+        return path if os.path.exists(path) else None
+
+
+def get_profile_store():
+    return current_app.extensions.get('profiles')
+
+
+def profiling_requested():
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    if flag not in ('1', 'true'):
+        return False
+    return current_user.is_authenticated and current_user.is_admin()
+
+
+def start_profile():
+    if not profiling_requested():
+        return
+    sampler = StackSampler(threading.get_ident(), current_app.config.get('PROFILE_SAMPLE_INTERVAL', 0.001))
+    profiler = cProfile.Profile()
+    g.profile = (profiler, sampler, time.perf_counter())
+    sampler.start()
+    profiler.enable()
+
+
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profiler, sampler, started = profile
+    profiler.disable()
+    sampler.stop()
+    profile_id = get_profile_store().save(profiler, sampler, {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+        'user': current_user.username,
+        'samples': sum(sampler.stacks.values()),
+    })
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def discard_profile(exc):
+    # after_request не вызывался (ошибка при формировании ответа):
+    # профилировщик всё равно нужно снять с потока.
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile[0].disable()
+        profile[1].stop()
+
+
+def default_profile_dir(app):
+    digest = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'task-manager-profiles-{digest}')
+
+
+def init_profiler(app):
+    if not app.config.get('PROFILER_ENABLED', True):
+        return
+    app.extensions['profiles'] = ProfileStore(
+        app.config.get('PROFILE_DIR') or default_profile_dir(app),
+        size=app.config.get('PROFILE_RING_SIZE', 20)
+    )
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(discard_profile)
@@ -0,0 +1,148 @@
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Project, ProjectOpenDeadline, ProjectStats, Task, chunked
+from app.versioning import next_revision
+
+TRACKED_ATTRS = ('project', 'project_id', 'status', 'completed_at', 'deadline')
+STAT_COLUMNS = ('total',) + Task.STATUSES
+
+
+def _state_query():
+    return (select(Task.project_id, Task.status, Task.completed_at.is_(None), Task.deadline,
+                   func.count(Task.id))
+            .where(Task.project_id.isnot(None))
+            .group_by(Task.project_id, Task.status, Task.completed_at.is_(None), Task.deadline))
+
+
+def _add_rows(counts, rows, sign=1):
+    for project_id, status, is_open, deadline, count in rows:
+        counts[('total', project_id)] += sign * count
+        if status in Task.STATUSES:
+            counts[(status, project_id)] += sign * count
+        if is_open and deadline is not None:
+            counts[('deadline', project_id, deadline)] += sign * count
+    return counts
+
+
+def task_state_counts(connection, task_ids):
+    # Вклад перечисленных задач в статистику проектов в текущем состоянии БД.
+    counts = Counter()
+    for chunk in chunked(list(task_ids)):
+        _add_rows(counts, connection.execute(_state_query().where(Task.id.in_(chunk))))
+    return counts
+
+
+def _upsert(connection, model, keys, rows):
+    # INSERT ... ON CONFLICT DO UPDATE col = col + excluded.col одним
+    # executemany на все строки; у строк одинаковый набор колонок.
+    if not rows:
+        return
+    table = model.__table__
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    stmt = dialect.insert(table)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: table.c[name] + stmt.excluded[name] for name in rows[0] if name not in keys}
+    ), rows)
+
+
+def apply_delta(connection, before, after):
+    # Применяет разницу after - before к таблицам статистики и поднимает
+    # version затронутых проектов, чтобы сменились их ETag.
+    delta = Counter(after)
+    delta.subtract(before)
+    stats, deadlines = {}, {}
+    for key, value in delta.items():
+        if not value:
+            continue
+        if key[0] == 'deadline':
+            deadlines[(key[1], key[2])] = value
+        else:
+            stats.setdefault(key[1], {})[key[0]] = value
+    _upsert(connection, ProjectStats, ('project_id',), [
+        dict({name: values.get(name, 0) for name in STAT_COLUMNS}, project_id=project_id)
+        for project_id, values in stats.items()
+    ])
+    _upsert(connection, ProjectOpenDeadline, ('project_id', 'deadline'), [
+        {'project_id': project_id, 'deadline': deadline, 'open_count': value}
+        for (project_id, deadline), value in deadlines.items()
+    ])
+    deadline_projects = {project_id for project_id, _ in deadlines}
+    for chunk in chunked(list(deadline_projects)):
+        connection.execute(delete(ProjectOpenDeadline).where(
+            ProjectOpenDeadline.project_id.in_(chunk), ProjectOpenDeadline.open_count <= 0
+        ))
+    projects = set(stats) | deadline_projects
+    if projects:
+        revision = next_revision(connection)
+        for chunk in chunked(list(projects)):
+            connection.execute(
+                update(Project.__table__).where(Project.id.in_(chunk))
+                .values(version=revision, updated_at=datetime.now())
+            )
+
+
+def _changed_tasks(session):
+    tasks = []
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Task) or obj.id is None:
+            continue
+        state = inspect(obj)
+        if obj in session.deleted or any(state.attrs[a].history.has_changes() for a in TRACKED_ATTRS):
+            tasks.append(obj)
+    return tasks
+
+
+@event.listens_for(Session, 'before_flush')
+def capture_project_stats(session, flush_context, instances):
+    # До flush в БД ещё старое состояние задач: запоминаем их вклад одним
+    # запросом, после flush тем же запросом читаем новый.
+    session.info.pop('project_stats_pending', None)
+    changed = _changed_tasks(session)
+    new_tasks = [obj for obj in session.new if isinstance(obj, Task)]
+    deleted_projects = [obj.id for obj in session.deleted if isinstance(obj, Project)]
+    if not changed and not new_tasks and not deleted_projects:
+        return
+    connection = session.connection()
+    for chunk in chunked(deleted_projects):
+        connection.execute(delete(ProjectStats).where(ProjectStats.project_id.in_(chunk)))
+        connection.execute(delete(ProjectOpenDeadline).where(ProjectOpenDeadline.project_id.in_(chunk)))
+    session.info['project_stats_pending'] = (
+        [t.id for t in changed],
+        new_tasks,
+        task_state_counts(connection, [t.id for t in changed])
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def update_project_stats(session, flush_context):
+    pending = session.info.pop('project_stats_pending', None)
+    if pending is None:
+        return
+    changed_ids, new_tasks, before = pending
+    connection = session.connection()
+    after = task_state_counts(connection, changed_ids + [t.id for t in new_tasks])
+    apply_delta(connection, before, after)
+
+
+def rebuild_project_stats(connection):
+    # Пересчитывает статистику всех проектов с нуля. Возвращает id проектов,
+    # у которых сохранённые значения расходились с пересчитанными.
+    expected = _add_rows(Counter(), connection.execute(_state_query()))
+    stored = Counter()
+    for row in connection.execute(select(ProjectStats.__table__)):
+        for name in STAT_COLUMNS:
+            stored[(name, row.project_id)] += getattr(row, name)
+    for project_id, deadline, count in connection.execute(select(ProjectOpenDeadline.__table__)):
+        stored[('deadline', project_id, deadline)] += count
+    drifted = {key[1] for key in set(expected) | set(stored) if expected[key] != stored[key]}
+
+    connection.execute(delete(ProjectOpenDeadline))
+    connection.execute(delete(ProjectStats))
+    apply_delta(connection, Counter(), expected)
+    return sorted(drifted)
@@ -0,0 +1,63 @@
+import time
+
+from flask import current_app, has_request_context, request, session as web_session
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = 'replica'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Метка в cookie-сессии: до этого момента чтения пользователя идут
+# в основную базу, чтобы он сразу видел свои изменения.
+PRIMARY_UNTIL_KEY = '_db_primary_until'
+
+
+def reads_from_replica():
+    if not has_request_context() or request.method not in SAFE_METHODS:
+        return False
+    return web_session.get(PRIMARY_UNTIL_KEY, 0) <= time.time()
+
+
+class RoutingSession(BaseSession):
+    # SELECT в безопасных запросах уходят на реплику, всё остальное — запись,
+    # flush, Core UPDATE/DELETE и чтения после записи в той же транзакции —
+    # в основную базу.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and isinstance(clause, Select)
+                and not self.info.get('wrote') and reads_from_replica()):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                self.info['replica_read'] = True
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def used_replica(session):
+    # Данные сессии могли быть прочитаны с отстающей реплики.
+    return session.info.get('replica_read', False)
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def mark_flush(session, flush_context, instances):
+    # Отметка ставится до flush, чтобы и чтения внутри него шли в основную базу.
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def mark_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def pin_to_primary(session):
+    if not session.info.pop('wrote', False) or not has_request_context():
+        return
+    if REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {}):
+        window = current_app.config['DB_READ_YOUR_WRITES_SECONDS']
+        web_session[PRIMARY_UNTIL_KEY] = time.time() + window
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_writes(session):
+    session.info.pop('wrote', None)
@@ -0,0 +1,148 @@
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import column, event, func, literal_column, or_, table, text
+
+from app.models import Comment, Task, db
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Веса bm25 по колонкам: совпадение в заголовке важнее, чем в описании
+# и комментариях.
+RANK_WEIGHTS = (10.0, 4.0, 1.0)
+SNIPPET_TOKENS = 12
+
+# Границы совпадения в сниппете. Управляющие символы не встречаются
+# в пользовательском тексте, поэтому их можно заменить на <mark> уже
+# после экранирования.
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+task_search = table('task_search', column('rowid'), column('title'),
+                    column('description'), column('comments'))
+
+_COMMENTS_OF = "coalesce((SELECT group_concat(content, ' ') FROM comment WHERE task_id = {0}), '')"
+
+# Индекс синхронизируется триггерами: так в него попадают и изменения
+# из массовых операций, которые обходят ORM.
+_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS task_search USING fts5("
+    "title, description, comments, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS task_search_ai AFTER INSERT ON task BEGIN "
+    "INSERT INTO task_search (rowid, title, description, comments) "
+    "VALUES (new.id, new.title, coalesce(new.description, ''), ''); END",
+    "CREATE TRIGGER IF NOT EXISTS task_search_au AFTER UPDATE OF title, description ON task BEGIN "
+    "UPDATE task_search SET title = new.title, description = coalesce(new.description, '') "
+    "WHERE rowid = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS task_search_ad AFTER DELETE ON task BEGIN "
+    "DELETE FROM task_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS comment_search_ai AFTER INSERT ON comment BEGIN "
+    f"UPDATE task_search SET comments = {_COMMENTS_OF.format('new.task_id')} "
+    "WHERE rowid = new.task_id; END",
+    "CREATE TRIGGER IF NOT EXISTS comment_search_au AFTER UPDATE OF content ON comment BEGIN "
+    f"UPDATE task_search SET comments = {_COMMENTS_OF.format('new.task_id')} "
+    "WHERE rowid = new.task_id; END",
+    "CREATE TRIGGER IF NOT EXISTS comment_search_ad AFTER DELETE ON comment BEGIN "
+    f"UPDATE task_search SET comments = {_COMMENTS_OF.format('old.task_id')} "
+    "WHERE rowid = old.task_id; END",
+]
+
+
+class SearchError(ValueError):
+    pass
+
+
+def fts_available(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def install(connection):
+    if not fts_available(connection):
+        return
+    for statement in _DDL:
+        connection.execute(text(statement))
+
+
+def drop_triggers(connection):
+    # Для массовой загрузки: без триггеров строки вставляются в разы
+    # быстрее, после загрузки индекс строится заново через rebuild().
+    if not fts_available(connection):
+        return
+    for name in ('task_search_ai', 'task_search_au', 'task_search_ad',
+                 'comment_search_ai', 'comment_search_au', 'comment_search_ad'):
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+
+
+def rebuild(connection):
+    # Полностью перестраивает индекс по текущим задачам и комментариям.
+    # Возвращает число проиндексированных задач.
+    if not fts_available(connection):
+        return 0
+    install(connection)
+    connection.execute(text('DELETE FROM task_search'))
+    result = connection.execute(text(
+        'INSERT INTO task_search (rowid, title, description, comments) '
+        "SELECT id, title, coalesce(description, ''), " + _COMMENTS_OF.format('task.id') + ' FROM task'
+    ))
+    return result.rowcount
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    install(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    if fts_available(connection):
+        connection.execute(text('DROP TABLE IF EXISTS task_search'))
+
+
+def match_expression(q):
+    # Пользовательский ввод не передаётся в MATCH как есть: каждое слово
+    # берётся в кавычки, поэтому операторы FTS5 в запросе не вызывают
+    # синтаксических ошибок. Все слова обязательны, последнее ищется
+    # по префиксу.
+    words = re.findall(r'\w+', q or '')
+    if not words:
+        raise SearchError('Search query is empty')
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(snippet):
+    if snippet is None:
+        return None
+    html = str(escape(snippet))
+    return Markup(html.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+def search_tasks(query, q, limit=DEFAULT_SEARCH_LIMIT):
+    # query — уже отфильтрованный по видимости Task.query. Возвращает
+    # список (task, snippet) по убыванию релевантности.
+    match = match_expression(q)
+    if not fts_available(db.engine):
+        return _search_like(query, q, limit)
+
+    index = literal_column('task_search')
+    rank = func.bm25(index, *RANK_WEIGHTS)
+    snippet = func.snippet(index, -1, _MARK_START, _MARK_END, '…', SNIPPET_TOKENS)
+    rows = (query.join(task_search, task_search.c.rowid == Task.id)
+            .filter(index.op('MATCH')(match))
+            .add_columns(snippet)
+            .order_by(rank, Task.id)
+            .limit(limit)
+            .all())
+    return [(task, highlight(fragment)) for task, fragment in rows]
+
+
+def _search_like(query, q, limit):
+    # Запасной вариант для баз без FTS5: без ранжирования и сниппетов.
+    conditions = []
+    for word in re.findall(r'\w+', q):
+        pattern = f'%{word}%'
+        conditions.append(or_(Task.title.ilike(pattern), Task.description.ilike(pattern),
+                              Task.comments.any(Comment.content.ilike(pattern))))
+    tasks = query.filter(*conditions).order_by(Task.id.desc()).limit(limit).all()
+    return [(task, None) for task in tasks]
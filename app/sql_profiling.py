@@ -0,0 +1,116 @@
+import re
+import time
+from collections import Counter, defaultdict
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+
+from app import db
+
+# Значения по умолчанию; включается SQL_PROFILING=true (FLASK_SQL_PROFILING).
+SQL_PROFILING_DEFAULTS = {
+    'SQL_PROFILING': False,
+    'SQL_SLOW_REQUEST_MS': 500,
+    'SQL_SLOW_REQUEST_QUERIES': 50,
+    # Сколько раз один и тот же запрос с разными параметрами считается N+1.
+    'SQL_N_PLUS_ONE_THRESHOLD': 5,
+}
+
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    # Текст запроса без различий в пробелах и длине списков IN (...):
+    # запросы одной формы отличаются только параметрами.
+    return _IN_LIST.sub('(?)', _SPACES.sub(' ', statement).strip())
+
+
+class QueryLog:
+    def __init__(self):
+        self.statements = []
+
+    def record(self, statement, parameters, duration):
+        self.statements.append((statement, repr(parameters), duration))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(duration for _, _, duration in self.statements)
+
+    def repeated(self, threshold):
+        # Формы запросов, выполненные не меньше threshold раз с разными
+        # параметрами: [(форма, число выполнений)], самые частые первыми.
+        counts, params = Counter(), defaultdict(set)
+        for statement, parameters, _ in self.statements:
+            shape = statement_shape(statement)
+            counts[shape] += 1
+            params[shape].add(parameters)
+        return [(shape, count) for shape, count in counts.most_common()
+                if count >= threshold and len(params[shape]) > 1]
+
+    def report(self, threshold):
+        lines = [f'{i}. {duration * 1000:.2f} ms {statement_shape(statement)}'
+                 for i, (statement, _, duration) in enumerate(self.statements, 1)]
+        for shape, count in self.repeated(threshold):
+            lines.append(f'N+1: {count}x {shape}')
+        return '\n'.join(lines)
+
+
+def current_query_log():
+    if has_app_context():
+        return g.get('sql_query_log')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_query_log() is not None:
+        conn.info.setdefault('sql_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = current_query_log()
+    starts = conn.info.get('sql_query_start')
+    if log is not None and starts:
+        log.record(statement, parameters, time.perf_counter() - starts.pop())
+
+
+def start_request_profile():
+    g.sql_query_log = QueryLog()
+    g.sql_request_start = time.perf_counter()
+
+
+def finish_request_profile(response):
+    log = g.pop('sql_query_log', None)
+    if log is None:
+        return response
+    config = current_app.config
+    elapsed = time.perf_counter() - g.pop('sql_request_start')
+    response.headers.add('Server-Timing', f'db;dur={log.duration * 1000:.2f};desc="{log.count} queries"')
+    response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+
+    threshold = config['SQL_N_PLUS_ONE_THRESHOLD']
+    if (elapsed * 1000 >= config['SQL_SLOW_REQUEST_MS']
+            or log.count >= config['SQL_SLOW_REQUEST_QUERIES'] or log.repeated(threshold)):
+        current_app.logger.warning(
+            'Slow request %s %s: %.2f ms, %d SQL statements (%.2f ms)\n%s',
+            request.method, request.full_path.rstrip('?'), elapsed * 1000,
+            log.count, log.duration * 1000, log.report(threshold)
+        )
+    return response
+
+
+def init_sql_profiling(app):
+    for key, value in SQL_PROFILING_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if not app.config['SQL_PROFILING']:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
@@ -0,0 +1,66 @@
+from datetime import date
+
+from sqlalchemy import case, func
+from werkzeug.datastructures import MultiDict
+
+from app.cache import get_task_list_cache
+from app.models import Task
+
+
+def visible_tasks(user):
+    # Администратор видит все задачи, как на странице /tasks.
+    if user.is_admin():
+        return Task.query
+    return Task.query.filter(Task.visible_to_filter(user))
+
+
+def _empty_counts():
+    return {'total': 0, 'by_status': dict.fromkeys(Task.STATUSES, 0), 'overdue': 0, 'due_today': 0}
+
+
+def compute_task_stats(user):
+    # Все счётчики считаются одним GROUP BY по (status, project_id): строк
+    # в результате не больше, чем статусов × проектов, а суммы по статусам
+    # и проектам собираются уже в Python.
+    today = date.today()
+    open_task = Task.completed_at.is_(None)
+    rows = (visible_tasks(user)
+            .with_entities(
+                Task.status, Task.project_id, func.count(Task.id),
+                func.sum(case((open_task & (Task.deadline < today), 1), else_=0)),
+                func.sum(case((open_task & (Task.deadline == today), 1), else_=0)))
+            .group_by(Task.status, Task.project_id)
+            .all())
+
+    stats = _empty_counts()
+    projects = {}
+    for status, project_id, total, overdue, due_today in rows:
+        project = projects.setdefault(project_id, _empty_counts())
+        for counts in (stats, project):
+            counts['total'] += total
+            counts['overdue'] += overdue or 0
+            counts['due_today'] += due_today or 0
+            if status in counts['by_status']:
+                counts['by_status'][status] += total
+    stats['by_project'] = [
+        dict(project_id=project_id, **counts)
+        for project_id, counts in sorted(projects.items(), key=lambda item: (item[0] is None, item[0] or 0))
+    ]
+    return stats
+
+
+def task_stats(user):
+    # Результат кэшируется вместе со списками задач
+    # и сбрасывается теми же поколениями: любое изменение задачи инвалидирует
+    # статистику её автора, исполнителей и администраторов.
+    cache = get_task_list_cache()
+    cache_key = None
+    if cache:
+        cache_key = cache.make_key('stats', None if user.is_admin() else user.id, MultiDict())
+        stats = cache.get(cache_key)
+        if stats:
+            return stats
+    stats = compute_task_stats(user)
+    if cache:
+        cache.set(cache_key, stats)
+    return stats
@@ -0,0 +1,172 @@
+import base64
+import binascii
+import itertools
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, insert, inspect, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.cache import task_audience
+from app.events import encode_audience
+from app.models import Comment, Revision, Subtask, Task, Tombstone, db
+from app.pagination import MAX_PAGE_SIZE
+
+DEFAULT_RETENTION = 30 * 24 * 3600  # секунд
+PRUNE_EVERY = 100
+TOMBSTONE_KINDS = {Task: 'task', Comment: 'comment', Subtask: 'subtask'}
+# Задача осталась, но пользователь из audience её больше не видит.
+REVOKED = 'revoked'
+
+_flushes = itertools.count(1)
+
+
+class SyncError(ValueError):
+    pass
+
+
+class ResyncRequired(Exception):
+    pass
+
+
+def encode_token(revision, last_id=None, issued_at=None):
+    # r — ревизия, до которой клиент получил все изменения; id — последняя
+    # выданная задача ревизии r, если страница оборвалась внутри неё;
+    # t — время выдачи, по нему проверяется срок хранения удалений.
+    payload = json.dumps({'r': revision, 'id': last_id, 't': int(issued_at or time.time())})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = data['id']
+        return int(data['r']), None if last_id is None else int(last_id), int(data['t'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise SyncError('Invalid token')
+
+
+def retention():
+    return current_app.config.get('SYNC_TOMBSTONE_RETENTION', DEFAULT_RETENTION)
+
+
+@event.listens_for(Session, 'before_flush')
+def collect_tombstones(session, flush_context, instances):
+    # Аудитория считается до flush, как и в журнале событий.
+    pending = []
+    deleted_tasks = {obj.id for obj in session.deleted if isinstance(obj, Task)}
+    for obj in session.deleted:
+        kind = TOMBSTONE_KINDS.get(type(obj))
+        if kind is None or obj.id is None:
+            continue
+        if kind == 'task':
+            pending.append((kind, obj.id, obj.id, task_audience(obj)))
+        elif obj.task_id not in deleted_tasks:
+            task = obj.task or session.get(Task, obj.task_id)
+            if task is not None:
+                pending.append((kind, obj.id, task.id, task_audience(task)))
+    for obj in session.dirty:
+        if isinstance(obj, Task) and obj not in session.deleted:
+            history = inspect(obj).attrs.assignees.history
+            revoked = {u.id for u in history.deleted or ()} - {u.id for u in obj.assignees} - {obj.user_id}
+            if revoked:
+                pending.append((REVOKED, obj.id, obj.id, revoked))
+    if pending:
+        session.info.setdefault('tombstones', []).extend(pending)
+
+
+@event.listens_for(Session, 'after_flush')
+def write_tombstones(session, flush_context):
+    # Ревизию flush выдаёт versioning.bump_versions: удаление задачи,
+    # комментария или подзадачи и снятие исполнителя всегда её получают.
+    revision = session.info.pop('flush_revision', None)
+    pending = session.info.pop('tombstones', None)
+    if not pending or revision is None:
+        return
+    now = datetime.now()
+    connection = session.connection()
+    connection.execute(insert(Tombstone.__table__), [
+        {'kind': kind, 'object_id': object_id, 'task_id': task_id, 'revision': revision,
+         'audience': encode_audience(audience), 'deleted_at': now}
+        for kind, object_id, task_id, audience in pending
+    ])
+    if next(_flushes) % PRUNE_EVERY == 0:
+        prune_tombstones(connection)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_tombstones(session):
+    session.info.pop('tombstones', None)
+    session.info.pop('flush_revision', None)
+
+
+def record_revocations(connection, revoked, revision):
+    # Для массового снятия исполнителей мимо событий сессии:
+    # revoked — {task_id: {user_id, ...}}.
+    now = datetime.now()
+    rows = [{'kind': REVOKED, 'object_id': task_id, 'task_id': task_id, 'revision': revision,
+             'audience': encode_audience(users), 'deleted_at': now}
+            for task_id, users in revoked.items() if users]
+    if rows:
+        connection.execute(insert(Tombstone.__table__), rows)
+
+
+def prune_tombstones(connection):
+    cutoff = datetime.now() - timedelta(seconds=retention())
+    return connection.execute(delete(Tombstone).where(Tombstone.deleted_at < cutoff)).rowcount
+
+
+def current_revision():
+    return db.session.execute(select(Revision.value).where(Revision.id == 1)).scalar() or 0
+
+
+def _tombstones(user, after, upto):
+    query = select(Tombstone.kind, Tombstone.object_id) \
+        .where(Tombstone.revision > after, Tombstone.revision <= upto)
+    if user.is_admin():
+        query = query.where(Tombstone.kind != REVOKED)
+    else:
+        query = query.where(Tombstone.audience.like(f'%,{user.id},%'))
+    deleted = {'tasks': set(), 'comments': set(), 'subtasks': set()}
+    for kind, object_id in db.session.execute(query.order_by(Tombstone.id)):
+        deleted['tasks' if kind == REVOKED else kind + 's'].add(object_id)
+    return deleted
+
+
+def task_changes(user, token=None, limit=MAX_PAGE_SIZE):
+    # Задачи, созданные или изменённые после token, и удалённые объекты.
+    # Без token — все видимые задачи (полная синхронизация) постранично.
+    # Возвращает (tasks, deleted, next_token, has_more).
+    now = time.time()
+    snapshot = current_revision()
+    after, last_id, issued_at = decode_token(token) if token else (0, None, now)
+    if token and (issued_at < now - retention() or after > snapshot):
+        # Удаления после выдачи токена могли быть уже вычищены
+        # (или база пересоздана): клиенту нужна полная синхронизация.
+        raise ResyncRequired()
+
+    query = Task.query.filter(Task.visible_to_filter(user), Task.version <= snapshot)
+    if last_id is None:
+        query = query.filter(Task.version > after)
+    else:
+        query = query.filter(tuple_(Task.version, Task.id) > tuple_(after, last_id))
+    tasks = query.order_by(Task.version, Task.id).limit(limit + 1).all()
+
+    has_more = len(tasks) > limit
+    if has_more:
+        tasks = tasks[:limit]
+        upto = tasks[-1].version
+        next_token = encode_token(upto, tasks[-1].id, issued_at)
+    else:
+        upto = snapshot
+        next_token = encode_token(snapshot, issued_at=now)
+
+    deleted = {'tasks': set(), 'comments': set(), 'subtasks': set()}
+    if token:
+        deleted = _tombstones(user, after, upto)
+        # Задача, которую пользователь снова видит, приходит в tasks.
+        deleted['tasks'] -= {t.id for t in tasks}
+    return tasks, {key: sorted(ids) for key, ids in deleted.items()}, next_token, has_more
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+from sqlalchemy import event, insert, update
+from sqlalchemy.orm import Session
+
+from app.models import Comment, Project, Revision, Subtask, Task
+
+
+def next_revision(connection):
+    # UPDATE блокирует строку счётчика до конца транзакции, поэтому номера
+    # ревизий фиксируются в том же порядке, в котором их выдали.
+    table = Revision.__table__
+    value = connection.execute(
+        update(table).where(table.c.id == 1).values(value=table.c.value + 1).returning(table.c.value)
+    ).scalar()
+    if value is None:
+        connection.execute(insert(table).values(id=1, value=1))
+        value = 1
+    return value
+
+
+def pending_changes(session):
+    # Задачи и проекты, которые затронет ближайший flush, включая удаляемые
+    # и родительские задачи изменённых комментариев и подзадач.
+    touched = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Task, Project)):
+            if obj in session.dirty and not session.is_modified(obj):
+                continue
+            touched.add(obj)
+        elif isinstance(obj, (Comment, Subtask)):
+            task = obj.task
+            if task is None and obj.task_id is not None:
+                task = session.get(Task, obj.task_id)
+            if task is not None:
+                touched.add(task)
+    return touched
+
+
+@event.listens_for(Session, 'before_flush')
+def bump_versions(session, flush_context, instances):
+    # Ревизия берётся и для flush, который только удаляет: блокировка строки
+    # счётчика упорядочивает по времени фиксации и записи журнала событий.
+    changes = pending_changes(session)
+    if not changes:
+        return
+    revision = next_revision(session.connection())
+    session.info['flush_revision'] = revision
+    now = datetime.now()
+    for obj in changes:
+        if obj not in session.deleted:
+            obj.version = revision
+            obj.updated_at = now
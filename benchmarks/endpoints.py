@@ -0,0 +1,230 @@
+"""Бенчмарк API и HTML-страниц на наборах данных разного размера.
+
+    python -m benchmarks.endpoints [--sizes 1000,100000,1000000] [--requests 50]
+        [--output results.json] [--baseline baseline.json] [--tolerance 0.25]
+
+Для каждого размера генерируется база (seed_db.generate; готовые базы
+кэшируются в --workdir и копируются перед каждым прогоном, так что запись
+не меняет исходный набор). Каждый сценарий выполняется --requests раз через
+тестовый клиент Flask от имени исполнителя; записываются пропускная
+способность, задержки (среднее, p50, p95, p99, максимум) и число SQL на
+запрос. Результаты пишутся в JSON; с --baseline сценарии, ставшие медленнее
+допуска по p50 или выполняющие больше SQL, печатаются как регрессии,
+и команда завершается с кодом 1.
+"""
+import argparse
+import json
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import event, select
+
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import Project, Task, task_assignees
+from seed_db import SHARED_PASSWORD as PASSWORD, generate, seed_shape
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+
+
+def build_app(path, cache):
+    return create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'TASK_LIST_CACHE_ENABLED': cache,
+        'USER_CACHE_VERSION_FILE': str(path.with_suffix('.version')),
+        'TASK_LIST_CACHE_DIR': str(path.with_suffix('.task-lists')),
+        'PASSWORD_HASH_WORKERS': 0,
+        'METRICS_ENABLED': False,
+        'PROFILER_ENABLED': False,
+    })
+
+
+def prepare_dataset(workdir, size, seed):
+    # Готовая база переиспользуется между запусками: генерация 1M задач
+    # занимает минуты.
+    path = workdir / f'dataset-{size}-{seed}.db'
+    if not path.exists():
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.unlink(missing_ok=True)
+        app = build_app(tmp_path, cache=False)
+        with app.app_context():
+            upgrade()
+            started = time.perf_counter()
+            generate(db.engine, tasks=size, seed=seed)
+            print(f'  набор {size}: сгенерирован за {time.perf_counter() - started:.1f} с', file=sys.stderr)
+            db.engine.dispose()
+        tmp_path.rename(path)
+    return path
+
+
+def pick_subjects(size):
+    # Исполнитель и задача, которую он видит, и проект с задачами.
+    worker_id = seed_shape(size)['managers'] + 2
+    task_id = db.session.scalar(
+        select(task_assignees.c.task_id).where(task_assignees.c.user_id == worker_id)
+        .order_by(task_assignees.c.task_id).limit(1)
+    )
+    project_id = db.session.scalar(select(Task.project_id).where(Task.id == task_id)) \
+        or db.session.scalar(select(Project.id).limit(1))
+    return 'worker1', task_id, project_id
+
+
+def scenarios(task_id, project_id):
+    # (имя, метод, адрес, данные); {n} — номер повтора.
+    today = date.today().isoformat()
+    return [
+        ('api.get_tasks', 'GET', '/api/tasks', None),
+        ('api.get_tasks?limit=500', 'GET', '/api/tasks?limit=500', None),
+        ('api.get_tasks?status=in_progress', 'GET', '/api/tasks?status=in_progress', None),
+        ('api.get_tasks?overdue=true', 'GET', '/api/tasks?overdue=true', None),
+        ('api.get_tasks?due_today=true', 'GET', '/api/tasks?due_today=true', None),
+        ('api.get_tasks?project_id', 'GET', f'/api/tasks?project_id={project_id}', None),
+        ('api.get_task', 'GET', f'/api/tasks/{task_id}', None),
+        ('main.tasks', 'GET', '/tasks', None),
+        ('main.view_task', 'GET', f'/task/{task_id}', None),
+        ('api.create_task', 'POST', '/api/tasks', {'title': 'Бенчмарк {n}', 'deadline': today}),
+        ('api.update_task', 'PUT', None, {'title': 'Изменено {n}', 'priority': 3}),
+        ('auth.login', 'POST', '/login', None),
+    ]
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(client, statements, method, url, data, requests, username):
+    latencies, queries = [], 0
+    for n in range(requests + 1):
+        kwargs = {}
+        if url == '/login':
+            kwargs['data'] = {'username': username, 'password': PASSWORD}
+        elif data is not None:
+            kwargs['json'] = {k: v.format(n=n) if isinstance(v, str) else v for k, v in data.items()}
+        statements.clear()
+        started = time.perf_counter()
+        rv = client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        if rv.status_code >= 400:
+            raise RuntimeError(f'{method} {url}: {rv.status_code}')
+        if n:  # первый запрос — прогрев
+            latencies.append(elapsed)
+            queries += len(statements)
+    latencies.sort()
+    return {
+        'requests': requests,
+        'throughput_rps': round(requests / sum(latencies), 2),
+        'latency_ms': {
+            'mean': round(sum(latencies) / requests * 1000, 3),
+            'p50': round(_percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(_percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(_percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+        },
+        'queries_per_request': round(queries / requests, 2),
+    }
+
+
+def run_size(workdir, size, seed, requests, cache):
+    source = prepare_dataset(workdir, size, seed)
+    path = workdir / f'run-{size}.db'
+    shutil.copy(source, path)
+    app = build_app(path, cache)
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        username, task_id, project_id = pick_subjects(size)
+        db.session.remove()
+
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    created_id = client.post('/api/tasks', json={'title': 'Для изменения'}).get_json()['id']
+    results = {}
+    for name, method, url, data in scenarios(task_id, project_id):
+        url = url or f'/api/tasks/{created_id}'
+        results[name] = run_scenario(client, statements, method, url, data, requests, username)
+        print(f'  {size:>8} {name:<34} p50 {results[name]["latency_ms"]["p50"]:>9.2f} мс  '
+              f'{results[name]["queries_per_request"]:>6.1f} SQL', file=sys.stderr)
+
+    with app.app_context():
+        db.engine.dispose()
+    path.unlink()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Регрессия — p50 дольше базового больше чем на tolerance или больше SQL.
+    regressions = []
+    for size, scenarios_ in results.items():
+        for name, current in scenarios_.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if base is None:
+                continue
+            if current['latency_ms']['p50'] > base['latency_ms']['p50'] * (1 + tolerance):
+                regressions.append(f'{size} {name}: p50 {base["latency_ms"]["p50"]} → '
+                                   f'{current["latency_ms"]["p50"]} мс')
+            if current['queries_per_request'] > base['queries_per_request']:
+                regressions.append(f'{size} {name}: SQL {base["queries_per_request"]} → '
+                                   f'{current["queries_per_request"]}')
+    return regressions
+
+
+def run(sizes, requests, workdir, seed=0, cache=False):
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': seed,
+            'requests': requests,
+            'task_list_cache': cache,
+        },
+        'results': {str(size): run_size(workdir, size, seed, requests, cache) for size in sizes},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='папка для сгенерированных баз (по умолчанию временная)')
+    parser.add_argument('--cache', action='store_true', help='включить кэш списков задач')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    if args.workdir:
+        workdir = Path(args.workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+        report = run(sizes, args.requests, workdir, args.seed, args.cache)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            report = run(sizes, args.requests, Path(tmp), args.seed, args.cache)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'результаты: {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report['results'], json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'регрессия: {line}')
+        if regressions:
+            sys.exit(1)
+        print('регрессий нет')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Сравнение запросов с кэшем пользователей и без него.
+
+    python -m benchmarks.user_loader [--requests 2000]
+
+Для каждого режима выполняется одинаковая серия GET /api/projects от
+авторизованного пользователя; выводится среднее время запроса и число
+SQL-запросов на один HTTP-запрос.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import User
+
+
+def measure(enabled, requests, workdir):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{workdir / f"bench-{enabled}.db"}',
+        'USER_CACHE_ENABLED': enabled,
+        'USER_CACHE_VERSION_FILE': str(workdir / 'users.version'),
+        'TASK_LIST_CACHE_DIR': str(workdir / 'task-lists'),
+        'METRICS_ENABLED': False,
+        'PROFILER_ENABLED': False,
+    })
+    statements = []
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', access_level=1)
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+    client.get('/api/projects')  # прогрев
+
+    statements.clear()
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get('/api/projects')
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        db.engine.dispose()
+    return elapsed / requests * 1000, len(statements) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        results = {mode: measure(mode, args.requests, workdir) for mode in (False, True)}
+
+    for enabled, (ms, queries) in results.items():
+        label = 'с кэшем ' if enabled else 'без кэша'
+        print(f'{label}: {ms:.3f} мс/запрос, {queries:.2f} SQL/запрос')
+    saved = results[False][0] - results[True][0]
+    print(f'экономия: {saved:.3f} мс и {results[False][1] - results[True][1]:.2f} SQL на запрос')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,199 @@
+import argparse
 import os
+import random
 import sys
 from datetime import datetime, timedelta, date
 
 # Добавляем корневую папку в путь
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import create_app, db
-from app.models import User, Project, Task, Comment, Subtask
-
-def seed_database():
+from sqlalchemy import func, insert, select, text
+
+from app import create_app, db, search
+from app.models import User, Project, Task, Comment, Subtask, task_assignees
+from app.passwords import get_password_hasher
+from app.project_stats import rebuild_project_stats
+
+SHARED_PASSWORD = 'pass'
+ADMIN_PASSWORD = 'admin'
+CHUNK_SIZE = 10000
+
+PROJECT_NAMES = ['Разработка сайта', 'Мобильное приложение', 'Маркетинговая кампания']
+COLORS = ['#3498db', '#e74c3c', '#2ecc71', '#f39c12', '#9b59b6']
+TITLES = [
+    'Создать макет главной страницы',
+    'Реализовать авторизацию',
+    'Написать API для пользователей',
+    'Тестирование функционала',
+    'Подготовить презентацию',
+    'Настроить аналитику',
+    'Исправить баги в мобильной версии',
+    'Обновить документацию',
+    'Провести код-ревью',
+    'Развернуть на продакшене'
+]
+SUBTASK_TITLES = ['Исследование', 'Реализация', 'Тестирование', 'Документация']
+COMMENTS = [
+    'Начал работу над задачей',
+    'Возникли сложности с API',
+    'Требуется помощь менеджера',
+    'Задача почти готова',
+    'Проверьте, пожалуйста',
+    'Отличная работа!',
+    'Нужно доработать согласно ТЗ',
+    'Сроки горят!'
+]
+
+
+class SeedError(RuntimeError):
+    pass
+
+
+def seed_shape(tasks, users=None, projects=None, managers=None):
+    # По умолчанию около 50 задач на пользователя и 200 на проект; каждый
+    # десятый пользователь — менеджер (уровень 1), остальные — исполнители.
+    users = users or max(9, tasks // 50)
+    managers = managers or max(1, users // 10)
+    return {
+        'users': users,
+        'managers': managers,
+        'workers': max(1, users - managers - 1),
+        'projects': projects or max(3, tasks // 200),
+    }
+
+
+def _insert_chunks(connection, table, rows, chunk_size):
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(insert(table), rows[start:start + chunk_size])
+
+
+def _advance_sequences(connection):
+    # Строки вставлены с явными id: последовательности PostgreSQL нужно
+    # передвинуть, иначе следующая вставка через ORM получит id 1.
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in (User.__table__, Project.__table__, Task.__table__, Comment.__table__, Subtask.__table__):
+        name = connection.dialect.identifier_preparer.format_table(table)
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), coalesce(max(id), 0) + 1, false) FROM {name}"
+        ))
+
+
+def generate(engine, tasks=1000, users=None, projects=None, comments=2, subtasks=2, assignees=2,
+             seed=0, chunk_size=CHUNK_SIZE, progress=None, managers=None):
+    # Заполняет пустую базу. Одинаковые параметры и seed дают одинаковые
+    # данные; даты создания и дедлайны отсчитываются от текущего момента,
+    # чтобы доля просроченных задач не зависела от дня запуска. comments и subtasks —
+    # среднее число на задачу, assignees — максимальное число исполнителей.
+    # Каждая пачка из chunk_size задач со связанными строками вставляется
+    # своей транзакцией; progress(n) вызывается после каждой пачки.
+    rng = random.Random(seed)
+    shape = seed_shape(tasks, users, projects, managers)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(User.__table__)).scalar():
+            raise SeedError('База не пуста')
+
+    # Все пользователи, кроме администратора, получают один и тот же хэш.
+    hasher = get_password_hasher()
+    shared_hash = hasher.hash(SHARED_PASSWORD)
+    manager_ids = range(2, shape['managers'] + 2)
+    worker_ids = range(shape['managers'] + 2, shape['managers'] + shape['workers'] + 2)
+    now = datetime.now().replace(microsecond=0)
+    today = date.today()
+
+    with engine.begin() as conn:
+        users_rows = [{'id': 1, 'username': 'admin', 'access_level': 0,
+                       'password_hash': hasher.hash(ADMIN_PASSWORD)}]
+        users_rows += [{'id': user_id, 'username': f'manager{n}', 'access_level': 1,
+                        'password_hash': shared_hash} for n, user_id in enumerate(manager_ids, 1)]
+        users_rows += [{'id': user_id, 'username': f'worker{n}', 'access_level': 2,
+                        'password_hash': shared_hash} for n, user_id in enumerate(worker_ids, 1)]
+        _insert_chunks(conn, User.__table__, users_rows, chunk_size)
+        _insert_chunks(conn, Project.__table__, [
+            {'id': project_id, 'name': PROJECT_NAMES[(project_id - 1) % len(PROJECT_NAMES)]
+             + ('' if project_id <= len(PROJECT_NAMES) else f' {project_id}'),
+             'description': f'Проект №{project_id} для компании',
+             'color': COLORS[project_id % len(COLORS)], 'user_id': 1, 'version': 0}
+            for project_id in range(1, shape['projects'] + 1)
+        ], chunk_size)
+
+    # Полнотекстовый индекс строится один раз после загрузки; если загрузка
+    # прервётся, триггеры всё равно возвращаются на место.
+    with engine.begin() as conn:
+        search.drop_triggers(conn)
+    try:
+        totals = _generate_tasks(engine, rng, shape, tasks, comments, subtasks, assignees,
+                                 manager_ids, worker_ids, now, today, chunk_size, progress)
+    finally:
+        with engine.begin() as conn:
+            search.install(conn)
+
+    with engine.begin() as conn:
+        search.rebuild(conn)
+        rebuild_project_stats(conn)
+        _advance_sequences(conn)
+    return dict(shape, **totals)
+
+
+def _generate_tasks(engine, rng, shape, tasks, comments, subtasks, assignees,
+                    managers, workers, now, today, chunk_size, progress):
+    comment_id = subtask_id = 0
+    totals = {'tasks': 0, 'assignees': 0, 'comments': 0, 'subtasks': 0}
+    for start in range(1, tasks + 1, chunk_size):
+        task_rows, assignee_rows, comment_rows, subtask_rows = [], [], [], []
+        for task_id in range(start, min(start + chunk_size, tasks + 1)):
+            title = TITLES[rng.randrange(len(TITLES))]
+            status = Task.STATUSES[rng.randrange(len(Task.STATUSES))]
+            created_at = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+            for user_id in rng.sample(workers, min(len(workers), rng.randint(1, assignees))):
+                assignee_rows.append({'task_id': task_id, 'user_id': user_id})
+
+            n_comments = rng.randint(0, 2 * comments)
+            for j in range(n_comments):
+                comment_id += 1
+                comment_rows.append({
+                    'id': comment_id, 'task_id': task_id,
+                    'user_id': rng.choice(workers) if j % 2 == 0 else rng.choice(managers),
+                    'content': COMMENTS[rng.randrange(len(COMMENTS))],
+                    'created_at': created_at + timedelta(minutes=(j + 1) * 30)
+                })
+            n_subtasks = rng.randint(0, 2 * subtasks)
+            n_done = rng.randint(0, n_subtasks)
+            for j in range(n_subtasks):
+                subtask_id += 1
+                subtask_rows.append({
+                    'id': subtask_id, 'task_id': task_id, 'completed': j < n_done,
+                    'title': f'{SUBTASK_TITLES[j % len(SUBTASK_TITLES)]} для "{title[:20]}..."'
+                })
+
+            task_rows.append({
+                'id': task_id, 'title': title,
+                'description': f'Подробное описание задачи "{title}"',
+                'status': status, 'priority': rng.randint(1, 4),
+                'deadline': today + timedelta(days=rng.randint(-30, 60)) if rng.random() < 0.7 else None,
+                'user_id': rng.choice(managers),
+                'project_id': rng.randint(1, shape['projects']) if rng.random() < 0.8 else None,
+                'created_at': created_at,
+                'completed_at': created_at + timedelta(days=rng.randint(1, 14)) if status == 'done' else None,
+                'version': 0, 'comments_count': n_comments,
+                'subtasks_total': n_subtasks, 'subtasks_done': n_done,
+            })
+
+        with engine.begin() as conn:
+            conn.execute(insert(Task.__table__), task_rows)
+            _insert_chunks(conn, task_assignees, assignee_rows, chunk_size)
+            _insert_chunks(conn, Comment.__table__, comment_rows, chunk_size)
+            _insert_chunks(conn, Subtask.__table__, subtask_rows, chunk_size)
+        totals['tasks'] += len(task_rows)
+        totals['assignees'] += len(assignee_rows)
+        totals['comments'] += len(comment_rows)
+        totals['subtasks'] += len(subtask_rows)
+        if progress:
+            progress(len(task_rows))
+    return totals
+
+
+def seed_database(tasks=10, seed=0, **options):
     app = create_app()
     app.app_context().push()
 
@@ -16,144 +201,22 @@ def seed_database():
     db.drop_all()
     db.create_all()
 
-    # Создание пользователей
-    users = []
-    admin = User(username='admin', access_level=0)
-    admin.set_password('admin')
-    users.append(admin)
-
-    managers = []
-    for i in range(1, 4):
-        user = User(username=f'manager{i}', access_level=1)
-        user.set_password('pass')
-        users.append(user)
-        managers.append(user)
-
-    workers = []
-    for i in range(1, 6):
-        user = User(username=f'worker{i}', access_level=2)
-        user.set_password('pass')
-        users.append(user)
-        workers.append(user)
-
-    db.session.add_all(users)
-    db.session.commit()
-
-    # Создание проектов
-    projects = []
-    project_names = ['Разработка сайта', 'Мобильное приложение', 'Маркетинговая кампания']
-    colors = ['#3498db', '#e74c3c', '#2ecc71']
-    
-    for i, (name, color) in enumerate(zip(project_names, colors)):
-        project = Project(
-            name=name,
-            description=f'Проект {name.lower()} для компании',
-            color=color,
-            user_id=admin.id
-        )
-        projects.append(project)
-        db.session.add(project)
-    db.session.commit()
-
-    # Создание задач
-    tasks = []
-    statuses = ['todo', 'in_progress', 'review', 'done']
-    priorities = [1, 2, 3, 4]
-    titles = [
-        'Создать макет главной страницы',
-        'Реализовать авторизацию',
-        'Написать API для пользователей',
-        'Тестирование функционала',
-        'Подготовить презентацию',
-        'Настроить аналитику',
-        'Исправить баги в мобильной версии',
-        'Обновить документацию',
-        'Провести код-ревью',
-        'Развернуть на продакшене'
-    ]
-
-    for i, title in enumerate(titles):
-        status = statuses[i % len(statuses)]
-        priority = priorities[i % len(priorities)]
-        project = projects[i % len(projects)]
-        author = managers[i % len(managers)]
-        
-        # Дедлайн: от сегодня до +30 дней
-        deadline = date.today() + timedelta(days=(i * 3) % 30)
-        
-        task = Task(
-            title=title,
-            description=f'Подробное описание задачи "{title}"',
-            status=status,
-            priority=priority,
-            deadline=deadline,
-            user_id=author.id,
-            project_id=project.id,
-            created_at=datetime.now() - timedelta(hours=i*2)
-        )
-        tasks.append(task)
-        db.session.add(task)
-    db.session.commit()
-
-    # Назначение исполнителей
-    for i, task in enumerate(tasks):
-        # Назначаем 1-2 исполнителей
-        assignees = []
-        if i % 3 == 0:
-            assignees = workers[:2]
-        elif i % 3 == 1:
-            assignees = [workers[i % len(workers)]]
-        else:
-            assignees = [workers[(i+1) % len(workers)]]
-        
-        task.assignees.extend(assignees)
-    db.session.commit()
-
-    # Создание подзадач
-    subtask_titles = ['Исследование', 'Реализация', 'Тестирование', 'Документация']
-    for i, task in enumerate(tasks):
-        for j in range(2 + (i % 3)):
-            completed = (j == 0)  # Первую подзадачу помечаем как выполненную
-            subtask = Subtask(
-                title=f'{subtask_titles[j % len(subtask_titles)]} для "{task.title[:20]}..."',
-                completed=completed,
-                task_id=task.id
-            )
-            db.session.add(subtask)
-    db.session.commit()
-
-    # Создание комментариев
-    comments = [
-        'Начал работу над задачей',
-        'Возникли сложности с API',
-        'Требуется помощь менеджера',
-        'Задача почти готова',
-        'Проверьте, пожалуйста',
-        'Отличная работа!',
-        'Нужно доработать согласно ТЗ',
-        'Сроки горят!'
-    ]
-    
-    for i, task in enumerate(tasks):
-        for j in range(i % 4):  # 0-3 комментария на задачу
-            author = workers[j % len(workers)] if j % 2 == 0 else managers[j % len(managers)]
-            comment = Comment(
-                content=comments[(i + j) % len(comments)],
-                user_id=author.id,
-                task_id=task.id,
-                created_at=task.created_at + timedelta(minutes=(j+1)*30)
-            )
-            db.session.add(comment)
-    db.session.commit()
+    # Демо-набор: администратор, manager1–3 и worker1–5.
+    options = dict({'users': 9, 'managers': 3}, **options)
+    totals = generate(db.engine, tasks=tasks, seed=seed, **options)
 
     print('База данных успешно заполнена тестовыми данными!')
-    print(f'Пользователей: {len(users)}')
-    print(f'Проектов: {len(projects)}')
-    print(f'Задач: {len(tasks)}')
+    print(f'Пользователей: {totals["users"]}')
+    print(f'Проектов: {totals["projects"]}')
+    print(f'Задач: {totals["tasks"]}')
     print('\nДанные для входа:')
-    print('Админ: admin / admin')
-    print('Менеджер: manager1 / pass')
-    print('Исполнитель: worker1 / pass')
+    print(f'Админ: admin / {ADMIN_PASSWORD}')
+    print(f'Менеджер: manager1 / {SHARED_PASSWORD}')
+    print(f'Исполнитель: worker1 / {SHARED_PASSWORD}')
 
 if __name__ == '__main__':
-    seed_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    seed_database(args.tasks, args.seed)
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.sql_profiling import QueryLog, statement_shape
+
+
+@contextmanager
+def count_queries(engine):
+    # Все SQL, выполненные движком внутри блока, в том числе запросами
+    # тестового клиента: with count_queries(db.engine) as log: ...
+    log = QueryLog()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        log.record(statement, parameters, 0.0)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield log
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def format_queries(log):
+    lines = [f"  {i}. {statement_shape(statement)}  {parameters}"
+             for i, (statement, parameters, _) in enumerate(log.statements, 1)]
+    for shape, count in log.repeated(2):
+        lines.append(f"  N+1: {count}x {shape}")
+    return "\n".join(lines)
+
+
+def assert_query_budget(log, budget, label="запрос"):
+    assert log.count <= budget, (
+        f"{label}: {log.count} SQL при бюджете {budget}\n{format_queries(log)}"
+    )
+
+
+def assert_constant_queries(small, large, label="запрос"):
+    # Число запросов не должно зависеть от объёма данных: при N+1 на большом
+    # наборе появляются повторы одной и той же формы с разными параметрами.
+    assert large.count == small.count, (
+        f"{label}: {small.count} SQL на малом наборе, {large.count} на большом\n"
+        f"малый:\n{format_queries(small)}\nбольшой:\n{format_queries(large)}"
+    )
@@ -1,20 +1,44 @@
 import os
-import tempfile
-from datetime import date, timedelta
+import time
+from datetime import date, datetime, timedelta, timezone
 
 import pytest
+from sqlalchemy import update
+from werkzeug.http import http_date
+from sqlalchemy.exc import OperationalError
 
 from app import create_app, db
 from app.models import User, Task, Project, Comment, Subtask
 
 
+# TEST_DATABASE_URL=postgresql+psycopg://... запускает тесты на PostgreSQL;
+# по умолчанию каждая проверка получает свой файл SQLite.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+sqlite_only = pytest.mark.skipif(
+    bool(TEST_DATABASE_URL) and not TEST_DATABASE_URL.startswith("sqlite"),
+    reason="требуется SQLite",
+)
+
+
 @pytest.fixture
-def client():
-    db_fd, db_path = tempfile.mkstemp()
-    app = create_app()
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
-    app.config["WTF_CSRF_ENABLED"] = False
+def client(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": TEST_DATABASE_URL or f"sqlite:///{tmp_path / 'test.db'}",
+        "WTF_CSRF_ENABLED": False,
+        "USER_CACHE_VERSION_FILE": str(tmp_path / "users.version"),
+        "TASK_LIST_CACHE_DIR": str(tmp_path / "task-lists"),
+        "METRICS_DIR": str(tmp_path / "metrics"),
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+        "PROFILE_RING_SIZE": 2,
+        # Дешёвый хэш и хэширование в потоке запроса ускоряют тесты.
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        "PASSWORD_HASH_WORKERS": 0,
+        "TASK_EVENTS_POLL_INTERVAL": 0.02,
+        "TASK_EVENTS_HEARTBEAT": 0.1,
+        "TASK_EVENTS_MAX_AGE": 5,
+    })
 
     with app.test_client() as client:
         with app.app_context():
@@ -36,8 +60,7 @@ def client():
 
     with app.app_context():
         db.session.remove()
-    os.close(db_fd)
-    os.unlink(db_path)
+        db.engine.dispose()
 
 
 def login(client, username, password):
@@ -500,4 +523,975 @@ def test_projects_crud_and_validation(client):
     assert rv.get_json()["message"] == "Project deleted"
 
     rv = client.get(f"/api/projects/{project_id}")
-    assert rv.status_code == 404
\ No newline at end of file
+    assert rv.status_code == 404
+
+def test_get_tasks_list_matches_detail_serialization(client):
+    login(client, "admin", "admin")
+    ids = []
+    for i in range(3):
+        rv = client.post(
+            "/api/tasks",
+            json={
+                "title": f"Task {i}",
+                "assignee_ids": [2, 3][: i + 1],
+                "subtasks": [{"title": f"sub {j}"} for j in range(i)],
+            },
+        )
+        ids.append(rv.get_json()["id"])
+    for _ in range(2):
+        client.post(f"/api/tasks/{ids[1]}/comments", json={"content": "c"})
+
+    rv = client.get("/api/tasks")
+    assert rv.status_code == 200
+    listed = {t["id"]: t for t in rv.get_json()}
+    for task_id in ids:
+        detail = client.get(f"/api/tasks/{task_id}").get_json()
+        assert listed[task_id] == detail
+    assert listed[ids[1]]["comments_count"] == 2
+
+
+def _walk_pages(client, url):
+    seen = []
+    while url:
+        rv = client.get(url)
+        assert rv.status_code == 200
+        seen.extend(t["id"] for t in rv.get_json())
+        cursor = rv.headers.get("X-Next-Cursor")
+        url = rv.headers["Link"][1:].split(">")[0] if cursor else None
+    return seen
+
+
+@pytest.mark.parametrize("sort", ["id", "-created_at", "deadline", "-deadline", "priority"])
+def test_get_tasks_keyset_pagination(client, sort):
+    login(client, "user1", "pass1")
+    for i in range(7):
+        deadline = (date.today() + timedelta(days=i % 3)).isoformat() if i % 2 else None
+        rv = client.post(
+            "/api/tasks",
+            json={"title": f"T{i}", "priority": i % 4 + 1, "deadline": deadline},
+        )
+        assert rv.status_code == 201
+
+    full = client.get(f"/api/tasks?sort={sort}").get_json()
+    paged = _walk_pages(client, f"/api/tasks?sort={sort}&limit=2")
+    assert paged == [t["id"] for t in full]
+    assert len(set(paged)) == 7
+
+
+def test_api_lists_default_to_first_page(client):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks/bulk", json={"tasks": [{"title": f"T{i}"} for i in range(52)]})
+    rv = client.get("/api/tasks")
+    assert len(rv.get_json()) == 50
+    assert rv.headers["X-Next-Cursor"]
+    assert len(_walk_pages(client, "/api/tasks")) == 52
+
+    for i in range(51):
+        client.post("/api/projects", json={"name": f"P{i}"})
+    rv = client.get("/api/projects")
+    assert len(rv.get_json()) == 50
+    assert len(_walk_pages(client, "/api/projects")) == 51
+
+
+def test_get_tasks_pagination_validation(client):
+    login(client, "user1", "pass1")
+    assert client.get("/api/tasks?limit=0").status_code == 400
+    assert client.get("/api/tasks?sort=title").status_code == 400
+    assert client.get("/api/tasks?cursor=garbage").status_code == 400
+
+
+def test_get_tasks_visible_without_any_assignments(client):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks", json={"title": "Own task"})
+    rv = client.get("/api/tasks")
+    assert [t["title"] for t in rv.get_json()] == ["Own task"]
+
+
+def test_tasks_page_next_link(client):
+    login(client, "user1", "pass1")
+    for i in range(3):
+        client.post("/api/tasks", json={"title": f"T{i}"})
+    rv = client.get("/tasks?limit=2")
+    assert rv.status_code == 200
+    assert "Следующая страница" in rv.get_data(as_text=True)
+    rv = client.get("/tasks")
+    assert "Следующая страница" not in rv.get_data(as_text=True)
+
+
+def test_get_tasks_sparse_fields_and_include(client):
+    login(client, "admin", "admin")
+    rv = client.post(
+        "/api/tasks",
+        json={"title": "Slim", "assignee_ids": [2], "subtasks": [{"title": "s"}]},
+    )
+    task_id = rv.get_json()["id"]
+
+    rv = client.get("/api/tasks?fields=id,title&include=")
+    assert rv.status_code == 200
+    assert rv.get_json() == [{"id": task_id, "title": "Slim"}]
+
+    rv = client.get(f"/api/tasks/{task_id}?fields=id&include=assignees,comments_count")
+    assert rv.get_json() == {"id": task_id, "assignee_ids": [2], "comments_count": 0}
+
+    rv = client.get("/api/tasks?fields=secret")
+    assert rv.status_code == 400
+    rv = client.get("/api/tasks?include=comments")
+    assert rv.status_code == 400
+
+
+def test_slim_task_list_skips_related_queries(client):
+    from sqlalchemy import event
+
+    login(client, "admin", "admin")
+    for i in range(3):
+        client.post("/api/tasks", json={"title": f"T{i}", "assignee_ids": [2]})
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        rv = client.get("/api/tasks?include=")
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert rv.status_code == 200
+    assert not any("task_assignees" in s.split("WHERE")[0] for s in statements)
+    assert not any("FROM subtask" in s or "FROM comment" in s for s in statements)
+
+
+def test_get_projects_without_author(client):
+    login(client, "admin", "admin")
+    client.post("/api/projects", json={"name": "P"})
+    rv = client.get("/api/projects?include=")
+    assert "author_username" not in rv.get_json()[0]
+    rv = client.get("/api/projects?fields=name&include=author")
+    assert rv.get_json() == [{"name": "P", "author_username": "admin"}]
+
+
+def test_export_tasks_ndjson_and_csv(client):
+    import csv
+    import io
+    import json
+
+    login(client, "user1", "pass1")
+    client.post("/api/tasks", json={"title": "A", "status": "todo"})
+    client.post("/api/tasks", json={"title": "B", "status": "done"})
+
+    rv = client.get("/api/tasks/export?status=todo")
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in rv.get_data(as_text=True).splitlines()]
+    assert [t["title"] for t in lines] == ["A"]
+    assert lines[0] == client.get(f"/api/tasks/{lines[0]['id']}").get_json()
+
+    rv = client.get("/api/tasks/export?format=csv&fields=id,title&include=assignees")
+    assert rv.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(rv.get_data(as_text=True))))
+    assert rows[0] == ["id", "title", "assignee_ids"]
+    assert [r[1] for r in rows[1:]] == ["A", "B"]
+
+    assert client.get("/api/tasks/export?format=xml").status_code == 400
+
+
+def test_export_tasks_cli(client, tmp_path):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks", json={"title": "From CLI"})
+    runner = client.application.test_cli_runner()
+    result = runner.invoke(args=["export-tasks", "--format", "csv", "--user", "user1"])
+    assert result.exit_code == 0, result.output
+    assert "From CLI" in result.stdout
+    assert result.stderr == ""
+
+    path = tmp_path / "tasks.jsonl"
+    result = runner.invoke(args=["export-tasks", "--output", str(path)])
+    assert result.exit_code == 0, result.output
+    assert result.stdout == ""
+    assert "Выгрузка завершена" in result.stderr
+    assert "From CLI" in path.read_text(encoding="utf-8")
+    result = runner.invoke(args=["export-tasks", "--user", "nobody"])
+    assert result.exit_code != 0
+
+
+def test_bulk_create_tasks(client):
+    login(client, "user1", "pass1")
+    rv = client.post("/api/projects", json={"name": "Bulk"})
+    project_id = rv.get_json()["id"]
+    rv = client.post(
+        "/api/tasks/bulk",
+        json={
+            "tasks": [
+                {"title": "B1", "project_id": project_id, "assignee_ids": [2, 3]},
+                {"title": "B2", "subtasks": [{"title": "s1"}, {"title": "s2"}]},
+            ]
+        },
+    )
+    assert rv.status_code == 201
+    data = rv.get_json()
+    assert data["created"] == 2 and data["failed"] == 0
+    first, second = (client.get(f"/api/tasks/{r['id']}").get_json() for r in data["results"])
+    assert first["project_id"] == project_id
+    assert sorted(first["assignee_ids"]) == [2, 3]
+    assert [s["title"] for s in second["subtasks"]] == ["s1", "s2"]
+
+
+def test_bulk_create_tasks_reports_per_item_errors(client):
+    login(client, "user2", "pass2")
+    rv = client.post(
+        "/api/tasks/bulk",
+        json=[
+            {"title": "ok", "assignee_ids": [1, 3]},
+            {"title": ""},
+            {"title": "bad project", "project_id": 999999},
+            {"title": "bad deadline", "deadline": "tomorrow"},
+        ],
+    )
+    assert rv.status_code == 207
+    results = rv.get_json()["results"]
+    assert "id" in results[0]
+    assert results[1]["error"] == "Title is required"
+    assert results[2]["error"] == "Invalid project_id"
+    assert "Invalid deadline format" in results[3]["error"]
+    task = client.get(f"/api/tasks/{results[0]['id']}").get_json()
+    assert task["assignee_ids"] == [3]
+
+    rv = client.post("/api/tasks/bulk", json={"tasks": [{"title": ""}]})
+    assert rv.status_code == 400
+    rv = client.post("/api/tasks/bulk", json={"tasks": []})
+    assert rv.status_code == 400
+
+
+def test_bulk_update_tasks_by_ids(client):
+    login(client, "user1", "pass1")
+    own = [client.post("/api/tasks", json={"title": f"T{i}", "assignee_ids": [2]}).get_json()["id"] for i in range(3)]
+    logout(client)
+    login(client, "admin", "admin")
+    foreign = client.post("/api/tasks", json={"title": "Admin task", "assignee_ids": [2]}).get_json()["id"]
+    logout(client)
+    login(client, "user1", "pass1")
+
+    rv = client.patch(
+        "/api/tasks/bulk",
+        json={
+            "ids": own + [foreign, 999999, "abc", None],
+            "changes": {"status": "done", "priority": 4, "add_assignee_ids": [3, 1], "remove_assignee_ids": [2]},
+        },
+    )
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert sorted(data["updated"]) == sorted(own)
+    assert {(s["id"], s["reason"]) for s in data["skipped"]} == {
+        (foreign, "access_denied"),
+        (999999, "not_found"),
+        ("abc", "invalid_id"),
+        (None, "invalid_id"),
+    }
+    assert data["rejected_assignee_ids"] == [1]
+    for task_id in own:
+        task = client.get(f"/api/tasks/{task_id}").get_json()
+        assert task["status"] == "done"
+        assert task["priority"] == 4
+        assert task["completed_at"] is not None
+        assert task["assignee_ids"] == [3]
+    assert client.get(f"/api/tasks/{foreign}").get_json()["status"] == "todo"
+
+
+def test_bulk_update_tasks_by_filter_and_validation(client):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks", json={"title": "A", "status": "todo"})
+    client.post("/api/tasks", json={"title": "B", "status": "review"})
+    rv = client.patch(
+        "/api/tasks/bulk",
+        json={"filter": {"status": "review"}, "changes": {"status": "in_progress"}},
+    )
+    assert rv.status_code == 200
+    assert len(rv.get_json()["updated"]) == 1
+    statuses = sorted(t["status"] for t in client.get("/api/tasks").get_json())
+    assert statuses == ["in_progress", "todo"]
+
+    assert client.patch("/api/tasks/bulk", json={"changes": {"status": "done"}}).status_code == 400
+    rv = client.patch("/api/tasks/bulk", json={"ids": [1], "changes": {"status": "bogus"}})
+    assert rv.status_code == 400
+    rv = client.patch("/api/tasks/bulk", json={"ids": [1], "changes": {"title": "x"}})
+    assert rv.status_code == 400
+
+
+def test_bulk_update_tasks_rejects_non_object_body(client):
+    login(client, "user1", "pass1")
+    for body in ([1, 2], "x", 5, None):
+        rv = client.patch("/api/tasks/bulk", json=body)
+        assert rv.status_code == 400
+        assert rv.get_json() == {"error": "Request body must be a JSON object"}
+    rv = client.patch("/api/tasks/bulk", data="not json", content_type="application/json")
+    assert rv.status_code == 400
+
+
+def test_task_etag_and_conditional_get(client):
+    login(client, "admin", "admin")
+    task_id = client.post("/api/tasks", json={"title": "Polled"}).get_json()["id"]
+
+    rv = client.get(f"/api/tasks/{task_id}")
+    etag = rv.headers["ETag"]
+    rv = client.get(f"/api/tasks/{task_id}", headers={"If-None-Match": etag})
+    assert rv.status_code == 304
+    assert rv.get_data() == b""
+
+    rv = client.get(f"/api/tasks/{task_id}?fields=id", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+
+    client.post(f"/api/tasks/{task_id}/comments", json={"content": "bump"})
+    rv = client.get(f"/api/tasks/{task_id}", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert rv.headers["ETag"] != etag
+
+
+def test_task_if_modified_since_ignores_current_second(client):
+    login(client, "admin", "admin")
+    task_id = client.post("/api/tasks", json={"title": "Polled"}).get_json()["id"]
+
+    def touch(updated_at):
+        with client.application.app_context():
+            db.session.execute(update(Task).where(Task.id == task_id).values(updated_at=updated_at))
+            db.session.commit()
+
+    touch(datetime.now() - timedelta(seconds=10))
+    rv = client.get(f"/api/tasks/{task_id}")
+    last_modified = rv.headers["Last-Modified"]
+    rv = client.get(f"/api/tasks/{task_id}", headers={"If-Modified-Since": last_modified})
+    assert rv.status_code == 304
+
+    # Запись в текущую секунду: дата не отдаётся, а старая не даёт 304.
+    # Проверка начинается в начале секунды, чтобы успеть до её конца.
+    time.sleep(1 - datetime.now().microsecond / 1e6)
+    now = datetime.now()
+    touch(now)
+    rv = client.get(f"/api/tasks/{task_id}")
+    assert "Last-Modified" not in rv.headers
+    for since in (last_modified, http_date(now.astimezone(timezone.utc))):
+        rv = client.get(f"/api/tasks/{task_id}", headers={"If-Modified-Since": since})
+        assert rv.status_code == 200
+
+
+def test_task_list_etag_changes_on_writes(client):
+    login(client, "user1", "pass1")
+    first = client.post("/api/tasks", json={"title": "One"}).get_json()["id"]
+    second = client.post("/api/tasks", json={"title": "Two"}).get_json()["id"]
+
+    etag = client.get("/api/tasks").headers["ETag"]
+    assert client.get("/api/tasks", headers={"If-None-Match": etag}).status_code == 304
+
+    client.patch("/api/tasks/bulk", json={"ids": [first], "changes": {"priority": 4}})
+    rv = client.get("/api/tasks", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    etag = rv.headers["ETag"]
+
+    client.delete(f"/api/tasks/{second}")
+    rv = client.get("/api/tasks", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert [t["id"] for t in rv.get_json()] == [first]
+
+
+def test_project_etag(client):
+    login(client, "admin", "admin")
+    project_id = client.post("/api/projects", json={"name": "P"}).get_json()["id"]
+    etag = client.get("/api/projects").headers["ETag"]
+    assert client.get("/api/projects", headers={"If-None-Match": etag}).status_code == 304
+    client.put(f"/api/projects/{project_id}", json={"name": "P2"})
+    assert client.get("/api/projects", headers={"If-None-Match": etag}).status_code == 200
+
+
+def _cache_stats(client):
+    return client.get("/api/cache/stats").get_json()
+
+
+def test_task_list_cache_hits_and_precise_invalidation(client):
+    login(client, "user1", "pass1")
+    task_id = client.post("/api/tasks", json={"title": "Cached", "assignee_ids": [3]}).get_json()["id"]
+    client.get("/api/tasks")
+    client.get("/api/tasks")
+    logout(client)
+
+    login(client, "user2", "pass2")
+    assert [t["title"] for t in client.get("/api/tasks").get_json()] == ["Cached"]
+    logout(client)
+
+    login(client, "admin", "admin")
+    hits = _cache_stats(client)["hits"]
+    assert hits >= 1
+    client.get("/api/tasks")
+    client.get("/api/tasks")
+    assert _cache_stats(client)["hits"] == hits + 1
+    logout(client)
+
+    # Комментарий к задаче user1 сбрасывает списки user1 и user2, но не админа.
+    login(client, "user2", "pass2")
+    client.post(f"/api/tasks/{task_id}/comments", json={"content": "hi"})
+    assert client.get("/api/tasks").get_json()[0]["comments_count"] == 1
+    logout(client)
+
+    login(client, "admin", "admin")
+    hits = _cache_stats(client)["hits"]
+    client.get("/api/tasks")
+    assert _cache_stats(client)["hits"] == hits + 1
+
+
+def test_task_list_cache_sees_unassignment_and_bulk_updates(client):
+    login(client, "user1", "pass1")
+    task_id = client.post("/api/tasks", json={"title": "Shared", "assignee_ids": [3]}).get_json()["id"]
+    logout(client)
+    login(client, "user2", "pass2")
+    assert len(client.get("/api/tasks").get_json()) == 1
+    assert len(client.get("/tasks").get_data(as_text=True).split("task-card")) == 2
+    logout(client)
+
+    login(client, "user1", "pass1")
+    client.patch("/api/tasks/bulk", json={"ids": [task_id], "changes": {"status": "review"}})
+    logout(client)
+    login(client, "user2", "pass2")
+    assert client.get("/api/tasks").get_json()[0]["status"] == "review"
+    logout(client)
+
+    login(client, "user1", "pass1")
+    client.put(f"/api/tasks/{task_id}", json={"title": "Shared", "assignee_ids": []})
+    logout(client)
+    login(client, "user2", "pass2")
+    assert client.get("/api/tasks").get_json() == []
+    assert "task-card" not in client.get("/tasks").get_data(as_text=True)
+
+
+def test_task_list_cache_is_shared_between_workers(client):
+    # Второе приложение с той же базой и папкой кэша — как второй воркер.
+    worker = create_app(dict(client.application.config))
+    login(client, "user1", "pass1")
+    task_id = client.post("/api/tasks", json={"title": "Shared", "priority": 2}).get_json()["id"]
+    rv = client.get("/api/tasks")
+    assert rv.get_json()[0]["priority"] == 2
+    etag = rv.headers["ETag"]
+
+    with worker.test_client() as other:
+        login(other, "user1", "pass1")
+        other.patch("/api/tasks/bulk", json={"ids": [task_id], "changes": {"priority": 4}})
+        other.put(f"/api/tasks/{task_id}", json={"title": "Renamed"})
+
+    rv = client.get("/api/tasks", headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert rv.get_json()[0]["title"] == "Renamed"
+    assert rv.get_json()[0]["priority"] == 4
+
+    with worker.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_task_counters_follow_comments_and_subtasks(client):
+    login(client, "admin", "admin")
+    rv = client.post(
+        "/api/tasks",
+        json={"title": "Counted", "subtasks": [{"title": "a", "completed": True}, {"title": "b"}]},
+    )
+    task = rv.get_json()
+    assert (task["subtasks_total"], task["subtasks_done"]) == (2, 1)
+    task_id = task["id"]
+
+    c1 = client.post(f"/api/tasks/{task_id}/comments", json={"content": "1"}).get_json()["id"]
+    client.post(f"/api/tasks/{task_id}/comments", json={"content": "2"})
+    sub = client.post(f"/api/tasks/{task_id}/subtasks", json={"title": "c"}).get_json()["id"]
+    client.put(f"/api/subtasks/{sub}", json={"completed": True})
+    client.delete(f"/api/comments/{c1}")
+    client.post(f"/task/{task_id}/comment", data={"content": "html"})
+    client.post(f"/subtask/{sub}/toggle")
+
+    task = client.get(f"/api/tasks/{task_id}").get_json()
+    assert task["comments_count"] == 2
+    assert (task["subtasks_total"], task["subtasks_done"]) == (3, 1)
+
+    client.post(f"/subtask/{sub}/delete")
+    task = client.get(f"/api/tasks/{task_id}").get_json()
+    assert (task["subtasks_total"], task["subtasks_done"]) == (2, 1)
+
+
+def test_repair_counters_command(client):
+    from sqlalchemy import text
+
+    login(client, "admin", "admin")
+    task_id = client.post("/api/tasks", json={"title": "Drift"}).get_json()["id"]
+    client.post(f"/api/tasks/{task_id}/comments", json={"content": "x"})
+    with client.application.app_context():
+        db.session.execute(text("UPDATE task SET comments_count = 7, subtasks_total = 3"))
+        db.session.commit()
+
+    result = client.application.test_cli_runner().invoke(args=["repair-counters"])
+    assert result.exit_code == 0, result.output
+    assert "1" in result.output
+    task = client.get(f"/api/tasks/{task_id}").get_json()
+    assert (task["comments_count"], task["subtasks_total"]) == (1, 0)
+
+
+@sqlite_only
+def test_search_tasks_ranked_with_snippets(client):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks", json={"title": "Починить принтер", "description": "Картридж"})
+    other = client.post("/api/tasks", json={"title": "Отчёт", "description": "Про принтер"}).get_json()
+    client.post("/api/tasks", json={"title": "Unrelated"})
+    client.post(f"/api/tasks/{other['id']}/comments", json={"content": "Нужен <b>тонер</b>"})
+
+    rv = client.get("/api/tasks/search?q=принтер")
+    assert rv.status_code == 200
+    results = rv.get_json()
+    assert [t["title"] for t in results] == ["Починить принтер", "Отчёт"]
+    assert "<mark>принтер</mark>" in results[0]["snippet"]
+
+    results = client.get("/api/tasks/search?q=тон").get_json()
+    assert [t["id"] for t in results] == [other["id"]]
+    assert "&lt;b&gt;" in results[0]["snippet"]
+
+    assert client.get('/api/tasks/search?q="OR (').status_code == 200
+    assert client.get("/api/tasks/search?q=").status_code == 400
+
+    client.put(f"/api/tasks/{other['id']}", json={"title": "Сводка"})
+    results = client.get("/api/tasks/search?q=сводка&fields=id,title&include=").get_json()
+    assert results == [{"id": other["id"], "title": "Сводка", "snippet": results[0]["snippet"]}]
+
+    client.delete(f"/api/tasks/{other['id']}")
+    assert client.get("/api/tasks/search?q=тонер").get_json() == []
+
+
+@sqlite_only
+def test_search_respects_visibility(client):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks", json={"title": "Секретный план"})
+    client.get("/logout")
+
+    login(client, "user2", "pass2")
+    assert client.get("/api/tasks/search?q=секретный").get_json() == []
+    rv = client.get("/tasks?q=секретный")
+    assert "Ничего не найдено" in rv.get_data(as_text=True)
+    client.get("/logout")
+
+    login(client, "admin", "admin")
+    rv = client.get("/tasks?q=секретный")
+    assert "<mark>Секретный</mark>" in rv.get_data(as_text=True)
+
+
+@sqlite_only
+def test_rebuild_search_command(client):
+    from sqlalchemy import text
+
+    login(client, "admin", "admin")
+    client.post("/api/tasks", json={"title": "Indexed later"})
+    with client.application.app_context():
+        db.session.execute(text("DELETE FROM task_search"))
+        db.session.commit()
+    assert client.get("/api/tasks/search?q=indexed").get_json() == []
+
+    result = client.application.test_cli_runner().invoke(args=["rebuild-search"])
+    assert result.exit_code == 0, result.output
+    assert len(client.get("/api/tasks/search?q=indexed").get_json()) == 1
+
+
+def _count_queries(app):
+    from sqlalchemy import event
+
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def test_user_loader_served_from_cache_and_invalidated(client):
+    statements = _count_queries(client.application)
+    login(client, "user1", "pass1")
+    statements.clear()
+    client.get("/api/projects")
+    assert not any("FROM user" in s for s in statements)
+
+    cache = client.application.extensions["user_cache"]
+    with client.application.app_context():
+        user1_id = User.query.filter_by(username="user1").first().id
+    assert cache.get(user1_id).access_level == 1
+    client.get("/logout")
+
+    login(client, "admin", "admin")
+    client.post(f"/admin/user/{user1_id}/set_level", data={"level": "3"})
+    assert cache.get(user1_id) is None
+    client.get("/logout")
+
+    login(client, "user1", "pass1")
+    statements.clear()
+    client.get("/api/projects")
+    assert cache.get(user1_id).access_level == 3
+    assert not any("FROM user" in s for s in statements)
+
+
+def test_user_cache_version_shared_between_processes(tmp_path):
+    from app.cache import UserCache
+
+    version_file = str(tmp_path / "users.version")
+    first, second = UserCache(version_file), UserCache(version_file)
+    user = User(id=1, username="u", password_hash="x", access_level=1)
+    first.set(user)
+    second.set(user)
+    assert second.get(1) is not None
+
+    first.invalidate()
+    assert first.get(1) is None
+    assert second.get(1) is None
+
+
+def test_login_returns_503_when_hashing_queue_is_full(client):
+    hasher = client.application.extensions["password_hasher"]
+    for _ in range(hasher.queue_limit):
+        hasher._slots.acquire()
+    try:
+        rv = client.post("/login", data={"username": "user1", "password": "pass1"})
+        assert rv.status_code == 503
+        assert rv.headers["Retry-After"] == "1"
+    finally:
+        for _ in range(hasher.queue_limit):
+            hasher._slots.release()
+
+    assert login(client, "user1", "pass1").status_code == 200
+    client.get("/logout")
+    login(client, "admin", "admin")
+    stats = client.get("/api/auth/stats").get_json()
+    assert stats["rejected"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["logins"] == 3
+    assert set(stats["login_latency_ms"]) == {"avg", "p50", "p95", "max"}
+
+
+def test_login_rehashes_password_with_new_parameters(client):
+    hasher = client.application.extensions["password_hasher"]
+    with client.application.app_context():
+        old_hash = User.query.filter_by(username="user1").first().password_hash
+    assert old_hash.startswith("pbkdf2:sha256:1000$")
+
+    hasher.method = "pbkdf2:sha256:2000"
+    hasher._parameters = None
+    login(client, "user1", "pass1")
+    with client.application.app_context():
+        user = User.query.filter_by(username="user1").first()
+        assert user.password_hash.startswith("pbkdf2:sha256:2000$")
+        assert user.check_password("pass1")
+
+
+def test_password_hasher_process_pool():
+    from app.passwords import PasswordHasher
+
+    hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=1, queue_limit=2)
+    password_hash = hasher.hash("secret")
+    assert hasher.verify(password_hash, "secret")
+    assert not hasher.verify(password_hash, "wrong")
+    hasher._executor.shutdown()
+
+
+def test_password_hasher_timeout_is_busy():
+    from app.passwords import PasswordHasher, PasswordHasherBusy
+
+    hasher = PasswordHasher(method="pbkdf2:sha256:2000000", workers=1, queue_limit=2, timeout=0.001)
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash("secret")
+    hasher._executor.shutdown()
+
+
+def test_stats_counts_visible_tasks(client):
+    today = date.today()
+    login(client, "user1", "pass1")
+    project_id = client.post("/api/projects", json={"name": "Stats"}).get_json()["id"]
+    client.post("/api/tasks", json={"title": "a", "project_id": project_id,
+                                    "deadline": (today - timedelta(days=1)).isoformat()})
+    client.post("/api/tasks", json={"title": "b", "project_id": project_id, "status": "review",
+                                    "deadline": today.isoformat()})
+    done_id = client.post("/api/tasks", json={"title": "c", "status": "done",
+                                              "deadline": today.isoformat()}).get_json()["id"]
+    client.put(f"/api/tasks/{done_id}/complete")
+
+    rv = client.get("/api/stats")
+    stats = rv.get_json()
+    assert stats["total"] == 3
+    assert stats["by_status"] == {"todo": 1, "in_progress": 0, "review": 1, "done": 1}
+    assert (stats["overdue"], stats["due_today"]) == (1, 1)
+    by_project = {p["project_id"]: p for p in stats["by_project"]}
+    assert by_project[project_id]["total"] == 2
+    assert by_project[None]["by_status"]["done"] == 1
+    assert client.get("/api/stats", headers={"If-None-Match": rv.headers["ETag"]}).status_code == 304
+
+    client.post("/api/tasks", json={"title": "d"})
+    assert client.get("/api/stats").get_json()["total"] == 4
+    assert "Всего: <strong>4</strong>" in client.get("/tasks").get_data(as_text=True)
+    client.get("/logout")
+
+    login(client, "user2", "pass2")
+    assert client.get("/api/stats").get_json()["total"] == 0
+    client.get("/logout")
+
+    login(client, "admin", "admin")
+    assert client.get("/api/stats").get_json()["total"] == 4
+
+
+def _project_stats(client, project_id):
+    return client.get(f"/api/projects/{project_id}?fields=id&include=stats").get_json()["stats"]
+
+
+def test_project_stats_follow_task_changes(client):
+    today = date.today()
+    login(client, "user1", "pass1")
+    project_id = client.post("/api/projects", json={"name": "Tracked"}).get_json()["id"]
+    other_id = client.post("/api/projects", json={"name": "Other"}).get_json()["id"]
+    overdue = (today - timedelta(days=2)).isoformat()
+
+    a = client.post("/api/tasks", json={"title": "a", "project_id": project_id, "deadline": overdue}).get_json()["id"]
+    b = client.post("/api/tasks", json={"title": "b", "project_id": project_id, "status": "review"}).get_json()["id"]
+    client.post("/api/tasks/bulk", json={"tasks": [{"title": "c", "project_id": project_id, "deadline": overdue}]})
+    stats = _project_stats(client, project_id)
+    assert stats["total"] == 3
+    assert stats["by_status"] == {"todo": 2, "in_progress": 0, "review": 1, "done": 0}
+    assert stats["overdue"] == 2
+
+    client.put(f"/api/tasks/{a}/complete")
+    client.post(f"/task/{b}/approve")
+    stats = _project_stats(client, project_id)
+    assert stats["by_status"]["done"] == 1 and stats["by_status"]["review"] == 0
+    assert stats["overdue"] == 1
+    assert stats["completion"] == 33
+
+    client.put(f"/api/tasks/{a}", json={"title": "a", "project_id": other_id})
+    client.patch("/api/tasks/bulk", json={"ids": [b], "changes": {"status": "in_progress", "deadline": overdue}})
+    stats = _project_stats(client, project_id)
+    assert (stats["total"], stats["by_status"]["in_progress"], stats["overdue"]) == (2, 1, 1)
+    assert _project_stats(client, other_id)["total"] == 1
+
+    client.delete(f"/api/tasks/{b}")
+    stats = _project_stats(client, project_id)
+    assert (stats["total"], stats["overdue"]) == (1, 1)
+    assert "Задач: 1" in client.get("/projects").get_data(as_text=True)
+
+    result = client.application.test_cli_runner().invoke(args=["reconcile-project-stats"])
+    assert result.exit_code == 0, result.output
+    assert "Расхождений нет" in result.output
+
+
+def test_reconcile_project_stats_fixes_drift(client):
+    from sqlalchemy import text
+
+    login(client, "user1", "pass1")
+    project_id = client.post("/api/projects", json={"name": "Drift"}).get_json()["id"]
+    client.post("/api/tasks", json={"title": "a", "project_id": project_id})
+    with client.application.app_context():
+        db.session.execute(text("UPDATE project_stats SET total = 10, todo = 0"))
+        db.session.commit()
+
+    result = client.application.test_cli_runner().invoke(args=["reconcile-project-stats"])
+    assert str(project_id) in result.output
+    stats = _project_stats(client, project_id)
+    assert (stats["total"], stats["by_status"]["todo"]) == (1, 1)
+
+
+def _read_events(response, count):
+    import json
+
+    events, buffer = [], ""
+    for chunk in response.response:
+        buffer += chunk.decode()
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+            if "event" in fields:
+                events.append({"id": int(fields.get("id", 0)), "event": fields["event"],
+                               "data": json.loads(fields["data"])})
+                if len(events) == count:
+                    return events
+    return events
+
+
+def test_task_event_stream_replays_visible_events(client):
+    login(client, "user1", "pass1")
+    with client.application.app_context():
+        user2_id = User.query.filter_by(username="user2").first().id
+    private_id = client.post("/api/tasks", json={"title": "Private"}).get_json()["id"]
+    shared_id = client.post("/api/tasks", json={"title": "Shared", "assignee_ids": [user2_id]}).get_json()["id"]
+    client.post(f"/api/tasks/{private_id}/comments", json={"content": "note"})
+    client.patch("/api/tasks/bulk", json={"ids": [private_id], "changes": {"priority": 4}})
+    client.delete(f"/api/tasks/{private_id}")
+
+    assert client.get("/api/tasks/events", headers={"Last-Event-ID": "abc"}).status_code == 400
+    rv = client.get("/api/tasks/events", headers={"Last-Event-ID": "0"}, buffered=False)
+    assert rv.mimetype == "text/event-stream"
+    events = _read_events(rv, 5)
+    rv.close()
+    assert [(e["event"], e["data"]["task_id"]) for e in events] == [
+        ("created", private_id), ("created", shared_id), ("commented", private_id),
+        ("updated", private_id), ("deleted", private_id),
+    ]
+    assert events[2]["data"]["comment_id"]
+    client.get("/logout")
+
+    login(client, "user2", "pass2")
+    client.post(f"/task/{shared_id}/mark_done")
+    rv = client.get(f"/api/tasks/events?last_event_id={events[0]['id']}", buffered=False)
+    received = _read_events(rv, 2)
+    rv.close()
+    assert [(e["event"], e["data"]["task_id"]) for e in received] == [
+        ("created", shared_id), ("status_changed", shared_id)
+    ]
+    assert received[1]["data"]["old_status"] == "todo"
+
+
+def test_task_event_stream_delivers_live_events(client):
+    login(client, "user1", "pass1")
+    rv = client.get("/api/tasks/events", buffered=False)
+    stream = iter(rv.response)
+    assert next(stream).decode().startswith("retry:")
+
+    writer = client.application.test_client()
+    login(writer, "user1", "pass1")
+    task_id = writer.post("/api/tasks", json={"title": "Live"}).get_json()["id"]
+
+    buffer = ""
+    while "event: created" not in buffer:
+        buffer += next(stream).decode()
+    assert f'"task_id": {task_id}' in buffer
+    rv.close()
+
+
+def test_task_event_broker_survives_database_errors(client, monkeypatch):
+    from app import events
+    fetch_events = events.fetch_events
+    failures = []
+
+    def flaky_fetch(connection, after_id, *args, **kwargs):
+        if not failures:
+            failures.append(after_id)
+            raise OperationalError("SELECT", {}, Exception("database is locked"))
+        return fetch_events(connection, after_id, *args, **kwargs)
+
+    monkeypatch.setattr(events, "fetch_events", flaky_fetch)
+    login(client, "user1", "pass1")
+    rv = client.get("/api/tasks/events", buffered=False)
+    stream = iter(rv.response)
+    next(stream)
+
+    writer = client.application.test_client()
+    login(writer, "user1", "pass1")
+    task_id = writer.post("/api/tasks", json={"title": "After error"}).get_json()["id"]
+
+    buffer = ""
+    while "event: created" not in buffer:
+        buffer += next(stream).decode()
+    assert failures and f'"task_id": {task_id}' in buffer
+    rv.close()
+
+
+def test_task_changes_returns_updates_and_tombstones(client):
+    login(client, "user1", "pass1")
+    with client.application.app_context():
+        user2_id = User.query.filter_by(username="user2").first().id
+    kept_id = client.post("/api/tasks", json={"title": "Kept"}).get_json()["id"]
+    doomed_id = client.post("/api/tasks", json={"title": "Doomed"}).get_json()["id"]
+    shared_id = client.post("/api/tasks", json={"title": "Shared", "assignee_ids": [user2_id]}).get_json()["id"]
+    comment_id = client.post(f"/api/tasks/{kept_id}/comments", json={"content": "c"}).get_json()["id"]
+    subtask_id = client.post(f"/api/tasks/{kept_id}/subtasks", json={"title": "s"}).get_json()["id"]
+
+    full = client.get("/api/tasks/changes").get_json()
+    assert sorted(t["id"] for t in full["tasks"]) == sorted([kept_id, doomed_id, shared_id])
+    assert full["deleted"] == {"tasks": [], "comments": [], "subtasks": []}
+    assert full["has_more"] is False
+
+    unchanged = client.get(f"/api/tasks/changes?since={full['token']}").get_json()
+    assert unchanged["tasks"] == []
+
+    client.delete(f"/api/comments/{comment_id}")
+    client.delete(f"/api/subtasks/{subtask_id}")
+    client.delete(f"/api/tasks/{doomed_id}")
+    client.put(f"/api/tasks/{shared_id}", json={"title": "Shared", "assignee_ids": []})
+    changes = client.get(f"/api/tasks/changes?since={full['token']}").get_json()
+    assert sorted(t["id"] for t in changes["tasks"]) == sorted([kept_id, shared_id])
+    assert changes["deleted"] == {"tasks": [doomed_id], "comments": [comment_id], "subtasks": [subtask_id]}
+    client.get("/logout")
+
+    login(client, "user2", "pass2")
+    rv = client.get(f"/api/tasks/changes?since={full['token']}")
+    assert rv.get_json()["tasks"] == []
+    assert rv.get_json()["deleted"]["tasks"] == [shared_id]
+
+
+def test_task_changes_pages_and_requires_resync(client):
+    login(client, "user1", "pass1")
+    client.post("/api/tasks/bulk", json={"tasks": [{"title": f"T{i}"} for i in range(5)]})
+    token = client.get("/api/tasks/changes").get_json()["token"]
+    ids = [t["id"] for t in client.get("/api/tasks?fields=id").get_json()]
+    client.patch("/api/tasks/bulk", json={"ids": ids, "changes": {"priority": 1}})
+
+    seen = []
+    while True:
+        page = client.get(f"/api/tasks/changes?since={token}&limit=2&fields=id").get_json()
+        seen.extend(t["id"] for t in page["tasks"])
+        token = page["token"]
+        if not page["has_more"]:
+            break
+    assert sorted(seen) == sorted(ids)
+
+    assert client.get("/api/tasks/changes?since=bogus").status_code == 400
+    client.application.config["SYNC_TOMBSTONE_RETENTION"] = -1
+    rv = client.get(f"/api/tasks/changes?since={token}")
+    assert rv.status_code == 410
+    assert rv.get_json()["full_resync"] is True
+
+
+def test_metrics_endpoint_reports_requests_and_queries(client):
+    login(client, "user1", "pass1")
+    client.get("/api/tasks")
+    client.get("/api/tasks")
+
+    assert client.get("/metrics").status_code == 403
+    client.application.config["METRICS_PUBLIC"] = True
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    assert rv.mimetype == "text/plain"
+    text = rv.get_data(as_text=True)
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert 'http_requests_total{endpoint="api.get_tasks",method="GET",status="200"} 2' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="api.get_tasks",le="+Inf"} 2' in text
+    assert 'http_request_duration_seconds_count{endpoint="api.get_tasks"} 2' in text
+    assert 'http_requests_in_flight{endpoint="metrics"} 1' in text
+    assert "login_duration_seconds_count 1" in text
+    assert "password_hash_queue_depth 0" in text
+    queries = [line for line in text.splitlines() if line.startswith('db_queries_total{endpoint="api.get_tasks"}')]
+    assert int(queries[0].split()[-1]) > 0
+
+    client.application.config["METRICS_TOKEN"] = "secret"
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+
+def test_admin_can_profile_requests(client):
+    import pstats
+
+    login(client, "user1", "pass1")
+    rv = client.get("/tasks?_profile=1")
+    assert rv.status_code == 200
+    assert "X-Profile-Id" not in rv.headers
+    client.get("/logout")
+
+    login(client, "admin", "admin")
+    ids = [client.get("/tasks", headers={"X-Profile": "1"}).headers["X-Profile-Id"] for _ in range(3)]
+    assert "X-Profile-Id" not in client.get("/tasks").headers
+
+    page = client.get("/admin").get_data(as_text=True)
+    # В кольце остаются два последних профиля.
+    assert ids[0] not in page and ids[1] in page and ids[2] in page
+    assert "main.tasks" in page
+
+    rv = client.get(f"/admin/profiles/{ids[2]}.pstats")
+    assert rv.status_code == 200
+    path = client.application.config["PROFILE_DIR"] + "/downloaded.pstats"
+    with open(path, "wb") as f:
+        f.write(rv.data)
+    assert pstats.Stats(path).total_calls > 0
+    assert client.get(f"/admin/profiles/{ids[2]}.collapsed").status_code == 200
+    assert client.get(f"/admin/profiles/{ids[0]}.pstats").status_code == 404
+    assert client.get("/admin/profiles/..%2Fsecret.pstats").status_code == 404
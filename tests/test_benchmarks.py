@@ -0,0 +1,19 @@
+import copy
+
+from benchmarks.endpoints import compare, run
+
+
+def test_benchmark_suite_runs_on_small_dataset(tmp_path):
+    report = run([50], requests=1, workdir=tmp_path)
+    results = report["results"]["50"]
+    assert {"api.get_tasks", "api.get_task", "main.tasks", "main.view_task",
+            "api.create_task", "api.update_task", "auth.login"} <= set(results)
+    assert all(r["queries_per_request"] > 0 for r in results.values())
+    assert compare(report["results"], report, tolerance=0.25) == []
+
+    baseline = copy.deepcopy(report)
+    baseline["results"]["50"]["main.tasks"]["queries_per_request"] -= 1
+    assert compare(report["results"], baseline, tolerance=0.25) == [
+        f"50 main.tasks: SQL {results['main.tasks']['queries_per_request'] - 1} → "
+        f"{results['main.tasks']['queries_per_request']}"
+    ]
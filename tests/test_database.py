@@ -0,0 +1,127 @@
+import shutil
+
+from sqlalchemy import text
+
+from app import create_app, db
+from app.database import DATABASE_DEFAULTS, engine_options
+from app.models import User
+from app.routing import PRIMARY_UNTIL_KEY
+
+
+def test_sqlite_connections_use_configured_pragmas(tmp_path):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'pragmas.db'}",
+        "SQLITE_BUSY_TIMEOUT": 1234,
+        "USER_CACHE_VERSION_FILE": str(tmp_path / "users.version"),
+        "TASK_LIST_CACHE_DIR": str(tmp_path / "task-lists"),
+        "METRICS_ENABLED": False,
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+    })
+    with app.app_context():
+        with db.engine.connect() as conn:
+            pragma = lambda name: conn.execute(text(f"PRAGMA {name}")).scalar()
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == 1234
+            assert pragma("cache_size") == DATABASE_DEFAULTS["SQLITE_CACHE_SIZE"]
+        db.engine.dispose()
+
+
+def test_engine_options_for_postgres_pool():
+    config = dict(DATABASE_DEFAULTS, DB_POOL_SIZE=5,
+                  SQLALCHEMY_ENGINE_OPTIONS={"pool_recycle": 60})
+    options = engine_options(config, "postgresql+psycopg://app@db/tasks")
+    assert options == {
+        "pool_size": 5,
+        "max_overflow": DATABASE_DEFAULTS["DB_MAX_OVERFLOW"],
+        "pool_timeout": DATABASE_DEFAULTS["DB_POOL_TIMEOUT"],
+        "pool_recycle": 60,
+        "pool_pre_ping": True,
+    }
+    assert engine_options(config, "sqlite:///tasks.db") == {"pool_recycle": 60}
+
+
+def test_reads_go_to_replica_except_after_own_writes(tmp_path):
+    primary, replica = tmp_path / "primary.db", tmp_path / "replica.db"
+    app = create_app({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "TASK_LIST_CACHE_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{primary}",
+        "DATABASE_REPLICA_URL": f"sqlite:///{replica}",
+        "USER_CACHE_VERSION_FILE": str(tmp_path / "users.version"),
+        "METRICS_ENABLED": False,
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+    })
+    with app.app_context():
+        db.create_all()
+        user = User(username="user1", access_level=1)
+        user.set_password("pass1")
+        db.session.add(user)
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+    # Реплика — снимок основной базы на момент копирования.
+    shutil.copy(primary, replica)
+
+    client = app.test_client()
+    client.post("/login", data={"username": "user1", "password": "pass1"})
+    rv = client.post("/api/tasks", json={"title": "Fresh"})
+    assert rv.status_code == 201
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM task")).scalar() == 1
+
+    # Сразу после записи пользователь читает из основной базы.
+    assert [t["title"] for t in client.get("/api/tasks").get_json()] == ["Fresh"]
+
+    with client.session_transaction() as session:
+        session[PRIMARY_UNTIL_KEY] = 0
+    assert client.get("/api/tasks").get_json() == []
+
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_replica_reads_are_not_cached(tmp_path):
+    primary, replica = tmp_path / "primary.db", tmp_path / "replica.db"
+    app = create_app({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{primary}",
+        "DATABASE_REPLICA_URL": f"sqlite:///{replica}",
+        "USER_CACHE_VERSION_FILE": str(tmp_path / "users.version"),
+        "TASK_LIST_CACHE_DIR": str(tmp_path / "task-lists"),
+        "METRICS_ENABLED": False,
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+    })
+    with app.app_context():
+        db.create_all()
+        user = User(username="user1", access_level=1)
+        user.set_password("pass1")
+        db.session.add(user)
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+    shutil.copy(primary, replica)
+
+    client = app.test_client()
+    client.post("/login", data={"username": "user1", "password": "pass1"})
+    client.post("/api/tasks", json={"title": "Fresh"})
+    with client.session_transaction() as session:
+        session[PRIMARY_UNTIL_KEY] = 0
+    # Реплика отстаёт: ответ без новой задачи не должен попасть в кэш.
+    assert client.get("/api/tasks").get_json() == []
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.copy(primary, replica)
+    assert [t["title"] for t in client.get("/api/tasks").get_json()] == ["Fresh"]
+
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
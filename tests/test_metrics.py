@@ -0,0 +1,49 @@
+import json
+
+from app.metrics import MetricsCollector
+
+
+def test_collector_sums_processes_and_skips_dead_gauges(tmp_path):
+    metrics = MetricsCollector(str(tmp_path), flush_interval=0)
+    metrics.inc("http_requests_total", {"endpoint": "api.get_tasks", "method": "GET", "status": 200})
+    metrics.gauge_add("http_requests_in_flight", {"endpoint": "api.get_tasks"}, 1)
+    metrics.observe("http_request_duration_seconds", {"endpoint": "api.get_tasks"}, 0.02)
+    metrics.observe("http_request_duration_seconds", {"endpoint": "api.get_tasks"}, 20)
+
+    # Файл завершившегося процесса: его счётчики учитываются, gauge — нет.
+    dead = {
+        "pid": 2 ** 22 + 1,
+        "counters": [["http_requests_total",
+                      [["endpoint", "api.get_tasks"], ["method", "GET"], ["status", 200]], 3]],
+        "histograms": [],
+        "gauges": [["http_requests_in_flight", [["endpoint", "api.get_tasks"]], 5]],
+    }
+    (tmp_path / f"{dead['pid']}.json").write_text(json.dumps(dead))
+
+    text = metrics.render()
+    assert 'http_requests_total{endpoint="api.get_tasks",method="GET",status="200"} 4' in text
+    assert 'http_requests_in_flight{endpoint="api.get_tasks"} 1' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="api.get_tasks",le="0.025"} 1' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="api.get_tasks",le="10.0"} 1' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="api.get_tasks",le="+Inf"} 2' in text
+
+    # Файл завершившегося процесса слит в общий и удалён, сумма не изменилась.
+    assert not (tmp_path / f"{dead['pid']}.json").exists()
+    assert 'status="200"} 4' in metrics.render()
+
+
+def test_collector_merges_stale_file_of_reused_pid(tmp_path):
+    metrics = MetricsCollector(str(tmp_path))
+    metrics.inc("http_requests_total", {"endpoint": "api.get_tasks", "method": "GET", "status": 200}, 3)
+    metrics.gauge_add("http_requests_in_flight", {"endpoint": "api.get_tasks"}, 2)
+    metrics.flush(force=True)
+
+    # Новый процесс с тем же pid: старый файл уходит в aggregate.json,
+    # счётчики не убывают, а gauge прежнего процесса не учитываются.
+    restarted = MetricsCollector(str(tmp_path))
+    restarted.inc("http_requests_total", {"endpoint": "api.get_tasks", "method": "GET", "status": 200})
+    restarted.flush(force=True)
+    assert {p.name for p in tmp_path.glob("*.json")} == {"aggregate.json", f"{restarted.pid}.json"}
+    text = restarted.render()
+    assert 'status="200"} 4' in text
+    assert "http_requests_in_flight" not in text
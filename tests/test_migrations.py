@@ -0,0 +1,63 @@
+from sqlalchemy import create_engine, create_mock_engine, inspect, text
+
+from app.migrations import HEAD, MIGRATIONS, current_version, upgrade
+
+BASELINE_SCHEMA = [
+    """CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(64) NOT NULL,
+        password_hash VARCHAR(128) NOT NULL, access_level INTEGER NOT NULL, PRIMARY KEY (id))""",
+    "CREATE UNIQUE INDEX ix_user_username ON user (username)",
+    """CREATE TABLE project (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, description TEXT,
+        color VARCHAR(7), user_id INTEGER NOT NULL, PRIMARY KEY (id))""",
+    """CREATE TABLE task (id INTEGER NOT NULL, title VARCHAR(100) NOT NULL, description TEXT,
+        created_at DATETIME, completed_at DATETIME, user_id INTEGER NOT NULL, project_id INTEGER,
+        status VARCHAR(20), priority INTEGER, deadline DATE, PRIMARY KEY (id))""",
+    """CREATE TABLE task_assignees (task_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        PRIMARY KEY (task_id, user_id))""",
+    """CREATE TABLE comment (id INTEGER NOT NULL, content TEXT NOT NULL, created_at DATETIME,
+        user_id INTEGER NOT NULL, task_id INTEGER NOT NULL, PRIMARY KEY (id))""",
+    """CREATE TABLE subtask (id INTEGER NOT NULL, title VARCHAR(100) NOT NULL, completed BOOLEAN,
+        task_id INTEGER NOT NULL, PRIMARY KEY (id))""",
+]
+
+
+def test_upgrade_baseline_database_in_place(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for ddl in BASELINE_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO user VALUES (1, 'admin', 'x', 0)"))
+        conn.execute(text("INSERT INTO task (id, title, user_id, status) VALUES (1, 'Old task', 1, 'todo')"))
+
+    applied = upgrade(engine)
+    assert [number for number, _ in applied] == list(range(1, HEAD + 1))
+    assert upgrade(engine) == []
+
+    insp = inspect(engine)
+    task_columns = {c["name"] for c in insp.get_columns("task")}
+    assert {"version", "updated_at"} <= task_columns
+    task_indexes = {i["name"] for i in insp.get_indexes("task")}
+    assert {"ix_task_user_status", "ix_task_open_deadline", "ix_task_created_at_id"} <= task_indexes
+    assert "ix_task_assignees_user_task" in {i["name"] for i in insp.get_indexes("task_assignees")}
+    with engine.connect() as conn:
+        assert current_version(conn) == HEAD
+        assert conn.execute(text("SELECT title, version FROM task")).all() == [("Old task", 0)]
+
+
+def test_upgrade_creates_fresh_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    assert upgrade(engine) == []
+    with engine.connect() as conn:
+        assert current_version(conn) == HEAD
+    assert inspect(engine).has_table("revision")
+
+
+def test_password_hash_widened_on_postgresql():
+    statements = []
+    engine = create_mock_engine("postgresql+psycopg://", lambda sql, *args, **kwargs: statements.append(str(sql)))
+    step = dict((number, step) for number, _, step in MIGRATIONS)[9]
+    step(engine)
+    assert statements == ['ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(256)']
+
+    sqlite = create_mock_engine("sqlite://", lambda sql, *args, **kwargs: statements.append(str(sql)))
+    step(sqlite)
+    assert len(statements) == 1
@@ -0,0 +1,234 @@
+import itertools
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import create_app, db, events, sync
+from app.models import Comment, Project, Subtask, Task, User
+from tests.query_budget import assert_constant_queries, assert_query_budget, count_queries
+
+# Каждый сценарий выполняется на малом и на большом наборе данных: число SQL
+# должно совпадать (O(1) по числу задач, комментариев, подзадач, исполнителей
+# и проектов) и не превышать бюджет. Бюджеты — текущие значения; если
+# изменение действительно требует больше запросов, бюджет поднимается вместе
+# с ним. /api/tasks/events не проверяется: поток не завершается сам.
+SMALL, LARGE = 2, 8
+
+PASSWORDS = {"admin": "admin", "user1": "pass1", "user2": "pass2"}
+
+_names = itertools.count(1)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Периодическая очистка событий и надгробий амортизированно O(1), но
+    # добавляет запрос в случайный момент и ломает точный счёт.
+    monkeypatch.setattr(events, "PRUNE_EVERY", 10 ** 9)
+    monkeypatch.setattr(sync, "PRUNE_EVERY", 10 ** 9)
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'budget.db'}",
+        "WTF_CSRF_ENABLED": False,
+        # Без кэшей считаются запросы самой обработки, а не попадания в кэш.
+        "TASK_LIST_CACHE_ENABLED": False,
+        "USER_CACHE_ENABLED": False,
+        "METRICS_ENABLED": False,
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        "PASSWORD_HASH_WORKERS": 0,
+    })
+    with app.app_context():
+        db.create_all()
+        for username, level in (("admin", 0), ("user1", 1), ("user2", 2)):
+            user = User(username=username, access_level=level)
+            user.set_password(PASSWORDS[username])
+            db.session.add(user)
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def add_data(size):
+    # size проектов, менеджеров и исполнителей; в каждом статусе size задач
+    # разных авторов (последняя — user1), у каждой задачи size комментариев
+    # разных авторов, size подзадач и до size + 2 исполнителей. Все задачи видны
+    # user1 и user2. Возвращает id объектов, над которыми выполняются сценарии.
+    user1 = User.query.filter_by(username="user1").one()
+    user2 = User.query.filter_by(username="user2").one()
+    managers = [User(username=f"manager{next(_names)}", access_level=1) for _ in range(size)]
+    workers = [User(username=f"worker{next(_names)}", access_level=2) for _ in range(size)]
+    # Ещё size исполнителей без задач: назначение ещё не загруженных
+    # пользователей выявляет запросы по одному на исполнителя.
+    free = [User(username=f"worker{next(_names)}", access_level=2) for _ in range(size)]
+    for user in managers + workers + free:
+        user.password_hash = user2.password_hash
+    db.session.add_all(managers + workers + free)
+    db.session.flush()
+    projects = [Project(name=f"Проект {next(_names)}", user_id=manager.id) for manager in managers]
+    empty_project = Project(name=f"Пустой {next(_names)}", user_id=user1.id)
+    db.session.add_all(projects + [empty_project])
+    db.session.flush()
+
+    tasks = {}
+    for status in Task.STATUSES:
+        for n in range(size):
+            author = user1 if n == size - 1 else managers[n]
+            task = Task(title=f"Задача отчёт {n}", description="Подготовить отчёт",
+                        user_id=author.id, project_id=projects[n].id, status=status,
+                        deadline=date.today() - timedelta(days=n % 3 - 1))
+            task.assignees = [user2] + workers + ([user1] if author is not user1 else [])
+            task.comments = [Comment(content=f"Комментарий {i}",
+                                     user_id=user1.id if i == 0 else workers[i].id)
+                             for i in range(size)]
+            task.subtasks = [Subtask(title=f"Подзадача {i}", completed=i % 2 == 0)
+                             for i in range(size)]
+            db.session.add(task)
+            tasks[status] = task
+    db.session.commit()
+
+    task = tasks["todo"]
+    return {
+        "task": task.id,
+        "in_progress": tasks["in_progress"].id,
+        "review": tasks["review"].id,
+        "comment": task.comments[0].id,
+        "subtask": task.subtasks[0].id,
+        "project": projects[-1].id,
+        "empty_project": empty_project.id,
+        "user2": user2.id,
+        "worker": workers[-1].id,
+        "free": [w.id for w in free],
+    }
+
+
+# (сценарий, пользователь, метод, адрес, json, form, код ответа, бюджет SQL);
+# в адресе и данных подставляются id из add_data, "{free}" — список id
+# исполнителей без задач.
+CASES = [
+    # app/api
+    ("api.password_hashing_stats", "admin", "GET", "/api/auth/stats", None, None, 200, 1),
+    ("api.get_projects", "user1", "GET", "/api/projects", None, None, 200, 6),
+    ("api.get_project", "user1", "GET", "/api/projects/{project}", None, None, 200, 5),
+    ("api.create_project", "user1", "POST", "/api/projects", {"name": "Новый"}, None, 201, 7),
+    ("api.update_project", "user1", "PUT", "/api/projects/{project}",
+     {"name": "Изменён"}, None, 200, 8),
+    ("api.delete_project", "user1", "DELETE", "/api/projects/{empty_project}", None, None, 200, 8),
+    ("api.get_stats", "user2", "GET", "/api/stats", None, None, 200, 2),
+    ("api.get_tasks", "user1", "GET", "/api/tasks", None, None, 200, 5),
+    ("api.get_tasks?limit", "user2", "GET", "/api/tasks?limit=3&status=todo", None, None, 200, 5),
+    ("api.export_tasks", "user1", "GET", "/api/tasks/export?format=csv", None, None, 200, 4),
+    ("api.find_tasks", "user1", "GET", "/api/tasks/search?q=отчёт", None, None, 200, 4),
+    ("api.get_task_changes", "user2", "GET", "/api/tasks/changes", None, None, 200, 5),
+    ("api.get_task", "user2", "GET", "/api/tasks/{task}", None, None, 200, 4),
+    ("api.create_task", "user1", "POST", "/api/tasks",
+     {"title": "Новая", "project_id": "{project}", "assignee_ids": "{free}",
+      "subtasks": [{"title": "Первая"}, {"title": "Вторая"}]}, None, 201, 16),
+    ("api.bulk_create_tasks", "user1", "POST", "/api/tasks/bulk",
+     {"tasks": [{"title": "Первая", "assignee_ids": "{free}"},
+                {"title": "Вторая", "project_id": "{project}"}]}, None, 201, 12),
+    ("api.update_task", "user1", "PUT", "/api/tasks/{task}",
+     {"title": "Изменена", "project_id": "{project}", "assignee_ids": "{free}"}, None, 200, 17),
+    ("api.bulk_update_tasks", "user1", "PATCH", "/api/tasks/bulk",
+     {"filter": {"status": "todo"}, "changes": {"priority": 4, "add_assignee_ids": "{free}",
+                                                "remove_assignee_ids": ["{user2}"]}}, None, 200, 16),
+    ("api.delete_task", "user1", "DELETE", "/api/tasks/{task}", None, None, 200, 19),
+    ("api.complete_task", "user2", "PUT", "/api/tasks/{task}/complete", None, None, 200, 15),
+    ("api.add_comment", "user2", "POST", "/api/tasks/{task}/comments",
+     {"content": "Готово"}, None, 201, 9),
+    ("api.delete_comment", "user1", "DELETE", "/api/comments/{comment}", None, None, 200, 9),
+    ("api.add_subtask", "user1", "POST", "/api/tasks/{task}/subtasks",
+     {"title": "Ещё одна"}, None, 201, 8),
+    ("api.update_subtask", "user1", "PUT", "/api/subtasks/{subtask}",
+     {"completed": False}, None, 200, 9),
+    ("api.delete_subtask", "user1", "DELETE", "/api/subtasks/{subtask}", None, None, 200, 9),
+    ("api.cache_stats", "admin", "GET", "/api/cache/stats", None, None, 200, 1),
+    # app/main/routes.py
+    ("main.index", "user1", "GET", "/", None, None, 302, 1),
+    ("main.projects", "user1", "GET", "/projects", None, None, 200, 4),
+    ("main.new_project", "user1", "POST", "/project/new", None, {"name": "Новый"}, 302, 3),
+    ("main.edit_project", "user1", "POST", "/project/{project}/edit",
+     None, {"name": "Изменён"}, 302, 4),
+    ("main.delete_project", "user1", "POST", "/project/{empty_project}/delete",
+     None, None, 302, 8),
+    ("main.view_project", "user1", "GET", "/project/{project}", None, None, 200, 4),
+    ("main.new_task_from_project", "user1", "GET", "/project/{project}/new_task",
+     None, None, 302, 2),
+    ("main.tasks", "user1", "GET", "/tasks", None, None, 200, 5),
+    ("main.tasks?q", "user2", "GET", "/tasks?q=отчёт&status=todo", None, None, 200, 5),
+    ("main.new_task", "user1", "POST", "/task/new", None,
+     {"title": "Новая", "project_id": "{project}", "assignees": "{free}"}, 302, 15),
+    ("main.view_task", "user2", "GET", "/task/{task}", None, None, 200, 6),
+    ("main.edit_task", "user1", "POST", "/task/{task}/edit", None,
+     {"title": "Изменена", "project_id": "{project}", "assignees": "{free}"}, 302, 14),
+    ("main.complete_task", "user2", "POST", "/task/{task}/complete", None, None, 302, 13),
+    ("main.mark_task_done", "user2", "POST", "/task/{in_progress}/mark_done",
+     None, None, 302, 11),
+    ("main.approve_task", "user1", "POST", "/task/{review}/approve", None, None, 302, 13),
+    ("main.delete_task", "user1", "POST", "/task/{task}/delete", None, None, 302, 19),
+    ("main.add_comment", "user2", "POST", "/task/{task}/comment",
+     None, {"content": "Готово"}, 302, 7),
+    ("main.delete_comment", "user1", "POST", "/comment/{comment}/delete", None, None, 302, 9),
+    ("main.add_subtask", "user1", "POST", "/task/{task}/subtask",
+     None, {"title": "Ещё одна"}, 302, 7),
+    ("main.toggle_subtask", "user1", "POST", "/subtask/{subtask}/toggle", None, None, 302, 8),
+    ("main.delete_subtask", "user1", "POST", "/subtask/{subtask}/delete", None, None, 302, 9),
+    ("main.admin", "admin", "GET", "/admin", None, None, 200, 2),
+    ("main.download_profile", "admin", "GET", "/admin/profiles/1-1-1.pstats",
+     None, None, 404, 1),
+    ("main.set_user_access_level", "admin", "POST", "/admin/user/{worker}/set_level",
+     None, {"level": "1"}, 302, 4),
+]
+
+
+def substitute(value, ids):
+    if isinstance(value, dict):
+        return {k: substitute(v, ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [substitute(v, ids) for v in value]
+    if isinstance(value, str) and value.startswith("{") and value.endswith("}"):
+        return ids[value[1:-1]]
+    return value
+
+
+def run_case(app, client, case, size):
+    name, username, method, url, json_body, form, status, budget = case
+    with app.app_context():
+        ids = add_data(size)
+    kwargs = {}
+    if json_body is not None:
+        kwargs["json"] = substitute(json_body, ids)
+    if form is not None:
+        kwargs["data"] = substitute(form, ids)
+    with app.app_context():
+        with count_queries(db.engine) as log:
+            rv = client.open(url.format(**ids), method=method, **kwargs)
+            rv.get_data()  # потоковые ответы выполняют запросы при чтении тела
+    assert rv.status_code == status, f"{name}: {rv.status_code} {rv.get_data(as_text=True)[:200]}"
+    return log
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case[0] for case in CASES])
+def test_query_budget(app, case):
+    name, username, budget = case[0], case[1], case[-1]
+    client = app.test_client()
+    client.post("/login", data={"username": username, "password": PASSWORDS[username]})
+    small = run_case(app, client, case, SMALL)
+    large = run_case(app, client, case, LARGE)
+    assert_constant_queries(small, large, name)
+    assert_query_budget(large, budget, name)
+
+
+def test_budget_failure_lists_statements(app):
+    with app.app_context():
+        with count_queries(db.engine) as log:
+            for user_id in (1, 2, 3):
+                db.session.execute(select(User).where(User.id == user_id)).all()
+        with pytest.raises(AssertionError) as e:
+            assert_query_budget(log, 1, "users")
+    message = str(e.value)
+    assert "users: 3 SQL при бюджете 1" in message
+    assert "3. SELECT user.id" in message
+    assert "N+1: 3x SELECT user.id" in message
@@ -0,0 +1,103 @@
+from sqlalchemy import select, text
+
+from app import create_app, db
+from app.counters import repair_counters
+from app.models import Comment, Subtask, Task, User, task_assignees
+from app.project_stats import rebuild_project_stats
+from seed_db import generate
+
+
+def make_app(path):
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}",
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        "PASSWORD_HASH_WORKERS": 0,
+        "USER_CACHE_VERSION_FILE": str(path.with_suffix(".version")),
+        "TASK_LIST_CACHE_DIR": str(path.with_suffix(".task-lists")),
+        "METRICS_ENABLED": False,
+        "PROFILE_DIR": str(path.with_suffix(".profiles")),
+        "WTF_CSRF_ENABLED": False,
+    })
+
+
+def dump(app):
+    with app.app_context():
+        rows = {}
+        for table in (User.__table__, Task.__table__, Comment.__table__, Subtask.__table__, task_assignees):
+            columns = [c for c in table.c if c.name not in ("password_hash", "created_at")]
+            rows[table.name] = db.session.execute(select(*columns).order_by(*table.primary_key)).all()
+        return rows
+
+
+def test_seed_is_deterministic_and_consistent(tmp_path):
+    first, second = make_app(tmp_path / "a.db"), make_app(tmp_path / "b.db")
+    for app in (first, second):
+        with app.app_context():
+            db.create_all()
+            totals = generate(db.engine, tasks=250, seed=7, chunk_size=100)
+    assert totals["tasks"] == 250 and totals["comments"] > 0 and totals["subtasks"] > 0
+    assert dump(first) == dump(second)
+
+    with first.app_context():
+        with db.engine.begin() as conn:
+            assert repair_counters(conn) == 0
+            assert rebuild_project_stats(conn) == []
+            indexed = conn.execute(text("SELECT count(*) FROM task_search")).scalar()
+            triggers = conn.execute(text("SELECT count(*) FROM sqlite_master WHERE type = 'trigger'")).scalar()
+        assert indexed == 250 and triggers == 6
+        db.engine.dispose()
+    with second.app_context():
+        db.engine.dispose()
+
+
+def test_seed_command(tmp_path):
+    app = make_app(tmp_path / "cli.db")
+    runner = app.test_cli_runner()
+    with app.app_context():
+        db.create_all()
+        result = runner.invoke(args=["seed", "--tasks", "40", "--reset"])
+        assert result.exit_code == 0, result.output
+        assert "задач: 40" in result.output
+        assert runner.invoke(args=["seed", "--tasks", "40"]).exit_code == 1
+
+    client = app.test_client()
+    rv = client.post("/login", data={"username": "worker1", "password": "pass"})
+    assert rv.status_code == 302
+    with app.app_context():
+        db.engine.dispose()
+
+
+def test_seed_restores_search_triggers_after_failure(tmp_path):
+    app = make_app(tmp_path / "fail.db")
+
+    def fail(n):
+        raise RuntimeError("прервано")
+
+    with app.app_context():
+        db.create_all()
+        try:
+            generate(db.engine, tasks=20, chunk_size=10, progress=fail)
+        except RuntimeError:
+            pass
+        with db.engine.connect() as conn:
+            triggers = conn.execute(text("SELECT count(*) FROM sqlite_master WHERE type = 'trigger'")).scalar()
+        assert triggers == 6
+        db.engine.dispose()
+
+
+def test_seed_leaves_ids_for_orm_inserts(tmp_path):
+    app = make_app(tmp_path / "ids.db")
+    with app.app_context():
+        db.create_all()
+        generate(db.engine, tasks=20, users=9, managers=3)
+        usernames = set(db.session.scalars(select(User.username)))
+        assert {"admin", "manager1", "manager3", "worker1", "worker5"} <= usernames
+        assert "manager4" not in usernames and "worker6" not in usernames
+
+        user = User(username="new", access_level=2)
+        user.set_password("pass")
+        db.session.add(user)
+        db.session.add(Task(title="После загрузки", user_id=1))
+        db.session.commit()
+        assert user.id == 10
+        db.engine.dispose()
@@ -0,0 +1,59 @@
+import logging
+
+from app import create_app, db
+from app.models import Task, User
+from app.sql_profiling import QueryLog, statement_shape
+
+
+def test_statement_shape_ignores_in_list_length():
+    assert statement_shape("SELECT id FROM task\n  WHERE id IN (?, ?, ?)") == \
+        statement_shape("SELECT id FROM task WHERE id IN (?)")
+
+
+def test_query_log_detects_repeated_statements():
+    log = QueryLog()
+    for user_id in range(6):
+        log.record("SELECT * FROM user WHERE id = ?", (user_id,), 0.001)
+    for _ in range(6):
+        log.record("SELECT count(*) FROM task", (), 0.001)
+    assert log.count == 12
+    # Один и тот же запрос с одинаковыми параметрами — не N+1.
+    assert log.repeated(5) == [("SELECT * FROM user WHERE id = ?", 6)]
+    assert "N+1: 6x SELECT * FROM user WHERE id = ?" in log.report(5)
+
+
+def test_slow_requests_are_logged_with_server_timing(tmp_path, caplog):
+    app = create_app({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'profile.db'}",
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        "PASSWORD_HASH_WORKERS": 0,
+        "SQL_PROFILING": True,
+        "SQL_SLOW_REQUEST_QUERIES": 1,
+        "USER_CACHE_VERSION_FILE": str(tmp_path / "users.version"),
+        "TASK_LIST_CACHE_DIR": str(tmp_path / "task-lists"),
+        "METRICS_ENABLED": False,
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+    })
+    with app.app_context():
+        db.create_all()
+        user = User(username="user1", access_level=1)
+        user.set_password("pass1")
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Task(title="Task", user_id=user.id))
+        db.session.commit()
+
+    client = app.test_client()
+    client.post("/login", data={"username": "user1", "password": "pass1"})
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        rv = client.get("/api/tasks")
+    timings = rv.headers.getlist("Server-Timing")
+    assert timings[0].startswith("db;dur=") and "queries" in timings[0]
+    assert timings[1].startswith("app;dur=")
+    assert "Slow request GET /api/tasks" in caplog.text
+    assert "1. " in caplog.text and "FROM task" in caplog.text
+
+    with app.app_context():
+        db.engine.dispose()